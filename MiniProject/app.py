@@ -1,30 +1,115 @@
 # ------------------ app.py (fixed) ------------------
-from flask import Flask, request, jsonify, render_template, session, redirect
+from flask import Flask, request, jsonify, render_template, session, redirect, Response, send_file, abort
+from werkzeug.security import safe_join
 from flask_cors import CORS
 from bson.objectid import ObjectId
-from datetime import datetime, timedelta, timezone
-import bcrypt
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from datetime import datetime, timedelta
+import mimetypes
 import os
-from flask_pymongo import PyMongo
-from pymongo import ReturnDocument
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import assets
+import streaming
+import images as image_store
+from realtime import broker, crop_topic, sse_stream
+from scheduler import scheduler
+from cleanup import cleanup
+from metrics import metrics, METRICS_ENABLED
+from database import close_client, get_client
+from cache import catalog_cache
+from passwords import hasher, PoolSaturated
+from models import ModelError, User, WishlistItem
 
 # Import CRUD functions from your module
 from crud import (
-    get_user_by_email, create_user, get_crops, create_crop,
-    update_crop, delete_crop, get_crop, get_highest_bid,
-    place_bid as crud_place_bid, get_auction_winner, db,
-    get_user_by_id, update_user, get_won_crops_for_user, add_won_crop,
-    determine_and_set_winner, send_message, get_messages_for_crop, delete_won_crop
+    get_user_by_email, create_user, get_crops_page, build_crop_query, geo_point,
+    create_crop, update_crop, delete_crop, get_crop,
+    place_bid as crud_place_bid, get_current_bid, get_current_bids, CURRENT_BID_FIELDS,
+    get_auction_winner, db,
+    get_user_by_id, update_user, get_won_crops_for_user, save_won_crop as crud_save_won_crop,
+    send_message, get_messages_for_crop, delete_won_crop,
+    get_wishlist_page, get_usernames,
+    BID_ACCEPTED, BID_CLOSED, BID_NOT_FOUND, BID_TOO_LOW, CLOSED_STATUSES,
+    auction_end_time, close_auctions, ensure_indexes
 )
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
 app.secret_key = os.environ.get("SECRET_KEY", "dev-secret-key")
 CORS(app, supports_credentials=True)
+# whole request body (all images of one upload); werkzeug answers 413 early
+app.config["MAX_CONTENT_LENGTH"] = int(os.getenv("MAX_UPLOAD_BYTES", str(32 * 1024 * 1024)))
+
+# MongoDB access goes through crud/database.py: one lazily created,
+# fork-safe client per process (see database.py for pool settings).
+
+# Mongo commands per route, latency histograms and the N+1 warning;
+# exported at /metrics (see metrics.py)
+if METRICS_ENABLED:
+    metrics.init_app(app)
+
+
+# -------------------- STATIC & MEDIA --------------------
+# Media URLs are content hashed, static URLs get ?v=<content hash> from
+# url_for, so both can be cached as immutable. send_file goes through
+# wsgi.file_wrapper (sendfile(2) under gunicorn) and handles ETag,
+# If-None-Match and Range. Behind nginx set MEDIA_ACCEL_PREFIX to an
+# internal location aliasing MEDIA_ROOT and the file is sent by nginx.
+MEDIA_ACCEL_PREFIX = os.getenv("MEDIA_ACCEL_PREFIX", "").rstrip("/")
+app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE") == "1"
+
+
+@app.url_defaults
+def fingerprint_static(endpoint, values):
+    if endpoint == "static" and "filename" in values and "v" not in values:
+        version = assets.asset_version(os.path.join(app.static_folder, values["filename"]))
+        if version:
+            values["v"] = version
+
+
+def serve_static(filename):
+    path = safe_join(app.static_folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    served, encoding = assets.precompressed(path, request.headers.get("Accept-Encoding"))
+    resp = send_file(served, mimetype=mimetypes.guess_type(path)[0] or "application/octet-stream",
+                     conditional=True)
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    if path.endswith(assets.COMPRESSIBLE):
+        resp.vary.add("Accept-Encoding")
+    if request.args.get("v"):
+        resp.headers["Cache-Control"] = assets.IMMUTABLE
+    return resp
+
+
+app.view_functions["static"] = serve_static
+
+
+@app.route(image_store.MEDIA_URL + "/<path:name>", methods=["GET"])
+def serve_media(name):
+    path, immutable = image_store.resolve_media(name)
+    if path is None:
+        abort(404)
+    if MEDIA_ACCEL_PREFIX:
+        resp = Response(mimetype=mimetypes.guess_type(path)[0])
+        rel = os.path.relpath(path, image_store.MEDIA_ROOT).replace(os.sep, "/")
+        resp.headers["X-Accel-Redirect"] = f"{MEDIA_ACCEL_PREFIX}/{rel}"
+    else:
+        # the file name is the content hash, so it is the ETag
+        etag = os.path.splitext(os.path.basename(path))[0]
+        resp = send_file(path, conditional=True, etag=etag)
+    # a thumbnail still rendering falls back to the original: revalidate it
+    resp.headers["Cache-Control"] = assets.IMMUTABLE if immutable else "no-cache"
+    return resp
+
 
-mongo = PyMongo()
-app.config["MONGO_URI"] = os.environ.get("MONGO_URI", "mongodb://localhost:27017/crop_connect")
-mongo.init_app(app)
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({"error": "Upload too large"}), 413
 
 
 # Basic routes
@@ -64,14 +149,19 @@ def register_api():
         return jsonify({"error": "Missing required fields"}), 400
     if get_user_by_email(data["email"]):
         return jsonify({"error": "Email already exists"}), 400
-    hashed_pw = bcrypt.hashpw(data["password"].encode(), bcrypt.gensalt())
-    user = {
-        "username": data["username"],
-        "email": data["email"],
-        "password": hashed_pw,
-        "role": data.get("role", "bidder")
-    }
-    create_user(user)
+    try:
+        hashed_pw = hasher.hash(data["password"])
+    except PoolSaturated:
+        return _busy_response()
+    try:
+        user = User(username=data["username"], email=data["email"],
+                    password=hashed_pw, role=data.get("role"))
+    except ModelError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        create_user(user.to_bson())
+    except DuplicateKeyError:  # lost a race against the unique email index
+        return jsonify({"error": "Email already exists"}), 400
     return jsonify({"message": "User registered successfully"}), 201
 
 
@@ -81,8 +171,16 @@ def login_api():
     if not data or not all(k in data for k in ("email", "password")):
         return jsonify({"error": "Missing credentials"}), 400
     user = get_user_by_email(data["email"])
-    if not user or not bcrypt.checkpw(data["password"].encode(), user["password"]):
+    try:
+        valid = bool(user) and hasher.check(data["password"], user.get("password"))
+    except PoolSaturated:
+        return _busy_response()
+    if not valid:
         return jsonify({"error": "Invalid credentials"}), 400
+    if hasher.needs_rehash(user["password"]):
+        # stored cost is outdated (BCRYPT_ROUNDS changed): upgrade it quietly
+        user_id = str(user["_id"])
+        hasher.rehash_later(data["password"], lambda new_hash: update_user(user_id, {"password": new_hash}))
     session["logged_in_user"] = {
         "id": str(user["_id"]),
         "username": user.get("username"),
@@ -100,6 +198,12 @@ def login_api():
     }), 200
 
 
+def _busy_response():
+    resp = jsonify({"error": "Server busy, please retry"})
+    resp.headers["Retry-After"] = "1"
+    return resp, 429
+
+
 @app.route("/api/auth/logout", methods=["POST"])
 def logout_api():
     session.pop("logged_in_user", None)
@@ -152,12 +256,13 @@ def update_profile():
     if "profile_picture" in request.files:
         file = request.files["profile_picture"]
         if file and file.filename:
-            upload_folder = os.path.join(app.static_folder, "profile_pics")
-            os.makedirs(upload_folder, exist_ok=True)
-            filepath = os.path.join(upload_folder, file.filename)
-            file.save(filepath)
-            upload_path = "/" + os.path.relpath(filepath, start=".").replace("\\", "/")
-            update_fields["profile_picture"] = upload_path
+            try:
+                stored = image_store.store_upload(file)
+            except image_store.ImageTooLarge as e:
+                return jsonify({"error": str(e)}), 413
+            except image_store.ImageError as e:
+                return jsonify({"error": str(e)}), 400
+            update_fields["profile_picture"] = stored["url"]
 
     success = update_user(user["id"], update_fields)
     if not success:
@@ -174,47 +279,176 @@ def update_profile():
 
 # Helper to check if string is data URL
 def _is_data_url(s: str):
-    return isinstance(s, str) and s.startswith("data:")
+    return image_store.is_data_url(s)
+
+
+def _store_request_images(data):
+    """
+    Decode data URL images (JSON) or multipart cropImages/cropImage uploads
+    into the image store. Returns the list of stored images (may be empty).
+    """
+    stored = []
+    if request.is_json:
+        raw = data.get("images")
+        if isinstance(raw, str):
+            raw = [raw]
+        for img in raw or []:
+            if _is_data_url(img):
+                stored.append(image_store.store_data_url(img))
+    else:
+        files = request.files.getlist("cropImages") or [request.files.get("cropImage")]
+        for f in files:
+            if f and f.filename != "":
+                stored.append(image_store.store_upload(f))
+    return stored
+
+
+def _parse_bool_arg(value):
+    if value is None or value == "":
+        return None
+    return value.lower() in ("1", "true", "yes")
 
 
-# List crops API filtering by status and expiration
+def _parse_float_arg(value, name):
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}")
+
+
+def _parse_near_arg(value):
+    if value is None or value == "":
+        return None
+    try:
+        lat, lon = (float(v) for v in value.split(","))
+    except ValueError:
+        raise ValueError("Invalid near, expected <lat>,<lon>")
+    geo_point(lat, lon)  # range check
+    return lat, lon
+
+
+def near_unavailable(e):
+    """
+    Body for a distance search MongoDB refused, typically because the geo
+    index (crud.ensure_indexes()) is missing or still building; sent as 503.
+    """
+    app.logger.warning("near search failed: %s", e)
+    return {"error": "Distance search is unavailable right now"}
+
+
+# List crops API: keyset paginated, filtered and projected server side.
+# Query params: status, sold, location, name (substrings), type, farmer_id,
+# min_price, max_price, fields (comma separated), limit, cursor, include_bids (adds "highest_bid":
+# {bid_price, bidder_id, bidder_email} or null per row), near=<lat>,<lon> with
+# within=<km> (default crud.NEAR_DEFAULT_KM): only crops placed within that
+# distance, nearest first, each with distance_km (503 when MongoDB cannot run
+# it). The body stays a flat array; the cursor for the next page is returned
+# in the X-Next-Cursor header.
 @app.route("/api/crops", methods=["GET"])
 def list_crops():
+    args = request.args
+    ndjson = streaming.wants_ndjson(request)
+    cache_key = catalog_cache_key(args, ndjson)
+    cached = catalog_cache.get_response(cache_key)
+    if cached is not None:
+        return _cached_json_response(cached)
     try:
-        crops = get_crops()  # fetch all crops from DB
-        result = []
+        page = CatalogPage(args)
+        crops, next_cursor = get_crops_page(page.query, cursor=page.cursor, limit=page.limit,
+                                            fields=page.query_fields, near=page.near,
+                                            within_km=page.within_km)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except OperationFailure as e:
+        if page.near is None:
+            raise
+        return jsonify(near_unavailable(e)), 503
 
-        for c in crops:
-            c["_id"] = str(c["_id"])
-            c["sold"] = bool(c.get("sold", False)) or (c.get("status", "").lower() == "closed")
-            c["farmer_name"] = c.get("farmer_name") or c.get("farmer") or "Unknown Farmer"
-            c["farmer_id"] = c.get("farmer_id") or c.get("farmer") or ""
-            c["buyer_name"] = c.get("buyer_name") or "Unknown"
-
-            if "images" not in c or not isinstance(c["images"], list):
-                c["images"] = [c["image"]] if c.get("image") else []
-
-            # ensure datetime is ISO string
-            crop_time = c.get("datetime")
-            if isinstance(crop_time, str):
-                try:
-                    crop_time = datetime.fromisoformat(crop_time)
-                except Exception:
-                    crop_time = datetime.now(timezone.utc)
-            if isinstance(crop_time, datetime) and crop_time.tzinfo is None:
-                crop_time = crop_time.replace(tzinfo=timezone.utc)
-            c["datetime"] = crop_time.isoformat()
-
-            result.append(c)
-
-        # always return flat array — farmer portal expects this
-        return jsonify(result), 200
+    try:
+        if page.include_bids:
+            page.add_bids(crops, get_current_bids([c["_id"] for c in crops], crops=crops))
+        # documents are normalized on write and go out as stored; a page is
+        # bounded and cached whole, so it is encoded in one go
+        body = streaming.encode_body(crops, ndjson)
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        entry = catalog_cache.put_response(cache_key, body.decode(), headers)
+        return _cached_json_response(entry, streaming.content_type(ndjson))
 
     except Exception as e:
-        print("🔥 Error in list_crops:", e)
+        app.logger.exception("list_crops failed")
         return jsonify({"error": str(e)}), 500
 
 
+def catalog_cache_key(args, ndjson):
+    return catalog_cache.list_key([*args.items(multi=True), ("format", "ndjson" if ndjson else "json")])
+
+
+class CatalogPage:
+    """
+    The /api/crops query parameters, parsed once; shared with the async API
+    (asgi.py). `args` is a werkzeug MultiDict. Raises ValueError.
+    """
+
+    def __init__(self, args):
+        self.query = build_crop_query(
+            status=args.get("status"),
+            sold=_parse_bool_arg(args.get("sold")),
+            location=args.get("location", "").strip() or None,
+            name=args.get("name", "").strip() or None,
+            crop_type=args.get("type"),
+            farmer_id=args.get("farmer_id"),
+            min_price=_parse_float_arg(args.get("min_price"), "min_price"),
+            max_price=_parse_float_arg(args.get("max_price"), "max_price"),
+        )
+        self.fields = [f.strip() for f in args.get("fields", "").split(",") if f.strip()] or None
+        self.include_bids = _parse_bool_arg(args.get("include_bids"))
+        self.query_fields = self.fields + list(CURRENT_BID_FIELDS) if self.fields and self.include_bids \
+            else self.fields
+        self.limit = args.get("limit", type=int)
+        self.cursor = args.get("cursor")
+        self.near = _parse_near_arg(args.get("near"))
+        self.within_km = _parse_float_arg(args.get("within"), "within")
+        if self.within_km is not None and self.near is None:
+            raise ValueError("within needs near")
+
+    def add_bids(self, crops, bids):
+        """
+        Fold {crop_id: bid} into the rows as highest_bid, dropping the bid
+        fields that were only fetched for it.
+        """
+        extras = set(self.query_fields or ()) - set(self.fields or ())
+        for c in crops:
+            c["highest_bid"] = bids[str(c["_id"])]
+            for extra in extras:
+                c.pop(extra, None)
+
+
+# Single crop, served from the same cache as the catalog.
+@app.route("/api/get_crop/<crop_id>", methods=["GET"])
+def get_crop_api(crop_id):
+    cache_key = catalog_cache.item_key(crop_id)
+    cached = catalog_cache.get_response(cache_key)
+    if cached is None:
+        crop = get_crop(crop_id)
+        if not crop:
+            return jsonify({"error": "Crop not found"}), 404
+        cached = catalog_cache.put_response(cache_key, streaming.dumps(crop).decode())
+    return _cached_json_response(cached)
+
+
+def _cached_json_response(entry, mimetype="application/json"):
+    """
+    Response for a cached body. Clients revalidate every time (no-cache) and
+    get a bodyless 304 when their If-None-Match still matches.
+    """
+    resp = Response(entry.body, mimetype=mimetype, headers=entry.headers)
+    resp.headers["ETag"] = entry.etag
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp.make_conditional(request)
+
+
 # Add crop API: handle files, data URLs, session farmer info
 @app.route("/api/crops", methods=["POST"])
 def add_crop():
@@ -230,50 +464,24 @@ def add_crop():
         data["farmer_name"] = user.get("username")
         data["farmer_email"] = user.get("email")
 
-    # Convert numeric fields
-    for key in ["price", "quantity"]:
-        if key in data and data[key] != "":
-            try:
-                data[key] = float(data[key])
-            except Exception:
-                data[key] = 0.0
-
-    # Ensure datetime
-    if data.get("datetime"):
-        try:
-            datetime.fromisoformat(data["datetime"])
-        except Exception:
-            data["datetime"] = datetime.utcnow().isoformat()
-    else:
-        data["datetime"] = datetime.utcnow().isoformat()
-
-    data["location"] = data.get("location", "").strip() or "Not specified"
+    # numbers, datetime, location and defaults are normalized by create_crop()
 
-    # Handle images
-    images = []
-    if request.is_json and data.get("images"):
-        if isinstance(data["images"], list):
-            images = [img for img in data["images"] if _is_data_url(img)]
-        elif _is_data_url(data["images"]):
-            images.append(data["images"])
-    else:
-        upload_folder = os.path.join(app.static_folder, "uploads")
-        os.makedirs(upload_folder, exist_ok=True)
-        files = request.files.getlist("cropImages") or [request.files.get("cropImage")]
-        for f in files:
-            if f and f.filename != "":
-                path = os.path.join(upload_folder, f.filename)
-                f.save(path)
-                images.append("/" + os.path.relpath(path, start=".").replace("\\", "/"))
-    if not images:
-        images = ["/static/default_crop.jpg"]
-
-    data["image"] = images[0]
-    data["images"] = images
+    # Handle images: stored once, only URLs end up on the crop
+    try:
+        stored = _store_request_images(data)
+    except image_store.ImageTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except image_store.ImageError as e:
+        return jsonify({"error": str(e)}), 400
+    data.update(image_store.image_fields(stored))
     data["status"] = "Available"
     data["sold"] = False  # ✅ Explicitly mark new crop as unsold
 
-    result = create_crop(data)
+    try:
+        result = create_crop(data)
+    except ModelError as e:
+        return jsonify({"error": str(e)}), 400
+    scheduler.schedule(result.inserted_id, auction_end_time(data))
     return jsonify({"message": "Crop added successfully", "id": str(result.inserted_id)}), 201
 
 
@@ -288,37 +496,24 @@ def edit_crop(crop_id):
     if not data:
         return jsonify({"error": "Invalid data"}), 400
 
-    for key in ["price", "quantity"]:
-        if key in data and data[key] != "":
-            try:
-                data[key] = float(data[key])
-            except Exception:
-                pass
-
-    data["location"] = data.get("location", "").strip() or "Not specified"
-
-    new_images = []
-    if request.is_json and data.get("images"):
-        if isinstance(data["images"], list):
-            new_images = [img for img in data["images"] if _is_data_url(img)]
-    else:
-        files = request.files.getlist("cropImages")
-        if not files:
-            single = request.files.get("cropImage")
-            if single:
-                files = [single]
-
-        upload_folder = os.path.join(app.static_folder, "uploads")
-        os.makedirs(upload_folder, exist_ok=True)
-        for f in files:
-            if f and f.filename != "":
-                path = os.path.join(upload_folder, f.filename)
-                f.save(path)
-                new_images.append("/" + os.path.relpath(path, start=".").replace("\\", "/"))
-
-    if new_images:
-        data["images"] = new_images
-        data["image"] = new_images[0]
+    # fields are normalized by update_crop() (prepare_crop(partial=True)):
+    # only what the request sends is touched
+    try:
+        stored = _store_request_images(data)
+    except image_store.ImageTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except image_store.ImageError as e:
+        return jsonify({"error": str(e)}), 400
+    # JSON clients may resend already stored image URLs alongside new data URLs
+    kept = []
+    if request.is_json and isinstance(data.get("images"), list):
+        kept = [image_store.describe_url(img) for img in data["images"]
+                if isinstance(img, str) and img and not _is_data_url(img)]
+    # never persist raw payloads; keep existing images unless new ones arrived
+    data.pop("images", None)
+    data.pop("image", None)
+    if kept or stored:
+        data.update(image_store.image_fields(kept + stored))
 
     # preserve farmer info if logged in as farmer (session)
     user = session.get("logged_in_user")
@@ -328,15 +523,20 @@ def edit_crop(crop_id):
             data["farmer_name"] = user.get("username")
             data["farmer_email"] = user.get("email")
 
-    result = update_crop(crop_id, data)
+    try:
+        result = update_crop(crop_id, data)
+    except ModelError as e:
+        return jsonify({"error": str(e)}), 400
     if getattr(result, "modified_count", 0) == 0:
         existing = get_crop(crop_id)
         if not existing:
             return jsonify({"error": "Crop not found"}), 404
+    if data.get("datetime"):
+        scheduler.schedule(crop_id, auction_end_time(data))
     return jsonify({"message": "Crop updated"}), 200
 
 
-# Delete crop API with cascade cleanup (attempt best-effort)
+# Delete crop API: soft delete, dependents are purged in the background (cleanup.py)
 @app.route("/api/crops/<crop_id>", methods=["DELETE"])
 def remove_crop(crop_id):
     try:
@@ -344,22 +544,11 @@ def remove_crop(crop_id):
     except Exception:
         return jsonify({"error": "Invalid crop ID"}), 400
 
-    try:
-        db.messages.delete_many({"crop_id": crop_oid})
-    except Exception:
-        pass
-    try:
-        db.bids.delete_many({"crop_id": crop_oid})
-    except Exception:
-        pass
-    try:
-        db.wishlist.delete_many({"crop_id": crop_oid})
-    except Exception:
-        pass
-
-    result = delete_crop(crop_id)
+    # bids, messages, wishlist entries and images go in the background
+    result = delete_crop(crop_oid)
     if not result or getattr(result, "deleted_count", 0) == 0:
         return jsonify({"error": "Crop not found"}), 404
+    cleanup.wake()
     return jsonify({"message": "Crop deleted"}), 200
 
 
@@ -372,28 +561,8 @@ def get_won_crops():
     if not user:
         return jsonify([])  # no user logged in
 
-    user_id = user["id"]
-
-    # Fetch won crops for this user
-    won_entries = list(db.won_crops.find({"user_id": user_id}))
-
-    result = []
-    for entry in won_entries:
-        crop = db.crops.find_one({"_id": ObjectId(entry["crop_id"])})
-        if crop:
-            entry["crop"] = {
-                "_id": str(crop["_id"]),
-                "name": crop.get("name", "Unnamed"),
-                "quantity": crop.get("quantity", "-"),
-                "quality": crop.get("quality", "-"),
-                "image": crop.get("image", "/static/default_crop.jpg"),
-                "location": crop.get("location", "Unknown"),
-                "datetime": crop.get("datetime"),
-                "farmer_name": crop.get("farmer_name") or crop.get("farmer") or "Unknown Farmer"  # <-- added
-            }
-        result.append(entry)
-
-    return jsonify(result)
+    # one won_crops query + one $in query on crops, projected to what the portal renders
+    return streaming.stream_response(request, get_won_crops_for_user(user["id"]))
 
 # ------ DELETE WON CROP ---------------
 @app.route("/api/delete_won_bid/<crop_id>", methods=["DELETE"])
@@ -425,18 +594,10 @@ def save_won_crop():
         return jsonify({"error": "Missing fields"}), 400
 
     try:
-        db.won_crops.update_one(
-            {"user_id": user_id, "crop_id": crop_id},
-            {"$set": {
-                "user_id": user_id,
-                "crop_id": crop_id,
-                "farmer_id": farmer_id,
-                "bid_price": bid_price,
-                "datetime": datetime.utcnow()
-            }},
-            upsert=True
-        )
+        crud_save_won_crop(user_id, crop_id, bid_price, farmer_id=farmer_id)
         return jsonify({"success": True})
+    except ModelError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -453,33 +614,30 @@ def place_bid():
         return jsonify({"error": "Missing fields"}), 400
 
     try:
-        crop_obj_id = ObjectId(crop_id)
-
-        crop = db.crops.find_one({"_id": crop_obj_id})
-        if not crop:
+        # single compare-and-set on the crop; no read before the write
+        outcome = crud_place_bid({
+            "crop_id": crop_id,
+            "bidder_id": bidder_id,
+            "bidder_email": bidder_email,
+            "bid_price": bid_price,
+        })
+        status = outcome["status"]
+        if status == BID_NOT_FOUND:
             return jsonify({"error": "Crop not found"}), 404
-
-        if crop.get("status", "").lower() in ["closed", "sold"]:
+        if status == BID_CLOSED:
             return jsonify({"error": "Bidding closed for this crop"}), 400
-
-        # Get existing highest bid
-        existing_bid = db.bids.find_one({"crop_id": crop_id})
-        if existing_bid and bid_price <= existing_bid["bid_price"]:
-            return jsonify({"error": f"Bid must be higher than current ₹{existing_bid['bid_price']}"}), 400
-
-        # Save/update bid
-        db.bids.update_one(
-            {"crop_id": crop_id},
-            {"$set": {
-                "bidder_id": bidder_id,
-                "bidder_email": bidder_email,
-                "bid_price": bid_price,
-                "datetime": datetime.utcnow()
-            }},
-            upsert=True
-        )
-
-        return jsonify({"success": True, "current_bid": bid_price})
+        if status == BID_TOO_LOW:
+            return jsonify({"error": f"Bid must be higher than current ₹{outcome['current_bid']}"}), 400
+        if status != BID_ACCEPTED:
+            return jsonify({"error": "Invalid bid"}), 400
+
+        broker.publish(crop_topic(crop_id), "bid", {
+            "crop_id": crop_id,
+            "bid_price": outcome["current_bid"],
+            "bidder_id": bidder_id,
+            "bidder_email": bidder_email,
+        })
+        return jsonify({"success": True, "current_bid": outcome["current_bid"]})
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -489,7 +647,7 @@ def place_bid():
 @app.route("/api/current_bid/<crop_id>", methods=["GET"])
 def current_bid(crop_id):
     try:
-        bid = db.bids.find_one({"crop_id": crop_id})
+        bid = get_current_bid(crop_id)
         if not bid:
             return jsonify({"current_bid": None})
         return jsonify({
@@ -501,41 +659,38 @@ def current_bid(crop_id):
         return jsonify({"error": str(e)}), 500
 
 
+# Current bids for many crops in one call: ?ids=<id>,<id>,...
+# Returns {crop_id: {bid_price, bidder_email, bidder_id} or null}.
+CURRENT_BIDS_MAX = 500
 
 
+@app.route("/api/current_bids", methods=["GET"])
+def current_bids():
+    ids = [i.strip() for i in request.args.get("ids", "").split(",") if i.strip()]
+    if not ids:
+        return jsonify({"error": "ids is required"}), 400
+    if len(ids) > CURRENT_BIDS_MAX:
+        return jsonify({"error": f"At most {CURRENT_BIDS_MAX} ids per request"}), 400
+    try:
+        return Response(streaming.dumps(get_current_bids(ids)), mimetype="application/json")
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 
 # Wishlist APIs
-# Retrieve wishlist for a user with populated crop details
+# Retrieve a page of a user's wishlist with populated crop details.
+# Query params: page (1-based), limit. Total row count is returned in
+# X-Total-Count; the body stays a flat array.
 @app.route("/api/wishlist/<user_id>", methods=["GET"])
 def get_wishlist(user_id):
+    page = request.args.get("page", 1, type=int)
+    limit = request.args.get("limit", type=int)
     try:
-        user_obj_id = ObjectId(user_id)
-    except Exception:
-        return jsonify({"error": "Invalid user ID"}), 400
-
-    # Find wishlist items by user
-    wishlist_items = list(db.wishlist.find({"user_id": user_obj_id}))
-
-    # For each wishlist item, add crop details for convenience
-    enriched_wishlist = []
-    for item in wishlist_items:
-        crop_id_obj = item.get("crop_id")
-        crop_details = None
-        if crop_id_obj:
-            crop = db.crops.find_one({"_id": crop_id_obj})
-            if crop:
-                crop["_id"] = str(crop["_id"])
-                crop_details = crop
-
-        enriched_wishlist.append({
-            "_id": str(item["_id"]),
-            "crop_id": str(item["crop_id"]),
-            "user_id": str(item["user_id"]),
-            "added_at": item.get("added_at"),
-            "crop": crop_details,
-        })
+        items, total = get_wishlist_page(user_id, page=page, limit=limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    return jsonify(enriched_wishlist), 200
+    return streaming.stream_response(request, items, headers={"X-Total-Count": str(total)})
 
 
 # Add item to wishlist safely
@@ -546,24 +701,15 @@ def add_to_wishlist():
         return jsonify({"error": "Missing wishlist data"}), 400
 
     try:
-        user_obj_id = ObjectId(data["user_id"])
-        crop_obj_id = ObjectId(data["crop_id"])
-    except Exception:
+        item = WishlistItem(user_id=data.get("user_id"), crop_id=data.get("crop_id"))
+    except ModelError:
         return jsonify({"error": "Invalid user_id or crop_id"}), 400
 
-    exists = db.wishlist.find_one({
-        "user_id": user_obj_id,
-        "crop_id": crop_obj_id
-    })
-
-    if exists:
+    # the unique (user_id, crop_id) index rejects duplicates atomically
+    try:
+        item.insert(db)
+    except DuplicateKeyError:
         return jsonify({"error": "Already in wishlist"}), 400
-
-    db.wishlist.insert_one({
-        "user_id": user_obj_id,
-        "crop_id": crop_obj_id,
-        "added_at": datetime.utcnow()
-    })
     return jsonify({"message": "Added to wishlist"}), 201
 
 
@@ -591,49 +737,41 @@ def remove_from_wishlist():
     return jsonify({"message": "Removed from wishlist"}), 200
 
 
-# Auction winner API - will determine winner if not already set
+# Auction winner API - a read. Auctions are closed by the background
+# scheduler; if it has not got to this one yet (or is disabled) and the
+# auction is due, it is closed here with the same idempotent transition.
 # -------------------- GET AUCTION WINNER --------------------
+AUCTION_CLOSE_GRACE = timedelta(seconds=5)  # tolerate client clock skew
+
+
 @app.route("/api/auction/winner/<crop_id>", methods=["GET"])
 def auction_winner(crop_id):
     try:
         crop_obj_id = ObjectId(crop_id)
-        crop = db.crops.find_one({"_id": crop_obj_id})
+    except Exception:
+        return jsonify({"error": "Invalid crop ID"}), 400
+
+    try:
+        fields = {"status": 1, "sold": 1, "datetime": 1, "winner": 1, "winner_id": 1, "sold_price": 1}
+        crop = db.crops.find_one({"_id": crop_obj_id}, fields)
         if not crop:
             return jsonify({"error": "Crop not found"}), 404
 
-        bid = db.bids.find_one({"crop_id": crop_id})
-        if not bid:
-            return jsonify({"error": "No bids placed yet"}), 404
+        if crop.get("status") not in CLOSED_STATUSES and not crop.get("sold"):
+            ends_at = auction_end_time(crop)
+            if ends_at and ends_at - AUCTION_CLOSE_GRACE > datetime.utcnow():
+                return jsonify({"error": "Auction still open"}), 409
+            for result in close_auctions([crop_id]):
+                broker.publish(crop_topic(crop_id), "auction_closed", result)
+            crop = db.crops.find_one({"_id": crop_obj_id}, fields)
 
-        # Mark crop as sold and closed
-        db.crops.update_one(
-            {"_id": crop_obj_id},
-            {"$set": {
-                "status": "Closed",
-                "sold": True,
-                "winner": bid["bidder_email"],
-                "winner_id": bid["bidder_id"],
-                "sold_price": bid["bid_price"]
-            }}
-        )
-
-        # Save in won_crops collection for bidder portal
-        db.won_crops.update_one(
-            {"user_id": bid["bidder_id"], "crop_id": crop_id},
-            {"$set": {
-                "user_id": bid["bidder_id"],
-                "crop_id": crop_id,
-                "farmer_id": crop.get("farmer_id"),
-                "bid_price": bid["bid_price"],
-                "datetime": datetime.utcnow()
-            }},
-            upsert=True
-        )
+        if not crop.get("winner_id"):
+            return jsonify({"error": "No bids placed yet"}), 404
 
         return jsonify({
-            "user_id": bid["bidder_id"],
-            "bidder_email": bid["bidder_email"],
-            "bid_price": bid["bid_price"]
+            "user_id": crop["winner_id"],
+            "bidder_email": crop.get("winner"),
+            "bid_price": crop.get("sold_price")
         })
 
     except Exception as e:
@@ -642,6 +780,9 @@ def auction_winner(crop_id):
 
 
 # Chat system APIs
+# Query param `since` (timestamp of the newest message the client has)
+# limits the result to messages from a few seconds before it on, so polling
+# clients receive deltas; they drop the repeats by _id.
 @app.route("/api/messages/<crop_id>", methods=["GET"])
 def get_messages(crop_id):
     try:
@@ -649,27 +790,46 @@ def get_messages(crop_id):
     except Exception:
         return jsonify([]), 200
 
-    messages = get_messages_for_crop(crop_id)
-    out = []
+    try:
+        messages = get_messages_for_crop(crop_id, since=request.args.get("since"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return streaming.stream_response(request, _messages_with_names(messages))
+
+
+def _messages_with_names(messages, batch_size=200):
+    """
+    Add sender_name / receiver_name while streaming: one batched (and
+    cached) username lookup per batch of messages.
+    """
+    batch = []
+
+    def flush():
+        names = get_usernames([m.get("sender_id") for m in batch] + [m.get("receiver_id") for m in batch])
+        for msg in batch:
+            yield message_with_names(msg, names)
+        batch.clear()
+
     for msg in messages:
-        msg_obj = {
-            "_id": msg.get("_id"),
-            "crop_id": msg.get("crop_id"),
-            "sender_id": msg.get("sender_id"),
-            "receiver_id": msg.get("receiver_id"),
-            "message": msg.get("message", ""),
-            "timestamp": msg.get("timestamp")
-        }
-        try:
-            sender = db.users.find_one({"_id": ObjectId(msg["sender_id"])})
-            receiver = db.users.find_one({"_id": ObjectId(msg["receiver_id"])})
-            msg_obj["sender_name"] = sender["username"] if sender else "Unknown"
-            msg_obj["receiver_name"] = receiver["username"] if receiver else "Unknown"
-        except Exception:
-            msg_obj["sender_name"] = "Unknown"
-            msg_obj["receiver_name"] = "Unknown"
-        out.append(msg_obj)
-    return jsonify(out), 200
+        batch.append(msg)
+        if len(batch) >= batch_size:
+            yield from flush()
+    if batch:
+        yield from flush()
+
+
+def message_with_names(msg, names):
+    return {
+        "_id": msg.get("_id"),
+        "crop_id": msg.get("crop_id"),
+        "sender_id": msg.get("sender_id"),
+        "receiver_id": msg.get("receiver_id"),
+        "message": msg.get("message", ""),
+        "timestamp": msg.get("timestamp"),
+        "sender_name": names.get(str(msg.get("sender_id")), "Unknown"),
+        "receiver_name": names.get(str(msg.get("receiver_id")), "Unknown"),
+    }
 
 
 @app.route("/api/messages", methods=["POST"])
@@ -679,13 +839,65 @@ def send_message_route():
     if not data or not all(k in data for k in required):
         return jsonify({"error": "Missing required fields"}), 400
     try:
-        send_message(data["crop_id"], data["sender_id"], data["receiver_id"], data["message"].strip())
+        result = send_message(data["crop_id"], data["sender_id"], data["receiver_id"], data["message"].strip())
+        if result is None:
+            return jsonify({"error": "Invalid crop, sender or receiver id"}), 400
+        broker.publish(crop_topic(data["crop_id"]), "message", {
+            "_id": str(result.inserted_id),
+            "crop_id": data["crop_id"],
+            "sender_id": data["sender_id"],
+            "receiver_id": data["receiver_id"],
+            "message": data["message"].strip(),
+            "timestamp": datetime.utcnow().isoformat(),
+        })
         return jsonify({"message": "Message sent"}), 201
     except Exception as e:
-        print("Error:", e)
+        app.logger.exception("send_message failed")
         return jsonify({"error": str(e)}), 400
 
 
+# -------------------- LIVE UPDATES (SSE) --------------------
+# Subscribe to one or more crops: /api/stream?crops=<id>,<id>
+# Events: bid, message, auction_closed. Each carries the changed fields only.
+# In production /api/stream is served by asgi.py, where a stream costs a
+# task. Here every open stream holds a server thread, so a process serves
+# at most SSE_MAX_STREAMS of them and answers 503 beyond that; browsers
+# then fall back to polling.
+STREAM_MAX_TOPICS = 500
+SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", "2"))
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+_stream_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS) if SSE_MAX_STREAMS > 0 else None
+
+
+def stream_crop_ids(args):
+    """
+    Crop ids of a /api/stream request. Raises ValueError when there are none
+    or more than STREAM_MAX_TOPICS.
+    """
+    crop_ids = [c.strip() for c in args.get("crops", "").split(",") if c.strip()]
+    if not crop_ids:
+        raise ValueError("crops parameter required")
+    if len(crop_ids) > STREAM_MAX_TOPICS:
+        raise ValueError(f"At most {STREAM_MAX_TOPICS} crops per stream")
+    return crop_ids
+
+
+@app.route("/api/stream", methods=["GET"])
+def stream():
+    try:
+        crop_ids = stream_crop_ids(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if _stream_slots is None or not _stream_slots.acquire(blocking=False):
+        return jsonify({"error": "Live updates are busy, poll instead"}), 503, {"Retry-After": "30"}
+
+    sub = broker.subscribe(crop_topic(c) for c in crop_ids)
+    response = Response(sse_stream(sub), mimetype="text/event-stream", headers=STREAM_HEADERS)
+    response.call_on_close(sub.close)  # also when the body was never iterated
+    response.call_on_close(_stream_slots.release)
+    return response
+
+
 # Chat page render with permissions
 @app.route("/chat")
 def chat():
@@ -705,44 +917,21 @@ def chat():
     user_id = str(user.get("id"))
     crop_farmer_id = str(crop.get("farmer_id")) if crop.get("farmer_id") else None
 
-    print(f"🔍 DEBUG - User: {user_id}, Crop farmer: {crop_farmer_id}")
-
     role = user.get("role")
     partner_id = None
     partner_name = None
 
-    # ✅ Multiple fallback methods to get winner
-    winner = None
-    winner_user_id = None
-
-    # Method 1: Try get_auction_winner
-    if 'get_auction_winner' in globals():
-        winner = get_auction_winner(crop_id)
+    # The crop document carries the winner: winner_id once the auction is
+    # closed, the current high bidder before that. Crops from before the
+    # bid engine fall back to auction_winners / the legacy bids rows.
+    winner_user_id = crop.get("winner_id") or crop.get("current_bidder_id")
+    if not winner_user_id:
+        winner = get_auction_winner(crop_id) or get_current_bid(crop_id) or {}
+        winner_user_id = winner.get("user_id") or winner.get("bidder_id") or crop.get("highest_bidder")
+    winner_user_id = str(winner_user_id) if winner_user_id else None
 
-    # Method 2: Direct DB lookup as fallback
-    if not winner:
-        try:
-            bid = db.bids.find_one({"crop_id": crop_id})
-            if bid:
-                winner = {
-                    "user_id": str(bid["bidder_id"]),
-                    "bidder_id": str(bid["bidder_id"]),
-                    "bidder_email": bid.get("bidder_email", "")
-                }
-        except:
-            pass
-
-    # Method 3: Check crop fields directly
-    if not winner:
-        crop_winner_id = crop.get("winner_id") or crop.get("highest_bidder")
-        if crop_winner_id:
-            winner_user_id = str(crop_winner_id)
-            winner = {"user_id": winner_user_id}
-
-    if winner:
-        winner_user_id = str(winner.get("user_id") or winner.get("bidder_id") or "")
-
-    print(f"🔍 DEBUG - Winner ID: {winner_user_id}")
+    app.logger.debug("chat %s: user %s, farmer %s, winner %s", crop_id, user_id, crop_farmer_id,
+                     winner_user_id)
 
     if role == "bidder":
         if not winner_user_id or winner_user_id != user_id:
@@ -763,7 +952,6 @@ def chat():
     else:
         return "Invalid role", 403
 
-    print(f"✅ AUTHORIZED - Partner ID: {partner_id}")
     return render_template(
         "chat.html",
         crop_id=crop_id,
@@ -773,7 +961,96 @@ def chat():
     )
 
 
+# -------------------- PROCESS LIFECYCLE --------------------
+# Importing this module opens no connections and starts no threads, so a
+# pre-forking server can import it once in its master. Every serving
+# process then calls start_background() and warm_up() itself, after the
+# fork (gunicorn.conf.py does this for gunicorn workers).
+
+WARMUP_PATHS = [p for p in os.getenv("WARMUP_PATHS", "/,/api/crops,/api/crops?include_bids=1").split(",") if p]
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "4"))
+
+
+def configure_app(config=None):
+    """
+    Apply `config` overrides to the module's Flask app (routes are registered
+    on it at import, so there is only the one) and return it for WSGI
+    servers. Background services are left to start_background().
+    """
+    if config:
+        app.config.update(config)
+    return app
+
+
+def start_background():
+    """
+    Start this process' background threads: index creation for every access
+    path (ENSURE_INDEXES=0 skips it, e.g. when a deploy step runs
+    `python migrations.py indexes` instead), auction closing
+    (AUCTION_SCHEDULER=0 disables it) and the purge of deleted crops
+    (CROP_CLEANUP=0).
+    """
+    if os.environ.get("ENSURE_INDEXES", "1") == "1":
+        threading.Thread(target=ensure_indexes, name="ensure-indexes", daemon=True).start()
+    if os.environ.get("AUCTION_SCHEDULER", "1") == "1":
+        scheduler.start()
+    if os.environ.get("CROP_CLEANUP", "1") == "1":
+        cleanup.start()
+
+
+def stop_background(timeout=5):
+    """
+    Stop background threads and release pools before the process exits.
+    """
+    scheduler.stop(timeout)
+    cleanup.stop(timeout)
+    image_store.drain(wait=True)
+    hasher.shutdown(wait=False)
+    close_client()
+
+
+def warm_up(paths=WARMUP_PATHS, connections=WARMUP_CONNECTIONS):
+    """
+    Prime this process before it takes traffic: open `connections` pooled
+    Mongo connections, fingerprint the static files, start the password
+    pool and GET each of `paths` once (template compilation, first catalog
+    page into the cache). Metrics recorded meanwhile are discarded.
+    Failures are logged, never raised. Returns the seconds taken.
+    """
+    started = time.perf_counter()
+    try:
+        client = get_client()
+        with ThreadPoolExecutor(max_workers=max(1, connections)) as pool:
+            list(pool.map(lambda _: client.admin.command("ping"), range(connections)))
+    except Exception as e:
+        app.logger.warning("Warm-up: MongoDB not reachable: %s", e)
+
+    media_root = os.path.abspath(image_store.MEDIA_ROOT)
+    for dirpath, dirnames, filenames in os.walk(app.static_folder):
+        if os.path.abspath(dirpath) == media_root:
+            dirnames.clear()  # content addressed, never fingerprinted
+            continue
+        for name in filenames:
+            if not name.endswith((".gz", ".br")):
+                assets.asset_version(os.path.join(dirpath, name))
+
+    hasher.start()
+    with app.test_client() as client:
+        for path in paths:
+            try:
+                resp = client.get(path, headers={"Accept": "application/json"})
+                resp.get_data()
+                if resp.status_code >= 500:
+                    app.logger.warning("Warm-up: GET %s returned %s", path, resp.status_code)
+            except Exception as e:
+                app.logger.warning("Warm-up: GET %s failed: %s", path, e)
+    metrics.reset()
+    return time.perf_counter() - started
+
+
 if __name__ == "__main__":
+    configure_app()
+    start_background()
     app.run(debug=True)
 
 # ------------------ END OF app.py ------------------
\ No newline at end of file
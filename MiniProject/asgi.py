@@ -0,0 +1,396 @@
+# ------------------ asgi.py ------------------
+# Async API for the polling endpoints:
+#
+#     uvicorn asgi:app --workers 4
+#
+# GET /api/current_bid/<id>, /api/current_bids, /api/messages/<id> and
+# /api/crops run as coroutines on the asyncio Mongo client
+# (database.get_async_db()): a poller waiting on MongoDB holds a task, not a
+# thread, so one process can serve thousands of them. The same goes for the
+# live updates stream, GET /api/stream (Server-Sent Events, realtime.py).
+# Lookups that do not depend on each other are issued concurrently:
+#
+#   current bids   the crops query and the legacy `bids` query (gather)
+#   messages       the username lookup for one batch runs while the next
+#                  batch is read from the cursor
+#
+# Query parsing, cache keys, response bodies and status codes are the ones
+# of the Flask routes (app.py / crud.py share the pieces), so clients can
+# use either server. It runs side by side with the WSGI app
+# (gunicorn -c gunicorn.conf.py wsgi:app): route the five paths above to
+# this server and everything else to gunicorn. Events are published by the
+# gunicorn workers, so both servers need REALTIME_BACKEND=redis, and crop
+# writes invalidate the catalog cache there, so it needs CACHE_BACKEND=redis
+# too (or CATALOG_CACHE=0; CATALOG_CACHE_LOCAL=1 when this server runs on
+# its own in a single process). Every
+# other request that reaches this server is handed to the Flask app in a
+# thread when asgiref is installed, and gets a 404 otherwise.
+#
+# Needs an asyncio driver: pymongo >= 4.9 (AsyncMongoClient) or motor; and
+# an ASGI server such as uvicorn. Per-route Mongo metrics (metrics.py) work
+# with pymongo's client, which runs commands in the request's task.
+
+import asyncio
+import inspect
+import re
+
+from pymongo.errors import OperationFailure
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_etags
+from werkzeug.sansio.request import Request
+
+import streaming
+from app import (
+    app as wsgi_app, CatalogPage, catalog_cache_key, message_with_names, near_unavailable, CURRENT_BIDS_MAX,
+    STREAM_HEADERS, stream_crop_ids, start_background, stop_background, warm_up,
+)
+from cache import MemoryBackend, catalog_cache, require_shared_cache
+from crud import (
+    CROP_SORT, CURRENT_BID_FIELDS, LEGACY_BID_FIELDS, MESSAGE_SORT, bid_from_crop, cached_usernames,
+    crop_near_pipeline, crop_page_query, merge_legacy_bids, message_query, remember_usernames,
+    split_crop_page, split_near_page, _as_object_id,
+)
+from database import close_async_client, get_async_db
+from metrics import metrics, METRICS_ENABLED
+from realtime import AsyncSubscription, InProcessBackend, asse_stream, broker, crop_topic
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+MESSAGE_BATCH = 200
+
+
+# -------------------- QUERIES --------------------
+
+async def current_bids(db, crop_ids, crops=None):
+    """
+    crud.get_current_bids() on the async client. Without `crops` the crops
+    and legacy bids queries run concurrently.
+    """
+    ids = list(dict.fromkeys(str(c) for c in crop_ids))
+    result = dict.fromkeys(ids)
+    if crops is None:
+        oids = [oid for oid in (_as_object_id(c) for c in ids) if oid is not None]
+        crops, legacy = await asyncio.gather(
+            db.crops.find({"_id": {"$in": oids}}, {f: 1 for f in CURRENT_BID_FIELDS}).to_list(None),
+            db.bids.find({"crop_id": {"$in": ids}}, LEGACY_BID_FIELDS).to_list(None),
+        )
+    else:
+        legacy = None
+    for crop in crops:
+        crop_id = str(crop["_id"])
+        if crop_id in result:
+            result[crop_id] = bid_from_crop(crop)
+
+    if legacy is None:
+        missing = [c for c, bid in result.items() if bid is None]
+        legacy = await db.bids.find({"crop_id": {"$in": missing}}, LEGACY_BID_FIELDS).to_list(None) \
+            if missing else []
+    merge_legacy_bids(result, legacy)
+    return result
+
+
+async def usernames(db, user_ids):
+    """
+    crud.get_usernames() on the async client (same cache).
+    """
+    keys, names, oids = cached_usernames(user_ids)
+    if oids:
+        remember_usernames(names, await db.users.find({"_id": {"$in": oids}}, {"username": 1}).to_list(None))
+    for key in keys:
+        names.setdefault(key, "Unknown")
+    return names
+
+
+async def messages_with_names(db, messages, batch_size=MESSAGE_BATCH):
+    """
+    app._messages_with_names() for an async cursor: the usernames of one
+    batch are looked up while the next batch is read.
+    """
+    pending = []  # (rows, lookup task), at most one batch behind the cursor
+    batch = []
+    try:
+        async for msg in messages:
+            batch.append(msg)
+            if len(batch) >= batch_size:
+                pending.append(_lookup_names(db, batch))
+                batch = []
+                if len(pending) > 1:
+                    for row in await _with_names(pending.pop(0)):
+                        yield row
+        if batch:
+            pending.append(_lookup_names(db, batch))
+        while pending:
+            for row in await _with_names(pending.pop(0)):
+                yield row
+    finally:
+        for _, lookup in pending:
+            lookup.cancel()
+
+
+def _lookup_names(db, rows):
+    ids = [m.get("sender_id") for m in rows] + [m.get("receiver_id") for m in rows]
+    return rows, asyncio.ensure_future(usernames(db, ids))
+
+
+async def _with_names(pending):
+    rows, lookup = pending
+    names = await lookup
+    return [message_with_names(msg, names) for msg in rows]
+
+
+async def _cached(fn, *args):
+    # the in-process cache answers at once; Redis is blocking I/O
+    if isinstance(catalog_cache.backend, MemoryBackend):
+        return fn(*args)
+    return await asyncio.to_thread(fn, *args)
+
+
+# -------------------- ROUTES --------------------
+# Each returns (status, headers, body); body is bytes or an async iterator
+# of bytes.
+
+def json_response(obj, status=200):
+    return status, {"Content-Type": "application/json"}, streaming.dumps(obj)
+
+
+async def current_bid(request, crop_id):
+    try:
+        bid = (await current_bids(get_async_db(), [crop_id])).get(crop_id)
+        if not bid:
+            return json_response({"current_bid": None})
+        return json_response({
+            "bid_price": bid["bid_price"],
+            "bidder_email": bid["bidder_email"],
+            "bidder_id": bid["bidder_id"]
+        })
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+async def current_bids_view(request):
+    ids = [i.strip() for i in request.args.get("ids", "").split(",") if i.strip()]
+    if not ids:
+        return json_response({"error": "ids is required"}, 400)
+    if len(ids) > CURRENT_BIDS_MAX:
+        return json_response({"error": f"At most {CURRENT_BIDS_MAX} ids per request"}, 400)
+    try:
+        return json_response(await current_bids(get_async_db(), ids))
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+async def get_messages(request, crop_id):
+    try:
+        query = message_query(crop_id, since=request.args.get("since"))
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    if query is None:
+        return json_response([])
+
+    db = get_async_db()
+    ndjson = streaming.wants_ndjson(request)
+    cursor = db.messages.find(query).sort(MESSAGE_SORT)
+    body = streaming.aencode_chunks(messages_with_names(db, cursor), ndjson)
+    return 200, {"Content-Type": streaming.content_type(ndjson)}, body
+
+
+async def list_crops(request):
+    args = request.args
+    ndjson = streaming.wants_ndjson(request)
+    cache_key = await _cached(catalog_cache_key, args, ndjson)
+    cached = await _cached(catalog_cache.get_response, cache_key)
+    if cached is not None:
+        return cached_json_response(request, cached)
+    try:
+        page = CatalogPage(args)
+        if page.near is not None:
+            pipeline, limit = crop_near_pipeline(page.query, page.near, page.within_km, cursor=page.cursor,
+                                                 limit=page.limit, fields=page.query_fields)
+        else:
+            query, projection, limit = crop_page_query(page.query, cursor=page.cursor, limit=page.limit,
+                                                       fields=page.query_fields)
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+
+    try:
+        db = get_async_db()
+        if page.near is not None:
+            try:
+                cursor = db.crops.aggregate(pipeline)
+                if inspect.isawaitable(cursor):  # pymongo's async client; motor returns the cursor
+                    cursor = await cursor
+                docs = await cursor.to_list(None)
+            except OperationFailure as e:
+                return json_response(near_unavailable(e), 503)
+            crops, next_cursor = split_near_page(docs, limit)
+        else:
+            docs = await db.crops.find(query, projection).sort(CROP_SORT).limit(limit + 1).to_list(None)
+            crops, next_cursor = split_crop_page(docs, limit)
+        if page.include_bids:
+            page.add_bids(crops, await current_bids(db, [c["_id"] for c in crops], crops=crops))
+        body = streaming.encode_body(crops, ndjson)
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        entry = await _cached(catalog_cache.put_response, cache_key, body.decode(), headers)
+        return cached_json_response(request, entry, streaming.content_type(ndjson))
+
+    except Exception as e:
+        wsgi_app.logger.exception("async list_crops failed")
+        return json_response({"error": str(e)}, 500)
+
+
+async def stream(request):
+    try:
+        crop_ids = stream_crop_ids(request.args)
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+    headers = {**STREAM_HEADERS, "Content-Type": "text/event-stream"}
+    if request.method == "HEAD":
+        return 200, headers, b""
+    sub = broker.subscribe((crop_topic(c) for c in crop_ids), AsyncSubscription)
+    return 200, headers, asse_stream(sub)
+
+
+def cached_json_response(request, entry, mimetype="application/json"):
+    """
+    app._cached_json_response(): ETag, no-cache and a bodyless 304 when
+    If-None-Match still matches.
+    """
+    headers = {**entry.headers, "Content-Type": mimetype, "ETag": entry.etag,
+               "Cache-Control": "private, no-cache"}
+    if parse_etags(request.headers.get("If-None-Match")).contains(entry.etag.strip('"')):
+        del headers["Content-Type"]
+        return 304, headers, b""
+    return 200, headers, entry.body.encode()
+
+
+ROUTES = [
+    (re.compile(r"/api/current_bid/([^/]+)"), "/api/current_bid/<crop_id>", current_bid),
+    (re.compile(r"/api/current_bids"), "/api/current_bids", current_bids_view),
+    (re.compile(r"/api/messages/([^/]+)"), "/api/messages/<crop_id>", get_messages),
+    (re.compile(r"/api/crops"), "/api/crops", list_crops),
+    (re.compile(r"/api/stream"), "/api/stream", stream),
+]
+
+
+# -------------------- ASGI APP --------------------
+
+def make_request(scope):
+    return Request(
+        scope["method"], scope.get("scheme", "http"), scope.get("server"), scope.get("root_path", ""),
+        scope["path"], scope.get("query_string", b""),
+        Headers([(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]]),
+        (scope.get("client") or (None,))[0],
+    )
+
+
+def cors_headers(request):
+    # what flask_cors adds for CORS(app, supports_credentials=True)
+    origin = request.headers.get("Origin")
+    if not origin:
+        return {}
+    return {"Access-Control-Allow-Origin": origin, "Access-Control-Allow-Credentials": "true",
+            "Vary": "Origin"}
+
+
+async def send_response(send, status, headers, body, head=False):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(k.lower().encode("latin-1"), str(v).encode("latin-1")) for k, v in headers.items()],
+    })
+    if isinstance(body, bytes):
+        await send({"type": "http.response.body", "body": b"" if head else body})
+        return
+    if not head:
+        async for chunk in body:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def send_streaming(receive, send, status, headers, body, head=False):
+    """
+    send_response() for a body that may never end (an SSE stream): stops as
+    soon as the client disconnects, which closes the body's generator.
+    """
+    sending = asyncio.ensure_future(send_response(send, status, headers, body, head))
+    disconnect = asyncio.ensure_future(_disconnected(receive))
+    try:
+        await asyncio.wait({sending, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        sending.cancel()
+        disconnect.cancel()
+    if sending.done() and not sending.cancelled():
+        sending.result()  # re-raise what went wrong while sending
+
+
+async def _disconnected(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                # uvicorn --workers, and the gunicorn workers next to this
+                # server, are processes it cannot see
+                require_shared_cache()
+            except RuntimeError as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            try:
+                await get_async_db().command("ping")
+            except Exception as e:
+                wsgi_app.logger.warning("Warm-up: MongoDB not reachable (async client): %s", e)
+            if isinstance(broker.backend, InProcessBackend):
+                wsgi_app.logger.warning("REALTIME_BACKEND=memory: /api/stream only sees events published "
+                                        "by this process")
+            start_background()
+            await asyncio.to_thread(warm_up)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await asyncio.to_thread(stop_background)
+            await close_async_client()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+_fallback = WsgiToAsgi(wsgi_app) if WsgiToAsgi is not None else None
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    if scope["method"] in ("GET", "HEAD"):
+        for pattern, rule, view in ROUTES:
+            match = pattern.fullmatch(scope["path"])
+            if match is None:
+                continue
+            request = make_request(scope)
+            token = metrics.begin_async(f"GET {rule}") if METRICS_ENABLED else None
+            try:
+                status, headers, body = await view(request, *match.groups())
+                headers.update(cors_headers(request))
+                head = scope["method"] == "HEAD"
+                if isinstance(body, bytes):
+                    await send_response(send, status, headers, body, head=head)
+                else:
+                    await send_streaming(receive, send, status, headers, body, head=head)
+            finally:
+                if token is not None:
+                    metrics.end_async(token)
+            return
+
+    if _fallback is not None:
+        return await _fallback(scope, receive, send)
+    await send_response(send, 404, {"Content-Type": "application/json"},
+                        streaming.dumps({"error": "Not served by the async API"}))
+
+# ------------------ END OF asgi.py ------------------
@@ -0,0 +1,110 @@
+# ------------------ assets.py ------------------
+# Fingerprinted, long-cached static assets.
+#
+# url_for('static', filename=...) gets a ?v=<content hash> parameter, and
+# responses for such URLs are marked immutable: a browser keeps them until
+# the file (and with it the URL) changes. CSS and JS can be precompressed
+# once at deploy time and the .br / .gz copies are then served directly:
+#
+#     python assets.py            # write .gz (and .br with brotli installed)
+
+import gzip
+import hashlib
+import os
+import sys
+import threading
+
+try:
+    import brotli
+except ImportError:  # .br files are skipped without brotli
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_ROOT = os.path.join(BASE_DIR, "static")
+IMMUTABLE = "public, max-age=31536000, immutable"
+COMPRESSIBLE = (".css", ".js", ".svg", ".html", ".json")
+
+_versions = {}  # path -> (mtime, size, version)
+_lock = threading.Lock()
+
+
+def asset_version(path):
+    """
+    Short content hash of a file, recomputed only when its mtime or size
+    changes. None for missing files.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    with _lock:
+        cached = _versions.get(path)
+    if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[2]
+    sha = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(64 * 1024), b""):
+            sha.update(chunk)
+    version = sha.hexdigest()[:12]
+    with _lock:
+        _versions[path] = (st.st_mtime_ns, st.st_size, version)
+    return version
+
+
+def precompressed(path, accept_encoding):
+    """
+    (path, encoding) of the best precompressed copy of `path` the client
+    accepts and that is not older than the original, else (path, None).
+    """
+    if not path.endswith(COMPRESSIBLE):
+        return path, None
+    accept_encoding = (accept_encoding or "").lower()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return path, None
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if encoding in accept_encoding:
+            try:
+                if os.stat(path + suffix).st_mtime_ns >= mtime:
+                    return path + suffix, encoding
+            except OSError:
+                continue
+    return path, None
+
+
+def compress_assets(root=STATIC_ROOT):
+    """
+    Write .gz (and .br) next to every compressible file under `root` that
+    is missing or stale. Returns the number of files written.
+    """
+    written = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            path = os.path.join(dirpath, name)
+            with open(path, "rb") as fh:
+                data = fh.read()
+            mtime = os.stat(path).st_mtime_ns
+            variants = [(".gz", lambda d: gzip.compress(d, 9, mtime=0))]
+            if brotli is not None:
+                variants.append((".br", lambda d: brotli.compress(d, quality=11)))
+            for suffix, compress in variants:
+                target = path + suffix
+                if os.path.exists(target) and os.stat(target).st_mtime_ns >= mtime:
+                    continue
+                compressed = compress(data)
+                if len(compressed) >= len(data):
+                    continue
+                with open(target, "wb") as fh:
+                    fh.write(compressed)
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    root = sys.argv[1] if len(sys.argv) > 1 else STATIC_ROOT
+    print(f"{compress_assets(root)} compressed assets written")
+
+# ------------------ END OF assets.py ------------------
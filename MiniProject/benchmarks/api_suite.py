@@ -0,0 +1,360 @@
+# ------------------ benchmarks/api_suite.py ------------------
+# Load test of the marketplace API.
+#
+# Seeds a throwaway database with users, crops, bids, wishlists and chat
+# messages, then runs scripted scenarios against app.py in process, through
+# Flask's test client (the full WSGI stack, minus the socket), from a number
+# of client threads:
+#
+#   catalog   browse /api/crops page by page with a mix of filters
+#   bidding   a bidding war on a few hot lots via /api/place_bid
+#   closes    a burst of /api/auction/winner calls on ended auctions
+#   chat      chat clients polling /api/messages/<crop_id>?since=..., and
+#             now and then posting to /api/messages
+#
+# Each scenario reports requests/s and p50/p95/p99 latency. --save writes
+# the results as a baseline; --compare checks a run against one and exits
+# with status 1 when a scenario got slower (p95) or lost throughput beyond
+# --tolerance.
+#
+#     python benchmarks/api_suite.py --mongomock                 # in-memory stand-in, no server
+#     python benchmarks/api_suite.py --save benchmarks/baseline.json
+#     python benchmarks/api_suite.py --compare benchmarks/baseline.json --tolerance 0.2
+#
+# Without --mongomock it uses MONGO_URI and the database BENCH_DB_NAME
+# (default crop_db_bench), which is dropped and re-seeded on every run.
+# The same --seed always produces the same data and the same request mix.
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+SCENARIOS = ("catalog", "bidding", "closes", "chat")
+CROP_TYPES = ("Vegetable", "Fruit", "Grain", "Pulse", "Spice")
+LOCATIONS = ("Mysuru", "Mandya", "Hassan", "Tumakuru", "Belagavi", "Dharwad")
+
+
+def load_app(use_mongomock, db_name, cache):
+    """
+    Import app.py configured for benchmarking: no background threads, a
+    dedicated database, optionally mongomock instead of a server.
+    """
+    os.environ["DB_NAME"] = db_name
+    os.environ["AUCTION_SCHEDULER"] = "0"
+    os.environ["CROP_CLEANUP"] = "0"
+    os.environ["CATALOG_CACHE"] = "1" if cache else "0"
+    import database
+    if use_mongomock:
+        import mongomock  # optional, only needed for the in-memory stand-in
+        database._client = mongomock.MongoClient()
+        database._client_pid = os.getpid()
+    import app as app_module
+    app_module.app.config["TESTING"] = True
+    return app_module.app, database.get_db()
+
+
+# -------------------- SEEDING --------------------
+
+def seed(db, rng, users, crops, bids_per_crop, messages, wishlist_per_user, hot_lots, closable):
+    """
+    Drop and fill the benchmark database. Returns the ids the scenarios need.
+    """
+    import bcrypt
+    from crud import ensure_indexes, prepare_crop
+    from models import Bid, Message, User, WishlistItem
+
+    for name in ("users", "crops", "bid_history", "bids", "wishlist", "messages",
+                 "won_crops", "auction_winners", "crop_deletions"):
+        db.drop_collection(name)
+    ensure_indexes()
+
+    password = bcrypt.hashpw(b"bench-password", bcrypt.gensalt(4))
+    user_docs = [User(username=f"user{i}", email=f"user{i}@bench.test", password=password,
+                      role="farmer" if i % 10 == 0 else "bidder").to_bson() for i in range(users)]
+    user_ids = db.users.insert_many(user_docs).inserted_ids
+    farmers = user_ids[::10]
+    names = {user_id: doc["username"] for user_id, doc in zip(user_ids, user_docs)}
+    bidders = [u for i, u in enumerate(user_ids) if i % 10]
+
+    now = datetime.utcnow()
+    crop_docs = []
+    for i in range(crops + hot_lots + closable):
+        if i < crops:
+            listed = now - timedelta(minutes=rng.randint(10, 90 * 24 * 60))
+            status = rng.choice(("Available", "Available", "Growing", "Closed"))
+        elif i < crops + hot_lots:
+            listed, status = now + timedelta(days=1), "Available"  # open for the whole run
+        else:
+            listed, status = now - timedelta(days=1), "Available"  # ended, not closed yet
+        farmer = rng.choice(farmers)
+        crop_docs.append(prepare_crop({
+            "name": f"{rng.choice(CROP_TYPES)} lot {i}",
+            "type": rng.choice(CROP_TYPES),
+            "quality": rng.choice(("A+", "A", "B")),
+            "price": float(rng.randint(50, 5000)),
+            "quantity": float(rng.randint(10, 2000)),
+            "location": rng.choice(LOCATIONS),
+            "datetime": listed,
+            "status": status,
+            "farmer_id": str(farmer),
+            "farmer_name": names[farmer],
+        }))
+    crop_ids = db.crops.insert_many(crop_docs).inserted_ids
+
+    # bid history, with the winning bid mirrored onto the crop as place_bid() does
+    for start in range(0, len(crop_ids), 1000):
+        history, tops = [], []
+        for crop_id, doc in zip(crop_ids[start:start + 1000], crop_docs[start:start + 1000]):
+            price = doc["price"]
+            top = None
+            for n in range(rng.randint(0, bids_per_crop * 2)):
+                price += rng.randint(1, 50)
+                bidder = rng.choice(bidders)
+                top = Bid(crop_id=crop_id, bidder_id=str(bidder), bidder_email=f"{bidder}@bench.test",
+                          bid_price=price, accepted=True, timestamp=doc["datetime"] + timedelta(seconds=n))
+                history.append(top.to_bson())
+            if top is not None:
+                tops.append((crop_id, top, n + 1))
+        if history:
+            db.bid_history.insert_many(history)
+        for crop_id, top, count in tops:
+            db.crops.update_one({"_id": crop_id}, {"$set": {
+                "current_bid": top.bid_price, "current_bidder_id": top.bidder_id,
+                "current_bidder_email": top.bidder_email, "highest_bidder": top.bidder_id,
+                "bid_count": count, "last_bid_at": top.timestamp}})
+
+    wishlist = {}
+    for user in bidders:
+        for crop_id in rng.sample(crop_ids[:crops], min(wishlist_per_user, crops)):
+            wishlist[(user, crop_id)] = WishlistItem(user_id=user, crop_id=crop_id).to_bson()
+    if wishlist:
+        db.wishlist.insert_many(list(wishlist.values()))
+
+    chat_crops = rng.sample(crop_ids[:crops], min(200, crops))
+    chats = []
+    for i in range(messages):
+        crop_id = chat_crops[i % len(chat_crops)]
+        chats.append(Message(crop_id=crop_id, sender_id=rng.choice(bidders), receiver_id=rng.choice(farmers),
+                             message=f"message {i}", timestamp=now - timedelta(seconds=messages - i)).to_bson())
+    for start in range(0, len(chats), 5000):
+        db.messages.insert_many(chats[start:start + 5000])
+
+    return {
+        "bidders": [str(b) for b in bidders],
+        "farmers": [str(f) for f in farmers],
+        "hot_lots": [str(c) for c in crop_ids[crops:crops + hot_lots]],
+        "closable": [str(c) for c in crop_ids[crops + hot_lots:]],
+        "chat_crops": [str(c) for c in chat_crops],
+    }
+
+
+# -------------------- SCENARIOS --------------------
+# step(client, ctx, state, rng) issues one request and returns its status;
+# `state` belongs to one client thread, `ctx` is shared.
+
+def _get(client, url, **kwargs):
+    resp = client.get(url, **kwargs)
+    resp.get_data()  # streamed bodies count until their last byte
+    resp.close()
+    return resp
+
+
+def catalog_step(client, ctx, state, rng):
+    if state.get("cursor") and rng.random() < 0.7:
+        params = dict(state["params"], cursor=state["cursor"])
+    else:
+        params = rng.choice((
+            {},
+            {"type": rng.choice(CROP_TYPES)},
+            {"status": "Available"},
+            {"include_bids": "1"},
+            {"min_price": "500", "max_price": "2500"},
+            {"fields": "name,price,image,thumbnail", "include_bids": "1"},
+        ))
+        params["limit"] = "50"
+        state["params"] = params
+    resp = _get(client, "/api/crops", query_string=params)
+    state["cursor"] = resp.headers.get("X-Next-Cursor")
+    return resp.status_code
+
+
+def bidding_step(client, ctx, state, rng):
+    bidder = state.setdefault("bidder", rng.choice(ctx["bidders"]))
+    resp = client.post("/api/place_bid", json={
+        "crop_id": rng.choice(ctx["hot_lots"]),
+        "bidder_id": bidder,
+        "bidder_email": f"{bidder}@bench.test",
+        # a shared, rising price: most bids win, racing ones are too low
+        "bid_price": 10000 + next(ctx["price"]) + rng.random(),
+    })
+    resp.close()
+    return resp.status_code
+
+
+def closes_step(client, ctx, state, rng):
+    with ctx["lock"]:
+        crop_id = next(ctx["closing"])
+    return _get(client, f"/api/auction/winner/{crop_id}").status_code
+
+
+def chat_step(client, ctx, state, rng):
+    crop_id = state.setdefault("crop", rng.choice(ctx["chat_crops"]))
+    if rng.random() < 0.1:
+        resp = client.post("/api/messages", json={
+            "crop_id": crop_id,
+            "sender_id": rng.choice(ctx["bidders"]),
+            "receiver_id": rng.choice(ctx["farmers"]),
+            "message": "still available?",
+        })
+        resp.close()
+        return resp.status_code
+    since = state.get("since")
+    resp = client.get(f"/api/messages/{crop_id}", query_string={"since": since} if since else None)
+    messages = resp.get_json() or []
+    resp.close()
+    if messages:
+        state["since"] = messages[-1]["timestamp"]
+    return resp.status_code
+
+
+STEPS = {"catalog": catalog_step, "bidding": bidding_step, "closes": closes_step, "chat": chat_step}
+
+
+# -------------------- RUNNER --------------------
+
+def run_scenario(app, name, ctx, clients, requests, seed):
+    step = STEPS[name]
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    per_client = max(1, requests // clients)
+    gate = threading.Barrier(clients)
+
+    def client_loop(index):
+        rng = random.Random(f"{seed}:{name}:{index}")
+        client, state, mine, codes = app.test_client(), {}, [], {}
+        gate.wait()
+        for _ in range(per_client):
+            t0 = time.perf_counter()
+            try:
+                status = step(client, ctx, state, rng)
+            except Exception as e:
+                print(f"{name}: request failed: {e}")
+                status = 599
+            mine.append(time.perf_counter() - t0)
+            codes[status] = codes.get(status, 0) + 1
+        with lock:
+            latencies.extend(mine)
+            for status, n in codes.items():
+                statuses[status] = statuses.get(status, 0) + n
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(client_loop, range(clients)))
+    elapsed = time.perf_counter() - t0
+    cuts = statistics.quantiles([x * 1000 for x in latencies], n=100, method="inclusive")
+    return {
+        "requests": len(latencies),
+        "errors": sum(n for status, n in statuses.items() if status >= 500),
+        "status": {str(k): v for k, v in sorted(statuses.items())},
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(cuts[49], 2),
+        "p95_ms": round(cuts[94], 2),
+        "p99_ms": round(cuts[98], 2),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the change against `baseline` per scenario. Returns the names of
+    scenarios that regressed.
+    """
+    regressed = []
+    for name, result in results.items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        p95 = result["p95_ms"] / base["p95_ms"] - 1 if base["p95_ms"] else 0.0
+        rps = result["rps"] / base["rps"] - 1 if base["rps"] else 0.0
+        bad = p95 > tolerance or rps < -tolerance or result["errors"] > base["errors"]
+        print(f"{name:>8}  p95 {p95:+7.1%}  rps {rps:+7.1%}  {'REGRESSED' if bad else 'ok'}")
+        if bad:
+            regressed.append(name)
+    return regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Marketplace API load test")
+    parser.add_argument("--mongomock", action="store_true", help="in-memory stand-in instead of MONGO_URI")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--clients", type=int, default=8, help="concurrent client threads")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--crops", type=int, default=5000)
+    parser.add_argument("--bids-per-crop", type=int, default=4, help="average accepted bids per crop")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--wishlist", type=int, default=5, help="wishlist entries per bidder")
+    parser.add_argument("--hot-lots", type=int, default=5, help="lots fought over in the bidding war")
+    parser.add_argument("--no-cache", action="store_true", help="run with the catalog cache off")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", metavar="FILE", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="baseline to check the results against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    app, db = load_app(args.mongomock, os.getenv("BENCH_DB_NAME", "crop_db_bench"), not args.no_cache)
+    t0 = time.perf_counter()
+    ctx = seed(db, random.Random(args.seed), args.users, args.crops, args.bids_per_crop, args.messages,
+               args.wishlist, args.hot_lots, closable=args.requests)
+    print(f"seeded {args.users} users, {args.crops} crops, {args.messages} messages "
+          f"in {time.perf_counter() - t0:.1f}s ({'mongomock' if args.mongomock else db.name})")
+    ctx.update(price=itertools.count(), lock=threading.Lock(), closing=itertools.cycle(ctx["closable"]))
+
+    results = {}
+    for name in scenarios:
+        results[name] = result = run_scenario(app, name, ctx, args.clients, args.requests, args.seed)
+        print(f"{name:>8}  {result['rps']:8.1f} req/s  p50={result['p50_ms']:7.2f}ms  "
+              f"p95={result['p95_ms']:7.2f}ms  p99={result['p99_ms']:7.2f}ms  status={result['status']}")
+
+    if args.save:
+        with open(args.save, "w") as fh:
+            json.dump({
+                "meta": {
+                    "created": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "cpus": os.cpu_count(),
+                    "backend": "mongomock" if args.mongomock else "mongodb",
+                    "args": {k: v for k, v in vars(args).items() if k not in ("save", "compare")},
+                },
+                "scenarios": results,
+            }, fh, indent=2)
+        print(f"baseline written to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        if baseline.get("meta", {}).get("args", {}).get("clients") != args.clients:
+            print("note: baseline was recorded with a different --clients")
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+    if not args.mongomock:
+        db.client.drop_database(db.name)
+
+# ------------------ END OF benchmarks/api_suite.py ------------------
@@ -0,0 +1,242 @@
+# ------------------ benchmarks/async_pollers.py ------------------
+# Many concurrent pollers against the sync (gunicorn, wsgi.py) and async
+# (uvicorn, asgi.py) servers.
+#
+# Every poller keeps one HTTP/1.1 keep-alive connection open and cycles
+# through what a bidder's page polls:
+#
+#   /api/current_bids?ids=...           the lots on screen
+#   /api/messages/<crop_id>?since=...   one chat, deltas only
+#   /api/crops?limit=20&include_bids=1  the first catalog page
+#
+# waiting --interval seconds between polls, for --duration seconds. This is
+# repeated for each --pollers level and each server, and the report shows
+# requests/s, p50/p95/p99 latency and errors (5xx and failed connections).
+# A sync worker serves at most `threads` requests at once; the async server
+# keeps answering while thousands of pollers are connected.
+#
+#     python benchmarks/async_pollers.py --launch --pollers 100,1000,3000
+#     python benchmarks/async_pollers.py --sync-url http://127.0.0.1:8000 \
+#         --async-url http://127.0.0.1:8001 --no-seed
+#
+# --launch seeds BENCH_DB_NAME (default crop_db_bench, dropped afterwards)
+# on MONGO_URI and starts `gunicorn -c gunicorn.conf.py wsgi:app` and
+# `uvicorn asgi:app` on it, with --workers processes each. With --sync-url /
+# --async-url the servers must already run with DB_NAME set to that
+# database; either URL may be left out to measure one mode only. With
+# several --workers the catalog cache is on only with CACHE_BACKEND=redis.
+# High --pollers levels need a raised open-files limit (ulimit -n) on both
+# ends.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import quote, urlsplit
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+# -------------------- HTTP CLIENT --------------------
+
+class Connection:
+    """
+    One keep-alive HTTP/1.1 connection; GET only.
+    """
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def get(self, path):
+        """
+        (status, body). Reconnects when the server closed the connection.
+        """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(f"GET {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                          f"Accept: application/json\r\n\r\n".encode())
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                body += chunk[:-2]
+        elif "content-length" in headers:
+            body = await self.reader.readexactly(int(headers["content-length"]))
+        else:
+            body = await self.reader.read()
+            headers["connection"] = "close"
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, bytes(body)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+# -------------------- POLLERS --------------------
+
+async def poller(base, ctx, rng, interval, deadline, latencies, statuses):
+    parts = urlsplit(base)
+    conn = Connection(parts.hostname, parts.port or 80)
+    chat = rng.choice(ctx["chat_crops"])
+    since = None
+    lots = ",".join(rng.sample(ctx["lots"], min(20, len(ctx["lots"]))))
+    paths = [f"/api/current_bids?ids={lots}", None, "/api/crops?limit=20&include_bids=1"]
+    await asyncio.sleep(rng.random() * interval)  # spread the first polls
+    step = 0
+    while time.perf_counter() < deadline:
+        path = paths[step % 3] or f"/api/messages/{chat}" + (f"?since={quote(since)}" if since else "")
+        t0 = time.perf_counter()
+        try:
+            status, body = await conn.get(path)
+            if path.startswith("/api/messages/") and status == 200:
+                rows = json.loads(body)
+                if rows:
+                    since = rows[-1]["timestamp"]
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+            conn.close()
+            status = 599
+        latencies.append(time.perf_counter() - t0)
+        statuses[status] = statuses.get(status, 0) + 1
+        step += 1
+        await asyncio.sleep(interval)
+    conn.close()
+
+
+async def run_level(base, ctx, pollers, interval, duration, seed):
+    latencies, statuses = [], {}
+    deadline = time.perf_counter() + duration
+    t0 = time.perf_counter()
+    await asyncio.gather(*(
+        poller(base, ctx, random.Random(f"{seed}:{i}"), interval, deadline, latencies, statuses)
+        for i in range(pollers)))
+    elapsed = time.perf_counter() - t0
+    cuts = statistics.quantiles([x * 1000 for x in latencies], n=100, method="inclusive") \
+        if len(latencies) > 1 else [0.0] * 99
+    return {
+        "requests": len(latencies),
+        "errors": sum(n for status, n in statuses.items() if status >= 500),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(cuts[49], 2),
+        "p95_ms": round(cuts[94], 2),
+        "p99_ms": round(cuts[98], 2),
+    }
+
+
+# -------------------- SERVERS --------------------
+
+def launch(mode, port, workers, db_name):
+    env = dict(os.environ, DB_NAME=db_name, AUCTION_SCHEDULER="0", CROP_CLEANUP="0",
+               WEB_CONCURRENCY=str(workers), BIND=f"127.0.0.1:{port}")
+    if env.get("CACHE_BACKEND", "memory") == "redis":
+        pass
+    elif workers > 1:
+        env["CATALOG_CACHE"] = "0"  # per-process caches go stale across workers (cache.py)
+    else:
+        env["CATALOG_CACHE_LOCAL"] = "1"  # one process, and the pollers only read
+    if mode == "sync":
+        cmd = ["gunicorn", "-c", "gunicorn.conf.py", "--access-logfile", "/dev/null", "wsgi:app"]
+    else:
+        cmd = ["uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(workers), "--no-access-log"]
+    return subprocess.Popen(cmd, cwd=BASE_DIR, env=env)
+
+
+async def wait_ready(base, timeout=60):
+    parts = urlsplit(base)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        conn = Connection(parts.hostname, parts.port or 80)
+        try:
+            status, _ = await conn.get("/api/crops?limit=1")
+            if status < 500:
+                return
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            conn.close()
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"{base} did not come up within {timeout}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent pollers: sync vs async API")
+    parser.add_argument("--sync-url", help="running WSGI server (gunicorn wsgi:app)")
+    parser.add_argument("--async-url", help="running ASGI server (uvicorn asgi:app)")
+    parser.add_argument("--launch", action="store_true", help="start both servers on --port and --port + 1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--workers", type=int, default=2, help="server processes per mode with --launch")
+    parser.add_argument("--pollers", default="100,1000", help="comma separated concurrency levels")
+    parser.add_argument("--interval", type=float, default=0.5, help="seconds between one poller's requests")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per level")
+    parser.add_argument("--crops", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--no-seed", action="store_true", help="use the data already in BENCH_DB_NAME")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    if not (args.launch or args.sync_url or args.async_url):
+        parser.error("give --launch or at least one of --sync-url / --async-url")
+
+    from api_suite import load_app, seed
+
+    db_name = os.getenv("BENCH_DB_NAME", "crop_db_bench")
+    _, db = load_app(False, db_name, cache=True)
+    if not args.no_seed:
+        seed(db, random.Random(args.seed), users=500, crops=args.crops, bids_per_crop=4,
+             messages=args.messages, wishlist_per_user=0, hot_lots=0, closable=0)
+    ctx = {
+        "lots": [str(c["_id"]) for c in db.crops.find({}, {"_id": 1}).limit(200)],
+        "chat_crops": [str(c) for c in db.messages.distinct("crop_id")][:200],
+    }
+
+    servers = {}
+    if args.launch:
+        servers = {"sync": launch("sync", args.port, args.workers, db_name),
+                   "async": launch("async", args.port + 1, args.workers, db_name)}
+        targets = {"sync": f"http://127.0.0.1:{args.port}", "async": f"http://127.0.0.1:{args.port + 1}"}
+    else:
+        targets = {mode: url for mode, url in (("sync", args.sync_url), ("async", args.async_url)) if url}
+
+    try:
+        for mode, base in targets.items():
+            asyncio.run(wait_ready(base))
+        print(f"pollers every {args.interval}s for {args.duration}s per level; "
+              f"{len(ctx['lots'])} lots, {len(ctx['chat_crops'])} chats")
+        for level in (int(n) for n in args.pollers.split(",") if n.strip()):
+            for mode, base in targets.items():
+                result = asyncio.run(run_level(base, ctx, level, args.interval, args.duration, args.seed))
+                print(f"{level:>6} pollers  {mode:>5}  {result['rps']:8.1f} req/s  "
+                      f"p50={result['p50_ms']:8.2f}ms  p95={result['p95_ms']:8.2f}ms  "
+                      f"p99={result['p99_ms']:8.2f}ms  errors={result['errors']}/{result['requests']}")
+    finally:
+        for proc in servers.values():
+            proc.terminate()
+        for proc in servers.values():
+            proc.wait(timeout=30)
+        if args.launch and not args.no_seed:
+            db.client.drop_database(db_name)
+
+# ------------------ END OF benchmarks/async_pollers.py ------------------
@@ -0,0 +1,95 @@
+# ------------------ benchmarks/bid_stress.py ------------------
+# Concurrency stress test for the bid engine (crud.place_bid).
+#
+# Hundreds of bidder threads fire bids with distinct prices at one crop at
+# the same moment. Afterwards the crop must hold the highest price that was
+# submitted, by the bidder who submitted it, and bid_history must contain
+# exactly one accepted row per price increase that won its compare-and-set.
+#
+#     python benchmarks/bid_stress.py --bidders 300 --bids 5
+#
+# Runs against MONGO_URI using a throwaway database (BENCH_DB_NAME, default
+# crop_db_bench) which is dropped afterwards.
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crud  # noqa: E402
+
+
+def run(bidders, bids_per_bidder, seed=7):
+    db = crud.get_client()[os.getenv("BENCH_DB_NAME", "crop_db_bench")]
+    crud.db = db
+    db.crops.drop()
+    db.bid_history.drop()
+
+    crop_id = str(crud.create_crop({"name": "stress-lot", "price": 1, "farmer_id": "bench"}).inserted_id)
+
+    rng = random.Random(seed)
+    prices = list(range(2, 2 + bidders * bids_per_bidder))
+    rng.shuffle(prices)
+    plan = {f"bidder-{i}": prices[i * bids_per_bidder:(i + 1) * bids_per_bidder] for i in range(bidders)}
+    owner = {p: b for b, ps in plan.items() for p in ps}
+
+    start_gate = threading.Barrier(bidders)
+    latencies = []
+    outcomes = []
+    lock = threading.Lock()
+
+    def bidder(name):
+        start_gate.wait()
+        for price in plan[name]:
+            t0 = time.perf_counter()
+            res = crud.place_bid({"crop_id": crop_id, "bidder_id": name,
+                                  "bidder_email": f"{name}@bench", "bid_price": price})
+            dt = time.perf_counter() - t0
+            with lock:
+                latencies.append(dt)
+                outcomes.append(res["status"])
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=bidders) as pool:
+        list(pool.map(bidder, plan))
+    elapsed = time.perf_counter() - t0
+
+    crop = db.crops.find_one({"_id": crud.ObjectId(crop_id)})
+    top = max(prices)
+    accepted = db.bid_history.count_documents({"crop_id": crud.ObjectId(crop_id), "accepted": True})
+    history = db.bid_history.count_documents({"crop_id": crud.ObjectId(crop_id)})
+
+    ok = (
+        crop["current_bid"] == top
+        and crop["current_bidder_id"] == owner[top]
+        and accepted == outcomes.count(crud.BID_ACCEPTED)
+        and history == len(prices)
+    )
+
+    lat_ms = sorted(x * 1000 for x in latencies)
+    print(f"bidders={bidders} bids={len(prices)} elapsed={elapsed:.2f}s "
+          f"throughput={len(prices) / elapsed:.0f} bids/s")
+    print(f"latency ms: p50={statistics.median(lat_ms):.2f} "
+          f"p95={lat_ms[int(len(lat_ms) * 0.95) - 1]:.2f} max={lat_ms[-1]:.2f}")
+    print(f"accepted={accepted} rejected={len(prices) - accepted}")
+    print(f"winner: expected {owner[top]} @ {top}, got {crop.get('current_bidder_id')} @ {crop.get('current_bid')}")
+    print("RESULT:", "OK" if ok else "FAILED")
+
+    db.client.drop_database(db.name)
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bid engine concurrency stress test")
+    parser.add_argument("--bidders", type=int, default=200)
+    parser.add_argument("--bids", type=int, default=5, help="bids per bidder")
+    args = parser.parse_args()
+    sys.exit(0 if run(args.bidders, args.bids) else 1)
+
+# ------------------ END OF benchmarks/bid_stress.py ------------------
@@ -0,0 +1,86 @@
+# ------------------ benchmarks/login_throughput.py ------------------
+# Login (bcrypt check) throughput against password pool size.
+#
+# A fixed number of client threads, standing in for request threads, verify
+# passwords through passwords.PasswordHasher. Each run reports throughput,
+# latency and how many attempts were turned away with a 429. The first row
+# is the old behaviour: checkpw inline on the calling thread.
+#
+#     python benchmarks/login_throughput.py --clients 32 --logins 400 --workers 1,2,4,8
+#     python benchmarks/login_throughput.py --pool process --rounds 10
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bcrypt  # noqa: E402
+from passwords import PasswordHasher, PoolSaturated  # noqa: E402
+
+
+def run(check, clients, logins):
+    latencies = []
+    rejected = 0
+    lock = threading.Lock()
+    per_client = max(1, logins // clients)
+    gate = threading.Barrier(clients)
+
+    def client(_):
+        nonlocal rejected
+        gate.wait()
+        for _ in range(per_client):
+            t0 = time.perf_counter()
+            try:
+                check()
+            except PoolSaturated:
+                with lock:
+                    rejected += 1
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(client, range(clients)))
+    elapsed = time.perf_counter() - t0
+    return elapsed, sorted(x * 1000 for x in latencies), rejected
+
+
+def report(label, elapsed, lat_ms, rejected):
+    if not lat_ms:
+        print(f"{label:>14}  all {rejected} attempts rejected")
+        return
+    print(f"{label:>14}  {len(lat_ms) / elapsed:8.1f} logins/s  "
+          f"p50={statistics.median(lat_ms):8.1f}ms  "
+          f"p95={lat_ms[max(0, int(len(lat_ms) * 0.95) - 1)]:8.1f}ms  rejected={rejected}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Login throughput vs password pool size")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent request threads")
+    parser.add_argument("--logins", type=int, default=320, help="login attempts per run")
+    parser.add_argument("--workers", default="1,2,4,8", help="comma separated pool sizes")
+    parser.add_argument("--queue", type=int, default=None, help="queue limit (default 4 x workers)")
+    parser.add_argument("--rounds", type=int, default=10, help="bcrypt cost")
+    parser.add_argument("--pool", choices=["thread", "process"], default="thread")
+    args = parser.parse_args()
+
+    password = b"correct horse battery staple"
+    hashed = bcrypt.hashpw(password, bcrypt.gensalt(args.rounds))
+    print(f"clients={args.clients} logins={args.logins} rounds={args.rounds} pool={args.pool} "
+          f"cpus={os.cpu_count()}")
+
+    report("inline", *run(lambda: bcrypt.checkpw(password, hashed), args.clients, args.logins))
+    for workers in (int(w) for w in args.workers.split(",")):
+        hasher = PasswordHasher(workers=workers, queue_limit=args.queue, rounds=args.rounds,
+                                kind=args.pool, timeout=60)
+        hasher.check(password, hashed)  # start the pool outside the timing
+        report(f"workers={workers}", *run(lambda: hasher.check(password, hashed), args.clients, args.logins))
+        hasher.shutdown()
+
+# ------------------ END OF benchmarks/login_throughput.py ------------------
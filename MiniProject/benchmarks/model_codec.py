@@ -0,0 +1,116 @@
+# ------------------ benchmarks/model_codec.py ------------------
+# Memory and encode/decode cost of models.Crop against plain dicts.
+#
+# Crop documents shaped like the stored ones are held either as the dicts
+# the driver returns or as Crop instances (__slots__). The report shows the
+# retained memory per crop, decode throughput (dict: prepare_crop on a copy,
+# the validation the write path does today; model: Crop.from_bson) and
+# encode throughput (streaming.dumps of the dict vs Crop.to_json, and
+# Crop.to_bson on its own). No database is needed.
+#
+#     python benchmarks/model_codec.py --crops 20000 --repeat 3
+
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson.objectid import ObjectId  # noqa: E402
+
+import streaming  # noqa: E402
+from crud import prepare_crop  # noqa: E402
+from models import Crop  # noqa: E402
+
+
+def make_doc(i):
+    image = f"/media/{i:064x}.jpg"
+    return {
+        "_id": ObjectId(),
+        "name": f"Tomato lot {i}",
+        "type": "vegetable",
+        "quality": "A",
+        "price": 100.0 + i % 50,
+        "quantity": float(i % 900 + 10),
+        "datetime": datetime(2030, 1, 1) + timedelta(minutes=i),
+        "location": "Mysuru",
+        "status": "Available",
+        "sold": False,
+        "notes": "",
+        "images": [image],
+        "image": image,
+        "thumbnail": image,
+        "thumbnails": [],
+        "farmer_id": str(ObjectId()),
+        "farmer_name": "Farmer",
+        "buyer_name": "Unknown",
+        "current_bid": 120.0 + i % 7,
+        "current_bidder_id": str(ObjectId()),
+        "current_bidder_email": "bidder@example.com",
+        "highest_bidder": "bidder",
+        "bid_count": i % 12,
+        "last_bid_at": datetime(2030, 1, 2),
+    }
+
+
+def retained_bytes(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = build()
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del objects
+    return size
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def report(label, n, seconds):
+    print(f"{label:>34}  {n / seconds:12,.0f} crops/s  {seconds / n * 1e6:7.2f} us/crop")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crop model codec vs dict path")
+    parser.add_argument("--crops", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    n = args.crops
+
+    docs = [make_doc(i) for i in range(n)]
+    models = [Crop.from_bson(doc) for doc in docs]
+
+    # every object is built fresh inside the measurement so shared values
+    # (the docs above) do not hide any of the cost
+    dict_mem = retained_bytes(lambda: [make_doc(i) for i in range(n)])
+    model_mem = retained_bytes(lambda: [Crop.from_bson(make_doc(i)) for i in range(n)])
+    print(f"crops={n}")
+    print(f"{'memory per crop, dict':>34}  {dict_mem / n:8.0f} bytes")
+    print(f"{'memory per crop, Crop':>34}  {model_mem / n:8.0f} bytes  "
+          f"({100 * (1 - model_mem / dict_mem):.0f}% less)")
+
+    report("decode dict (prepare_crop)", n,
+           best_of(args.repeat, lambda: [prepare_crop(dict(d)) for d in docs]))
+    report("decode Crop.from_bson", n,
+           best_of(args.repeat, lambda: [Crop.from_bson(d) for d in docs]))
+    report("encode dict (streaming.dumps)", n,
+           best_of(args.repeat, lambda: [streaming.dumps(d) for d in docs]))
+    report("encode Crop.to_json", n,
+           best_of(args.repeat, lambda: [m.to_json() for m in models]))
+    report("encode Crop.to_bson", n,
+           best_of(args.repeat, lambda: [m.to_bson() for m in models]))
+
+# ------------------ END OF benchmarks/model_codec.py ------------------
@@ -0,0 +1,277 @@
+# ------------------ cache.py ------------------
+# Caches shared by the API helpers.
+#
+# TTLCache is a small in-process LRU with expiry. CatalogCache sits in front
+# of the crop catalog and stores serialized responses in a pluggable backend:
+#
+#   MemoryBackend  per process (default)
+#   RedisBackend   shared by all workers; any redis-py compatible client
+#                  works, so fakeredis.FakeRedis() is the local stand-in
+#
+# CACHE_BACKEND=memory|redis|fakeredis, REDIS_URL, CATALOG_CACHE_TTL,
+# CATALOG_CACHE_SIZE configure it; CATALOG_CACHE=0 switches it off. A crop
+# write only invalidates the cache of the process that made it, so servers
+# with several processes refuse to start with a per-process backend (see
+# require_shared_cache()). A server that cannot count its processes (asgi.py)
+# needs CATALOG_CACHE_LOCAL=1 to confirm it runs alone.
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Thread-safe dict-like cache with a per-entry time to live and a maximum
+    size (oldest entries are evicted first).
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def get_many(self, keys):
+        """
+        Returns ({key: value} for cached keys, [missing keys]).
+        """
+        found, missing = {}, []
+        for key in keys:
+            value = self.get(key, _MISSING)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        return found, missing
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_MISSING = object()
+
+
+# -------------------- BACKENDS --------------------
+# Values are str; counters are never evicted so a generation can not
+# silently go back to an older value.
+
+class MemoryBackend:
+    def __init__(self, maxsize=1024, ttl=30.0):
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._entries.set(key, value, ttl)
+
+    def delete(self, *keys):
+        for key in keys:
+            self._entries.delete(key)
+
+    def get_counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        self._entries.clear()
+
+
+class RedisBackend:
+    def __init__(self, client=None, prefix="cropconnect:cache:", ttl=30.0):
+        if client is None:
+            import redis  # optional dependency, only needed for this backend
+            client = redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, value, px=int((self.ttl if ttl is None else ttl) * 1000))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*(self.prefix + k for k in keys))
+
+    def get_counter(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+def create_backend():
+    kind = os.getenv("CACHE_BACKEND", "memory").lower()
+    ttl = float(os.getenv("CATALOG_CACHE_TTL", "30"))
+    if kind == "redis":
+        return RedisBackend(ttl=ttl)
+    if kind == "fakeredis":
+        import fakeredis
+        return RedisBackend(client=fakeredis.FakeRedis(), ttl=ttl)
+    return MemoryBackend(maxsize=int(os.getenv("CATALOG_CACHE_SIZE", "1024")), ttl=ttl)
+
+
+def require_shared_cache(processes=None):
+    """
+    Raise RuntimeError when `processes` server processes would each keep a
+    catalog cache of their own and serve pages another process has already
+    changed. processes=None means the count is unknown; a per-process cache
+    is then only accepted with CATALOG_CACHE_LOCAL=1. Reads the environment
+    only, so server config files can call it before the app is imported.
+    """
+    kind = os.getenv("CACHE_BACKEND", "memory").lower()
+    if os.getenv("CATALOG_CACHE", "1") != "1" or kind == "redis":
+        return
+    fix = "set CACHE_BACKEND=redis (and REDIS_URL) or CATALOG_CACHE=0"
+    if processes is None and os.getenv("CATALOG_CACHE_LOCAL") != "1":
+        raise RuntimeError(
+            f"CACHE_BACKEND={kind} keeps one catalog cache per process and this server cannot tell "
+            f"how many processes serve the catalog: {fix}, or CATALOG_CACHE_LOCAL=1 if this one runs alone"
+        )
+    if processes is not None and processes > 1:
+        raise RuntimeError(
+            f"CACHE_BACKEND={kind} keeps one catalog cache per process, which goes stale across "
+            f"{processes} worker processes: {fix}"
+        )
+
+
+# -------------------- CATALOG CACHE --------------------
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "headers")
+
+    def __init__(self, body, etag, headers):
+        self.body = body
+        self.etag = etag
+        self.headers = headers
+
+
+def make_etag(body):
+    if isinstance(body, str):
+        body = body.encode()
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+class CatalogCache:
+    """
+    Read-through cache for catalog list responses and single crops.
+
+    List entries are keyed by the catalog generation, which every crop write
+    bumps, so no stale page can be served after a write without having to
+    enumerate the cached pages. Single crops are keyed by id and deleted by
+    the writes that touch them.
+    """
+
+    GENERATION_KEY = "crops:generation"
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+        self.enabled = os.getenv("CATALOG_CACHE", "1") == "1"
+
+    # ---- list responses ----
+
+    def list_key(self, args):
+        """
+        Cache key for a catalog request; `args` is an iterable of (name, value).
+        """
+        generation = self.backend.get_counter(self.GENERATION_KEY)
+        canonical = "&".join(f"{k}={v}" for k, v in sorted(args))
+        return f"crops:list:{generation}:{hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()}"
+
+    def item_key(self, crop_id):
+        return f"crop:{crop_id}:response"
+
+    def get_response(self, key):
+        if not self.enabled:
+            return None
+        raw = self.backend.get(key)
+        if raw is None:
+            return None
+        etag, headers, body = raw.split("\n", 2)
+        return CachedResponse(body, etag, json.loads(headers))
+
+    def put_response(self, key, body, headers=None):
+        entry = CachedResponse(body, make_etag(body), headers or {})
+        if self.enabled:
+            self.backend.set(key, f"{entry.etag}\n{json.dumps(entry.headers)}\n{body}")
+        return entry
+
+    # ---- single crops ----
+
+    def get_crop(self, crop_id):
+        if not self.enabled:
+            return None
+        return self.backend.get(f"crop:{crop_id}")
+
+    def put_crop(self, crop_id, serialized):
+        if self.enabled:
+            self.backend.set(f"crop:{crop_id}", serialized)
+
+    # ---- invalidation ----
+
+    def invalidate(self, *crop_ids):
+        """
+        Called by every crop write: drops the crops' own entries and moves
+        the catalog to a new generation.
+        """
+        if crop_ids:
+            keys = []
+            for crop_id in crop_ids:
+                keys += [f"crop:{crop_id}", self.item_key(crop_id)]
+            self.backend.delete(*keys)
+        self.backend.incr(self.GENERATION_KEY)
+
+    def clear(self):
+        self.backend.clear()
+        self.backend.incr(self.GENERATION_KEY)
+
+
+catalog_cache = CatalogCache(create_backend())
+
+# ------------------ END OF cache.py ------------------
@@ -0,0 +1,69 @@
+# ------------------ cleanup.py ------------------
+# Background purge of deleted crops.
+#
+# Deleting a crop only moves it to crop_deletions (crud.delete_crop), so
+# the API answers right away. This worker then removes the crop's bids,
+# messages, wishlist entries, won_crops / auction_winners rows and images
+# with crud.purge_deleted_crops(). The API wakes it after a delete; it also
+# polls, which picks up deletions made by other workers or left over from a
+# crash. Purging is idempotent, so every worker process can run one.
+
+import os
+import threading
+
+import crud
+
+CLEANUP_SECONDS = float(os.getenv("CROP_CLEANUP_SECONDS", "60"))
+
+
+class CleanupWorker:
+    def __init__(self, interval=CLEANUP_SECONDS, batch_size=crud.CROP_PURGE_BATCH):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def wake(self):
+        self._wake.set()
+
+    def run_once(self):
+        """
+        Purge until the queue is empty. Returns the number of crops purged.
+        """
+        purged = 0
+        while True:
+            count = crud.purge_deleted_crops(self.batch_size)
+            purged += count
+            if count < self.batch_size:
+                return purged
+
+    def _loop(self):
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopping:
+                return
+            try:
+                self.run_once()
+            except Exception as e:
+                print("Crop cleanup failed, retrying later:", e)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._loop, name="crop-cleanup", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping = True
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+cleanup = CleanupWorker()
+
+# ------------------ END OF cleanup.py ------------------
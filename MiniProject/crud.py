@@ -1,16 +1,16 @@
 # ------------------ crud.py (fixed) ------------------
 from bson.objectid import ObjectId
-from datetime import datetime
-from pymongo import MongoClient
-from dotenv import load_dotenv
+from bson import json_util
+from datetime import datetime, timedelta, timezone
+from pymongo import UpdateOne
+from pymongo.errors import ConnectionFailure, OperationFailure
+from cache import TTLCache, catalog_cache
+from database import db, get_client
+from models import AuctionWinner, Bid, Crop, Message, ModelError, WonCrop, parse_datetime, to_point
+import images as image_store
+import base64
 import os
-
-load_dotenv()
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
-DB_NAME = os.getenv("DB_NAME", "crop_db")
-
-client = MongoClient(MONGO_URI)
-db = client[DB_NAME]
+import re
 
 
 # -------------------- USERS --------------------
@@ -39,6 +39,8 @@ def update_user(user_id, update_fields):
             {"_id": ObjectId(user_id)},
             {"$set": update_fields}
         )
+        if "username" in update_fields:
+            _username_cache.delete(str(user_id))
         return result.modified_count > 0
     except Exception as e:
         print(f"User update error: {e}")
@@ -46,196 +48,731 @@ def update_user(user_id, update_fields):
 
 
 
+# Display names change rarely but are resolved on every chat poll
+_username_cache = TTLCache(
+    maxsize=int(os.getenv("USERNAME_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USERNAME_CACHE_TTL", "300")),
+)
+
+
+def get_usernames(user_ids):
+    """
+    Resolve many user ids to usernames with at most one $in query, backed by
+    a TTL cache. Unknown or invalid ids map to "Unknown".
+    """
+    keys, names, oids = cached_usernames(user_ids)
+    if oids:
+        remember_usernames(names, db.users.find({"_id": {"$in": oids}}, {"username": 1}))
+    for key in keys:
+        names.setdefault(key, "Unknown")
+    return names
+
+
+def cached_usernames(user_ids):
+    """
+    (keys, {key: cached name}, [ObjectIds still to look up]) for user_ids.
+    The first half of get_usernames(), shared with the async API.
+    """
+    keys = list({str(u) for u in user_ids if u})
+    names, missing = _username_cache.get_many(keys)
+    return keys, names, [oid for oid in (_as_object_id(k) for k in missing) if oid is not None]
+
+
+def remember_usernames(names, users):
+    for user in users:
+        name = user.get("username") or "Unknown"
+        names[str(user["_id"])] = name
+        _username_cache.set(str(user["_id"]), name)
+
+
 # -------------------- CROPS --------------------
 
+# Crops are normalized once, on write (and by `python migrations.py
+# normalize` for older documents): datetime is a naive-UTC BSON date,
+# price/quantity are floats, images/image/thumbnail and the display fields
+# are always present, sold agrees with status. Readers use the documents as
+# stored; ObjectId and datetime are encoded by streaming.dumps().
+
+DEFAULT_CROP_IMAGE = "/static/default_crop.jpg"
+SOLD_STATUSES = ("closed", "sold")
+# No more bids once a crop has one of these. Auctions that end without a
+# bid become "Expired" (sold stays False).
+CLOSED_STATUSES = ["Closed", "closed", "Sold", "sold", "Expired"]
+
+# A crop's position is a GeoJSON point in `geo` (2dsphere index), from the
+# latitude / longitude a client sends or, failing that, parsed from the
+# "<place> (lat, lon)" or "lat, lon" text the farmer portal writes into
+# `location`. Crops that cannot be placed have no `geo`.
+_LOCATION_COORDINATES = re.compile(r"(?:^|[\s(])(-?\d{1,2}\.\d+)\s*,\s*(-?\d{1,3}\.\d+)\s*\)?\s*$")
+
+
+def _text(value, default):
+    return (value.strip() if isinstance(value, str) else "") or default
+
+
+def _number(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def geo_point(lat, lon):
+    """
+    GeoJSON point for a latitude / longitude in degrees. Raises ValueError.
+    """
+    try:
+        return to_point({"type": "Point", "coordinates": [float(lon), float(lat)]})
+    except (TypeError, ValueError):
+        raise ValueError("Invalid coordinates")
+
+
+def parse_lat_lon(location):
+    """
+    (lat, lon) from a location text ending in "lat, lon" or "(lat, lon)",
+    None when it has no valid coordinates.
+    """
+    match = _LOCATION_COORDINATES.search(location) if isinstance(location, str) else None
+    if match is None:
+        return None
+    lat, lon = float(match.group(1)), float(match.group(2))
+    return (lat, lon) if -90 <= lat <= 90 and -180 <= lon <= 180 else None
+
+
+def _crop_geo(crop_data, partial):
+    """
+    Set crop_data["geo"] from latitude/longitude, a valid geo or the
+    location text. On an update that moves the crop somewhere without
+    coordinates geo becomes None, which update_crop() unsets.
+    """
+    lat, lon = crop_data.pop("latitude", None), crop_data.pop("longitude", None)
+    if lat not in (None, "") and lon not in (None, ""):
+        try:
+            crop_data["geo"] = geo_point(lat, lon)
+            return
+        except ValueError:
+            pass
+    if crop_data.get("geo") is not None:
+        try:
+            crop_data["geo"] = to_point(crop_data["geo"])
+            return
+        except (TypeError, ValueError, AttributeError):
+            crop_data.pop("geo")
+    if "location" in crop_data:
+        coordinates = parse_lat_lon(crop_data["location"])
+        if coordinates is not None:
+            crop_data["geo"] = geo_point(*coordinates)
+        elif partial:
+            crop_data["geo"] = None
+    if not partial and crop_data.get("geo", False) is None:
+        del crop_data["geo"]
+
+
+def prepare_crop(crop_data, partial=False):
+    """
+    Normalize crop fields in place for storage. With partial=True (updates)
+    only the fields present are touched and no defaults are added.
+    """
+    def has(key):
+        return not partial or key in crop_data
+
+    if has("datetime"):
+        crop_data["datetime"] = parse_datetime(crop_data.get("datetime")) or datetime.utcnow()
+    if has("location"):
+        crop_data["location"] = _text(crop_data.get("location"), "Not specified")
+    _crop_geo(crop_data, partial)
+    for key in ("price", "quantity"):
+        if has(key):
+            crop_data[key] = _number(crop_data.get(key))
+
+    if has("images") or has("image"):
+        images = crop_data.get("images")
+        if not isinstance(images, list):
+            images = [crop_data["image"]] if crop_data.get("image") else []
+        images = [img for img in images if isinstance(img, str) and img] or [DEFAULT_CROP_IMAGE]
+        crop_data["images"] = images
+        crop_data["image"] = images[0]
+        if not crop_data.get("thumbnail"):
+            crop_data["thumbnail"] = images[0]
+        if not isinstance(crop_data.get("thumbnails"), list):
+            crop_data["thumbnails"] = []
+
+    for key, default in (("name", "Unnamed"), ("type", "-"), ("quality", "-")):
+        if has(key):
+            crop_data[key] = _text(crop_data.get(key), default)
+    if has("notes"):
+        crop_data["notes"] = _text(crop_data.get("notes"), "")
+    if has("status"):
+        crop_data["status"] = crop_data.get("status") or "Available"
+    if has("sold") or "status" in crop_data:
+        crop_data["sold"] = bool(crop_data.get("sold")) or \
+            str(crop_data.get("status", "")).lower() in SOLD_STATUSES
+
+    # ids from the session are strings; keep them that way
+    if has("farmer_id"):
+        crop_data["farmer_id"] = str(crop_data.get("farmer_id") or crop_data.get("farmer") or "")
+    if has("farmer_name"):
+        crop_data["farmer_name"] = crop_data.get("farmer_name") or crop_data.get("farmer") or "Unknown Farmer"
+    if not partial:
+        crop_data["buyer_name"] = crop_data.get("buyer_name") or "Unknown"
+    return crop_data
+
+
 def create_crop(crop_data):
     """
     Insert a new crop with normalized structure and default values.
+    Raises ModelError when a field has the wrong type.
     """
-    # Normalize datetime
-    if "datetime" in crop_data:
-        try:
-            if isinstance(crop_data["datetime"], datetime):
-                crop_data["datetime"] = crop_data["datetime"].isoformat()
-            else:
-                _ = datetime.fromisoformat(crop_data["datetime"])
-        except Exception:
-            crop_data["datetime"] = datetime.utcnow().isoformat()
-    else:
-        crop_data["datetime"] = datetime.utcnow().isoformat()
+    result = db.crops.insert_one(Crop.from_bson(prepare_crop(crop_data)).to_bson())
+    catalog_cache.invalidate(str(result.inserted_id))
+    return result
 
-    # Default location
-    crop_data["location"] = crop_data.get("location", "").strip() or "Not specified"
 
-    # Ensure numeric fields
-    for key in ["price", "quantity"]:
-        try:
-            crop_data[key] = float(crop_data.get(key, 0) or 0)
-        except Exception:
-            crop_data[key] = 0.0
+def get_crops():
+    """
+    Fetch all crops.
+    Prefer get_crops_page() for anything request-facing.
+    """
+    return list(db.crops.find())
 
-    # Handle images
-    images = []
-    if "images" in crop_data and isinstance(crop_data["images"], list):
-        images = crop_data["images"]
-    elif "image" in crop_data and crop_data["image"]:
-        images = [crop_data["image"]]
 
-    if not images:
-        images = ["/static/default_crop.jpg"]
+# Keyset pagination over the catalog, newest first on (datetime, _id)
+CROP_PAGE_SIZE = int(os.getenv("CROP_PAGE_SIZE", "100"))
+CROP_PAGE_MAX = int(os.getenv("CROP_PAGE_MAX", "500"))
+CROP_SORT = [("datetime", -1), ("_id", -1)]
 
-    crop_data["images"] = images
-    crop_data["image"] = images[0]
 
-    # Defaults
-    crop_data["name"] = crop_data.get("name", "").strip() or "Unnamed"
-    crop_data["type"] = crop_data.get("type", "").strip() or "-"
-    crop_data["quality"] = crop_data.get("quality", "").strip() or "-"
-    crop_data["status"] = crop_data.get("status", "Available")
-    crop_data["sold"] = bool(crop_data.get("sold", False))
-    crop_data["notes"] = crop_data.get("notes", "").strip()
+def encode_crop_cursor(crop):
+    """
+    Opaque cursor for the (datetime, _id) position of a crop document.
+    """
+    raw = json_util.dumps([crop.get("datetime"), ObjectId(str(crop["_id"]))])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
 
-    # farmer_id may be provided as string; store as string to avoid accidental ObjectId conversions
-    # (frontend/session stores ids as strings). Keep it consistent.
-    if "farmer_id" in crop_data and isinstance(crop_data["farmer_id"], ObjectId):
-        crop_data["farmer_id"] = str(crop_data["farmer_id"])
 
-    return db.crops.insert_one(crop_data)
+def decode_crop_cursor(cursor):
+    """
+    Inverse of encode_crop_cursor(). Raises ValueError on a malformed cursor.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        dt, oid = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        if not isinstance(oid, ObjectId):
+            raise ValueError
+        return dt, oid
+    except Exception:
+        raise ValueError("Invalid cursor")
 
 
-def get_crops():
+def build_crop_query(status=None, sold=None, location=None, crop_type=None,
+                     farmer_id=None, min_price=None, max_price=None, name=None):
+    """
+    Translate catalog filters into a Mongo query.
+    status/crop_type accept comma separated values; location and name are
+    case-insensitive substring matches (the bidder portal search).
+    sold=False means still open: neither sold nor closed nor Expired (an
+    auction that ended without bids).
     """
-    Fetch all crops, normalized.
+    clauses = []
+    if status:
+        values = [v.strip() for v in status.split(",") if v.strip()]
+        clauses.append({"status": {"$in": values}})
+    if sold is not None:
+        if sold:
+            clauses.append({"$or": [{"sold": True}, {"status": "Closed"}]})
+        else:
+            clauses.append({"sold": {"$ne": True}, "status": {"$nin": CLOSED_STATUSES}})
+    if location:
+        clauses.append({"location": {"$regex": re.escape(location), "$options": "i"}})
+    if name:
+        clauses.append({"name": {"$regex": re.escape(name), "$options": "i"}})
+    if crop_type:
+        values = [v.strip() for v in crop_type.split(",") if v.strip()]
+        clauses.append({"type": {"$in": values}})
+    if farmer_id:
+        clauses.append({"farmer_id": str(farmer_id)})
+    price = {}
+    if min_price is not None:
+        price["$gte"] = float(min_price)
+    if max_price is not None:
+        price["$lte"] = float(max_price)
+    if price:
+        clauses.append({"price": price})
+
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def get_crops_page(query=None, cursor=None, limit=None, fields=None, near=None, within_km=None):
     """
-    crops = list(db.crops.find())
-    for c in crops:
-        c["_id"] = str(c["_id"])
-        if "images" not in c or not isinstance(c["images"], list):
-            c["images"] = [c.get("image", "/static/default_crop.jpg")]
-        c["image"] = c.get("image") or c["images"][0]
-    return crops
+    Fetch one page of crops matching `query`, newest first, or with
+    near=(lat, lon) nearest first (see crop_near_pipeline()).
+    `fields` is an optional list of field names to project; _id and datetime
+    are always included because the cursor is built from them.
+    Returns (crops, next_cursor) where next_cursor is None on the last page.
+    """
+    if near is not None:
+        pipeline, limit = crop_near_pipeline(query, near, within_km, cursor, limit, fields)
+        return split_near_page(list(db.crops.aggregate(pipeline)), limit)
+    query, projection, limit = crop_page_query(query, cursor, limit, fields)
+    # fetch one extra row to know whether another page exists
+    docs = list(db.crops.find(query, projection).sort(CROP_SORT).limit(limit + 1))
+    return split_crop_page(docs, limit)
+
+
+def crop_page_query(query=None, cursor=None, limit=None, fields=None):
+    """
+    (filter, projection, limit) for a catalog page; see get_crops_page().
+    Raises ValueError for a malformed cursor.
+    """
+    limit = min(max(int(limit or CROP_PAGE_SIZE), 1), CROP_PAGE_MAX)
+    query = dict(query or {})
+
+    if cursor:
+        dt, oid = decode_crop_cursor(cursor)
+        after = {"$or": [
+            {"datetime": {"$lt": dt}},
+            {"datetime": dt, "_id": {"$lt": oid}},
+        ]}
+        query = {"$and": [query, after]} if query else after
+
+    projection = None
+    if fields:
+        projection = {f: 1 for f in fields}
+        projection["datetime"] = 1
+    return query, projection, limit
+
+
+def split_crop_page(docs, limit):
+    """
+    (page, next_cursor) from the limit + 1 documents fetched for a page.
+    """
+    if len(docs) > limit:
+        docs = docs[:limit]
+        return docs, encode_crop_cursor(docs[-1])
+    return docs, None
+
+
+# Distance search: $geoNear over the 2dsphere index on geo, nearest first
+# on (distance, _id). The cursor carries the last row's distance, which
+# becomes the next page's minDistance, so a page never re-reads the crops
+# before it.
+NEAR_DEFAULT_KM = float(os.getenv("NEAR_DEFAULT_KM", "50"))
+NEAR_MAX_KM = float(os.getenv("NEAR_MAX_KM", "1000"))
+_NEAR_DISTANCE = "_distance"  # metres; replaced by distance_km in the rows
+
+
+def encode_near_cursor(crop):
+    raw = json_util.dumps([crop[_NEAR_DISTANCE], ObjectId(str(crop["_id"]))])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_near_cursor(cursor):
+    """
+    Inverse of encode_near_cursor(). Raises ValueError on a malformed cursor.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        distance, oid = json_util.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        if not isinstance(oid, ObjectId) or isinstance(distance, bool) \
+                or not isinstance(distance, (int, float)):
+            raise ValueError
+        return distance, oid
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def crop_near_pipeline(query=None, near=None, within_km=None, cursor=None, limit=None, fields=None):
+    """
+    (pipeline, limit) for a page of crops matching `query` within
+    `within_km` (default NEAR_DEFAULT_KM) of near=(lat, lon), nearest first.
+    Rows get distance_km (see split_near_page()). Raises ValueError.
+    """
+    limit = min(max(int(limit or CROP_PAGE_SIZE), 1), CROP_PAGE_MAX)
+    within_km = NEAR_DEFAULT_KM if within_km is None else float(within_km)
+    if not 0 < within_km <= NEAR_MAX_KM:
+        raise ValueError(f"within must be more than 0 and at most {NEAR_MAX_KM:g} km")
+
+    geo_near = {"near": geo_point(*near), "key": "geo", "spherical": True,
+                "distanceField": _NEAR_DISTANCE, "maxDistance": within_km * 1000}
+    if query:
+        geo_near["query"] = query
+    pipeline = [{"$geoNear": geo_near}]
+    if cursor:
+        distance, oid = decode_near_cursor(cursor)
+        geo_near["minDistance"] = distance
+        pipeline.append({"$match": {"$or": [
+            {_NEAR_DISTANCE: {"$gt": distance}},
+            {_NEAR_DISTANCE: distance, "_id": {"$gt": oid}},
+        ]}})
+    pipeline += [{"$sort": {_NEAR_DISTANCE: 1, "_id": 1}}, {"$limit": limit + 1}]
+    if fields:
+        pipeline.append({"$project": {**{f: 1 for f in fields}, "datetime": 1, _NEAR_DISTANCE: 1}})
+    return pipeline, limit
+
+
+def split_near_page(docs, limit):
+    """
+    (page, next_cursor) from the limit + 1 documents of a near pipeline,
+    with the distance in kilometres as distance_km.
+    """
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_near_cursor(docs[-1])
+    for doc in docs:
+        doc["distance_km"] = round(doc.pop(_NEAR_DISTANCE) / 1000, 3)
+    return docs, next_cursor
 
 
 def get_crop(crop_id):
     """
-    Fetch single crop by ID.
+    Fetch single crop by ID (read-through catalog_cache).
     """
+    cached = catalog_cache.get_crop(crop_id)
+    if cached is not None:
+        return json_util.loads(cached)
     try:
         crop = db.crops.find_one({"_id": ObjectId(crop_id)})
     except Exception:
         return None
 
     if crop:
-        crop["_id"] = str(crop["_id"])
-        if "images" not in crop or not isinstance(crop["images"], list):
-            crop["images"] = [crop.get("image", "/static/default_crop.jpg")]
-        crop["image"] = crop.get("image") or crop["images"][0]
+        catalog_cache.put_crop(crop_id, json_util.dumps(crop))
     return crop
 
 
 def update_crop(crop_id, crop_data):
     """
-    Update crop details.
+    Update crop details. Raises ModelError when a field has the wrong type.
     """
     crop_data.pop("_id", None)
-    crop_data["location"] = crop_data.get("location", "").strip() or "Not specified"
-
-    for key in ["price", "quantity"]:
-        if key in crop_data:
-            try:
-                crop_data[key] = float(crop_data[key])
-            except Exception:
-                crop_data[key] = 0.0
-
-    if "images" in crop_data and isinstance(crop_data["images"], list):
-        crop_data["image"] = crop_data["images"][0]
-
-    return db.crops.update_one({"_id": ObjectId(crop_id)}, {"$set": crop_data})
+    prepare_crop(crop_data, partial=True)
+    update = {}
+    if crop_data.get("geo", False) is None:
+        del crop_data["geo"]
+        update["$unset"] = {"geo": ""}
+    update["$set"] = Crop.to_set(crop_data)
+    result = db.crops.update_one({"_id": ObjectId(crop_id)}, update)
+    catalog_cache.invalidate(str(crop_id))
+    return result
 
 
 def delete_crop(crop_id):
     """
-    Delete crop by ID safely.
+    Soft delete: the crop moves to crop_deletions and leaves the catalog at
+    once. Its bids, messages, wishlist entries, ... and images are removed
+    later by purge_deleted_crops(). Returns the delete result, or None when
+    there is no such crop or on error.
     """
     try:
-        return db.crops.delete_one({"_id": ObjectId(crop_id)})
+        oid = ObjectId(crop_id)
+        crop = db.crops.find_one({"_id": oid})
+        if crop is None:
+            return None
+        # tombstone first: if the process dies in between, the purge still
+        # finds the crop and removes it with the rest
+        db.crop_deletions.replace_one(
+            {"_id": oid}, {"_id": oid, "crop": crop, "deleted_at": datetime.utcnow()}, upsert=True
+        )
+        result = db.crops.delete_one({"_id": oid})
+        catalog_cache.invalidate(str(crop_id))
+        return result
     except Exception as e:
         print("Error deleting crop:", e)
         return None
 
 
+# -------------------- DELETION CLEANUP --------------------
+
+# Collections whose documents belong to a crop (crop_id). Legacy `bids`
+# rows hold the id as a string, so both forms are matched.
+CROP_DEPENDENTS = ("bid_history", "bids", "messages", "wishlist", "won_crops", "auction_winners")
+CROP_PURGE_BATCH = int(os.getenv("CROP_PURGE_BATCH", "100"))
+ILLEGAL_OPERATION = 20  # server error code: transactions need a replica set
+
+_transactions = None  # unknown until the first attempt
+
+
+def _run_in_transaction(work):
+    """
+    Run work(session) in a transaction, or as work(None) on a standalone
+    server, which has none. Callers make every step idempotent, so a purge
+    interrupted without a transaction is completed by the next run.
+    """
+    global _transactions
+    if _transactions is not False:
+        try:
+            with get_client().start_session() as session:
+                session.with_transaction(work)
+            _transactions = True
+            return
+        except OperationFailure as e:
+            if e.code != ILLEGAL_OPERATION or _transactions:
+                raise
+            _transactions = False
+    work(None)
+
+
+def unreferenced_images(urls):
+    """
+    The media URLs in `urls` that no crop or profile uses any more.
+    """
+    urls = list(urls)
+    if not urls:
+        return []
+    used = set(db.crops.distinct("images", {"images": {"$in": urls}}))
+    used.update(db.crops.distinct("image", {"image": {"$in": urls}}))
+    used.update(db.users.distinct("profile_picture", {"profile_picture": {"$in": urls}}))
+    return [url for url in urls if url not in used]
+
+
+def purge_deleted_crops(batch_size=CROP_PURGE_BATCH):
+    """
+    Remove everything that refers to up to `batch_size` deleted crops in one
+    transaction, then delete their image files unless another crop (or a
+    profile) shares them. Returns the number of crops purged.
+    """
+    batch = list(db.crop_deletions.find({}, {"crop.images": 1, "crop.image": 1})
+                 .sort("deleted_at", 1).limit(batch_size))
+    if not batch:
+        return 0
+    ids = [entry["_id"] for entry in batch]
+    refs = ids + [str(oid) for oid in ids]
+
+    def work(session):
+        for name in CROP_DEPENDENTS:
+            db[name].delete_many({"crop_id": {"$in": refs}}, session=session)
+        db.crops.delete_many({"_id": {"$in": ids}}, session=session)
+        db.crop_deletions.delete_many({"_id": {"$in": ids}}, session=session)
+
+    _run_in_transaction(work)
+
+    urls = set()
+    for entry in batch:
+        crop = entry.get("crop") or {}
+        urls.update(u for u in (crop.get("images") or []) + [crop.get("image")]
+                    if image_store.media_digest(u))
+    for url in unreferenced_images(urls):
+        try:
+            image_store.delete_image(url)
+        except OSError as e:
+            print("Error deleting image:", url, e)
+    return len(ids)
+
+
 # -------------------- BIDS --------------------
 
+# The current high bid lives on the crop document (current_bid,
+# current_bidder_id, current_bidder_email, bid_count, last_bid_at) and is only
+# ever changed by the compare-and-set in place_bid(), so readers never need
+# a join. Every attempt is appended to bid_history, from which
+# reconcile_bid_fields() can rebuild the crop fields.
+
+BID_ACCEPTED = "accepted"
+BID_TOO_LOW = "too_low"
+BID_CLOSED = "closed"
+BID_NOT_FOUND = "not_found"
+BID_INVALID = "invalid"
+
+
 def place_bid(bid_data):
     """
-    Add new bid document.
-    Expected keys: crop_id (str), bidder_id (str), bid_price (float)
+    Place a bid with a single conditional update: it only applies while the
+    crop is open and the bid beats the current high bid, so concurrent
+    bidders can never overwrite a higher bid with a lower one.
+    Expected keys: crop_id (str), bidder_id (str), bid_price (number),
+    optional bidder_email.
+    Returns {"status": BID_*, "current_bid": float|None}. Accepted bids need
+    no reads; the rejection reason costs one projected read.
     """
     try:
-        bid_doc = {
-            "crop_id": ObjectId(bid_data["crop_id"]),
-            "bidder_id": ObjectId(bid_data["bidder_id"]),
-            "bid_price": float(bid_data["bid_price"]),
-            "timestamp": datetime.utcnow()
-        }
-        # Insert bid
-        res = db.bids.insert_one(bid_doc)
-        # Update crop current price and highest_bidder (store string for frontend convenience)
-        db.crops.update_one(
-            {"_id": ObjectId(bid_data["crop_id"])},
-            {"$set": {"price": float(bid_data["bid_price"]), "highest_bidder": str(bid_data["bidder_id"])}}
-        )
-        return res
-    except Exception as e:
-        print("Error placing bid:", e)
+        crop_oid = ObjectId(bid_data["crop_id"])
+        bid_price = float(bid_data["bid_price"])
+        bidder_id = str(bid_data["bidder_id"])
+    except Exception:
+        return {"status": BID_INVALID, "current_bid": None}
+    if not bid_price > 0:
+        return {"status": BID_INVALID, "current_bid": None}
+
+    now = datetime.utcnow()
+    result = db.crops.update_one(
+        {
+            "_id": crop_oid,
+            "status": {"$nin": CLOSED_STATUSES},
+            "sold": {"$ne": True},
+            "$or": [{"current_bid": None}, {"current_bid": {"$lt": bid_price}}],
+        },
+        {
+            "$set": {
+                "current_bid": bid_price,
+                "current_bidder_id": bidder_id,
+                "current_bidder_email": bid_data.get("bidder_email"),
+                "highest_bidder": bidder_id,
+                "last_bid_at": now,
+            },
+            "$inc": {"bid_count": 1},
+        },
+    )
+
+    if result.matched_count:
+        outcome = {"status": BID_ACCEPTED, "current_bid": bid_price}
+        catalog_cache.invalidate(str(crop_oid))
+    else:
+        crop = db.crops.find_one({"_id": crop_oid}, {"current_bid": 1, "status": 1, "sold": 1})
+        if not crop:
+            outcome = {"status": BID_NOT_FOUND, "current_bid": None}
+        elif crop.get("sold") or crop.get("status") in CLOSED_STATUSES:
+            outcome = {"status": BID_CLOSED, "current_bid": crop.get("current_bid")}
+        else:
+            outcome = {"status": BID_TOO_LOW, "current_bid": crop.get("current_bid")}
+
+    if outcome["status"] != BID_NOT_FOUND:
+        try:
+            Bid(
+                crop_id=crop_oid,
+                bidder_id=bidder_id,
+                bidder_email=bid_data.get("bidder_email"),
+                bid_price=bid_price,
+                accepted=outcome["status"] == BID_ACCEPTED,
+                timestamp=now,
+            ).insert(db)
+        except Exception as e:
+            print("Error recording bid history:", e)
+    return outcome
+
+
+def get_current_bid(crop_id):
+    """
+    Current high bid for a crop as {"bid_price", "bidder_id", "bidder_email"}
+    or None. See get_current_bids().
+    """
+    return get_current_bids([crop_id]).get(str(crop_id))
+
+
+def bid_from_crop(crop):
+    """
+    Current bid dict from a crop fetched with the current_bid* fields, or None.
+    """
+    if crop.get("current_bid") is None:
         return None
+    return {
+        "bid_price": crop["current_bid"],
+        "bidder_id": crop.get("current_bidder_id"),
+        "bidder_email": crop.get("current_bidder_email"),
+        "bid_count": crop.get("bid_count", 0),
+        "last_bid_at": crop.get("last_bid_at"),
+    }
+
+
+CURRENT_BID_FIELDS = ("current_bid", "current_bidder_id", "current_bidder_email", "bid_count", "last_bid_at")
+
+
+def get_current_bids(crop_ids, crops=None):
+    """
+    {crop_id: current bid or None} for many crops with one $in query on
+    crops, plus one on the legacy one-document-per-crop `bids` collection
+    for crops bid on before the bid engine existed. Pass already fetched
+    `crops` (with CURRENT_BID_FIELDS) to skip the first query.
+    """
+    ids = list(dict.fromkeys(str(c) for c in crop_ids))
+    result = dict.fromkeys(ids)
+    if crops is None:
+        oids = [oid for oid in (_as_object_id(c) for c in ids) if oid is not None]
+        crops = db.crops.find({"_id": {"$in": oids}}, {f: 1 for f in CURRENT_BID_FIELDS}) if oids else []
+    for crop in crops:
+        crop_id = str(crop["_id"])
+        if crop_id in result:
+            result[crop_id] = bid_from_crop(crop)
+
+    missing = [c for c, bid in result.items() if bid is None]
+    if missing:
+        merge_legacy_bids(result, db.bids.find({"crop_id": {"$in": missing}}, LEGACY_BID_FIELDS))
+    return result
+
+
+LEGACY_BID_FIELDS = {"crop_id": 1, "bid_price": 1, "bidder_id": 1, "bidder_email": 1}
+
+
+def merge_legacy_bids(result, legacy_rows):
+    """
+    Fill the crops in `result` that have no current bid from legacy `bids`
+    rows (crop_id is a string there).
+    """
+    for legacy in legacy_rows:
+        if result.get(legacy["crop_id"], False) is None:
+            result[legacy["crop_id"]] = {
+                "bid_price": legacy.get("bid_price"),
+                "bidder_id": legacy.get("bidder_id"),
+                "bidder_email": legacy.get("bidder_email"),
+            }
 
 
 def get_bids_for_crop(crop_id):
+    """
+    Accepted bids for a crop, highest first.
+    """
     try:
         oid = ObjectId(crop_id)
     except Exception:
         return []
 
-    bids = list(db.bids.find({"crop_id": oid}).sort("bid_price", -1))
-    for b in bids:
-        b["_id"] = str(b["_id"])
-        b["crop_id"] = str(b["crop_id"])
-        b["bidder_id"] = str(b["bidder_id"])
-        # convert timestamp to iso for API
-        if isinstance(b.get("timestamp"), datetime):
-            b["timestamp"] = b["timestamp"].isoformat()
-    return bids
+    return list(db.bid_history.find({"crop_id": oid, "accepted": True}).sort("bid_price", -1))
 
 
 def get_highest_bid(crop_id):
-    bids = get_bids_for_crop(crop_id)
-    return bids[0] if bids else None
+    return get_current_bid(crop_id)
 
 
-# -------------------- AUCTION WINNERS --------------------
-
-def set_auction_winner(crop_id, user_id, bid_price=None):
+def reconcile_bid_fields(crop_ids=None, batch_size=500):
     """
-    Persist winner record in auction_winners collection.
+    Rebuild current_bid, current_bidder_id, current_bidder_email, bid_count
+    and last_bid_at on crops from their accepted bid_history rows. A crop
+    whose current bid has since moved above the recomputed one is left
+    alone, so this is safe to run while bidding continues.
+    Returns the number of crops corrected.
     """
-    try:
-        db.auction_winners.update_one(
-            {"crop_id": ObjectId(crop_id)},
-            {
-                "$set": {
-                    "user_id": ObjectId(user_id),
-                    "assigned_at": datetime.utcnow(),
-                    "bid_price": float(bid_price) if bid_price is not None else None
-                }
-            },
-            upsert=True
-        )
-        return True
-    except Exception as e:
-        print("Error setting winner:", e)
-        return False
+    match = {"accepted": True}
+    if crop_ids is not None:
+        match["crop_id"] = {"$in": [oid for oid in (_as_object_id(c) for c in crop_ids) if oid is not None]}
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"crop_id": 1, "bid_price": -1, "timestamp": 1}},
+        {"$group": {
+            "_id": "$crop_id",
+            "bid_price": {"$first": "$bid_price"},
+            "bidder_id": {"$first": "$bidder_id"},
+            "bidder_email": {"$first": "$bidder_email"},
+            "bid_count": {"$sum": 1},
+            "last_bid_at": {"$max": "$timestamp"},
+        }},
+    ]
+    ops = []
+    fixed = 0
+    for row in db.bid_history.aggregate(pipeline, allowDiskUse=True):
+        ops.append(UpdateOne(
+            {"_id": row["_id"], "$or": [{"current_bid": None}, {"current_bid": {"$lte": row["bid_price"]}}]},
+            {"$set": {
+                "current_bid": row["bid_price"],
+                "current_bidder_id": row["bidder_id"],
+                "current_bidder_email": row["bidder_email"],
+                "highest_bidder": row["bidder_id"],
+                "bid_count": row["bid_count"],
+                "last_bid_at": row["last_bid_at"],
+            }},
+        ))
+        if len(ops) >= batch_size:
+            fixed += db.crops.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        fixed += db.crops.bulk_write(ops, ordered=False).modified_count
+    if fixed:
+        catalog_cache.clear()
+    return fixed
+
 
+# -------------------- AUCTION WINNERS --------------------
 
 def get_auction_winner(crop_id):
     try:
@@ -254,75 +791,166 @@ def get_auction_winner(crop_id):
     return row
 
 
-def determine_and_set_winner(crop_id):
+# -------------------- AUCTION CLOSING --------------------
+
+AUCTION_DURATION_SECONDS = int(os.getenv("AUCTION_DURATION_SECONDS", "300"))
+
+
+def auction_end_time(crop):
     """
-    Find the highest bid for a crop and set auction winner + create won_crops record.
-    Returns winner doc or None.
+    Naive-UTC end of a crop's auction (listing datetime + AUCTION_DURATION),
+    or None when the datetime cannot be parsed.
     """
-    try:
-        highest = db.bids.find({"crop_id": ObjectId(crop_id)}).sort("bid_price", -1).limit(1)
-        highest = list(highest)
-        if not highest:
-            return None
-        hb = highest[0]
-        user_id = str(hb["bidder_id"]) if isinstance(hb.get("bidder_id"), ObjectId) else str(hb.get("bidder_id"))
-        bid_price = float(hb.get("bid_price", 0))
-        # persist winner
-        ok = set_auction_winner(crop_id, user_id, bid_price)
-        if not ok:
-            print("Failed to persist auction winner")
-            return None
-        # mark crop as sold/closed
-        db.crops.update_one({"_id": ObjectId(crop_id)}, {"$set": {"status": "Closed", "sold": True}})
-        # add to won_crops
-        add_won_crop(user_id, crop_id, db.crops.find_one({"_id": ObjectId(crop_id)}).get("farmer_id"), bid_price)
-        return get_auction_winner(crop_id)
-    except Exception as e:
-        print("Error determining winner:", e)
+    start = parse_datetime(crop.get("datetime"))
+    if start is None:
         return None
+    return start + timedelta(seconds=AUCTION_DURATION_SECONDS)
+
+
+def get_open_auctions(ending_before=None):
+    """
+    (crop_id, end_time) for crops that are still open, optionally only those
+    ending before `ending_before` (naive UTC).
+    """
+    query = {"status": {"$nin": CLOSED_STATUSES}, "sold": {"$ne": True}}
+    if ending_before is not None:
+        query["datetime"] = {"$lte": ending_before - timedelta(seconds=AUCTION_DURATION_SECONDS)}
+    out = []
+    for crop in db.crops.find(query, {"datetime": 1}):
+        end = auction_end_time(crop)
+        if end is not None:
+            out.append((str(crop["_id"]), end))
+    return out
+
+
+CLOSE_ATTEMPTS = 3
+
+
+def close_auctions(crop_ids):
+    """
+    Close a batch of auctions exactly once. Each transition is conditional
+    on the crop still being open with the current bid that was read, so a
+    bid landing between the read and the write (or another worker closing
+    the crop) makes it miss; the crop is then re-read and tried again, up to
+    CLOSE_ATTEMPTS times. won_crops / auction_winners rows are written and
+    results returned only for the transitions that matched, so running this
+    twice (or from several workers) writes nothing new.
+    Returns a list of {"crop_id", "user_id", "bidder_email", "bid_price"} for
+    the auctions this call closed (user_id None when nobody bid).
+    """
+    pending = [oid for oid in (_as_object_id(c) for c in crop_ids) if oid is not None]
+    won_ops, winner_ops, closed = [], [], []
+    for _ in range(CLOSE_ATTEMPTS):
+        if not pending:
+            break
+        crops = list(db.crops.find(
+            {"_id": {"$in": pending}, "status": {"$nin": CLOSED_STATUSES}, "sold": {"$ne": True}},
+            {"farmer_id": 1, "current_bid": 1, "current_bidder_id": 1, "current_bidder_email": 1},
+        ))
+        bids = get_current_bids([c["_id"] for c in crops], crops=crops) if crops else {}  # legacy rows in one query
+        now = datetime.utcnow()
+        pending = []
+        for crop in crops:
+            crop_id = str(crop["_id"])
+            bid = bids[crop_id]
+            won = winner = None
+            if bid:
+                update = {"status": "Closed", "sold": True, "closed_at": now,
+                          "winner": bid.get("bidder_email"), "winner_id": bid["bidder_id"],
+                          "sold_price": bid["bid_price"]}
+                try:
+                    won = WonCrop(user_id=bid["bidder_id"], crop_id=crop["_id"], bid_price=bid["bid_price"],
+                                  farmer_id=crop.get("farmer_id") or None, won_at=now).to_bson()
+                    winner = AuctionWinner(crop_id=crop["_id"], user_id=bid["bidder_id"],
+                                           bidder_email=bid.get("bidder_email"), bid_price=bid["bid_price"],
+                                           assigned_at=now).to_bson()
+                except ModelError as e:  # a legacy bidder id; the crop still records the winner
+                    print(f"Not recording the win on crop {crop_id}: {e}")
+            else:
+                update = {"status": "Expired", "sold": False, "closed_at": now}
+            result = db.crops.update_one(
+                {"_id": crop["_id"], "status": {"$nin": CLOSED_STATUSES}, "sold": {"$ne": True},
+                 "current_bid": crop.get("current_bid")},
+                {"$set": update},
+            )
+            if not result.matched_count:
+                pending.append(crop["_id"])  # outbid or closed elsewhere since the read
+                continue
+
+            if won is not None:
+                won_ops.append(UpdateOne({"user_id": won["user_id"], "crop_id": won["crop_id"]},
+                                         {"$setOnInsert": won}, upsert=True))
+                winner_ops.append(UpdateOne({"crop_id": winner["crop_id"]},
+                                            {"$setOnInsert": winner}, upsert=True))
+            closed.append({"crop_id": crop_id,
+                           "user_id": bid["bidder_id"] if bid else None,
+                           "bidder_email": bid.get("bidder_email") if bid else None,
+                           "bid_price": bid["bid_price"] if bid else None})
+
+    if closed:
+        catalog_cache.invalidate(*(c["crop_id"] for c in closed))
+    if won_ops:
+        db.won_crops.bulk_write(won_ops, ordered=False)
+        db.auction_winners.bulk_write(winner_ops, ordered=False)
+    return closed
 
 
 # -------------------- WON CROPS (BIDDER'S WON CROPS) --------------------
 
-def add_won_crop(user_id, crop_id, farmer_id, bid_price, won_at=None):
-    try:
-        doc = {
-            "user_id": ObjectId(user_id),       # bidder id
-            "farmer_id": ObjectId(farmer_id) if farmer_id is not None else None,
-            "crop_id": ObjectId(crop_id),
-            "bid_price": float(bid_price),
-            "won_at": won_at or datetime.utcnow()
-        }
-        return db.won_crops.insert_one(doc)
-    except Exception as e:
-        print(f"Error adding won crop: {e}")
-        return None
+# Crop fields the bidder portal renders for a won lot
+WON_CROP_FIELDS = ("name", "quantity", "quality", "image", "images", "thumbnail",
+                   "location", "datetime", "farmer_name")
 
 
-def get_won_crops_for_user(user_id):
+def _as_object_id(value):
     try:
-        user_obj_id = ObjectId(user_id)
+        return value if isinstance(value, ObjectId) else ObjectId(str(value))
     except Exception:
-        return []
+        return None
 
-    won_list = list(db.won_crops.find({"user_id": user_obj_id}).sort("won_at", -1))
-    # Populate crop details in each won crop entry
-    for entry in won_list:
-        entry["_id"] = str(entry["_id"])
-        entry["user_id"] = str(entry["user_id"])
-        entry["crop_id"] = str(entry["crop_id"])
-        # fetch crop details safely
-        try:
-            crop = db.crops.find_one({"_id": ObjectId(entry["crop_id"])})
-            if crop:
-                crop["_id"] = str(crop["_id"])
-                entry["crop"] = crop
-        except Exception:
-            entry["crop"] = None
-        # convert won_at to iso
-        if isinstance(entry.get("won_at"), datetime):
-            entry["won_at"] = entry["won_at"].isoformat()
-    return won_list
+
+def join_crops(entries, key="crop_id", fields=None, target="crop"):
+    """
+    Attach crop documents to `entries` (list of dicts holding a crop id under
+    `key`) with a single $in query instead of one find_one per entry.
+    Entries whose crop is gone get target=None. Returns entries.
+    """
+    wanted = {}
+    for entry in entries:
+        oid = _as_object_id(entry.get(key))
+        if oid is not None:
+            wanted[oid] = None
+    projection = {f: 1 for f in fields} if fields else None
+
+    crops = {}
+    if wanted:
+        for crop in db.crops.find({"_id": {"$in": list(wanted)}}, projection):
+            crops[crop["_id"]] = crop
+
+    for entry in entries:
+        entry[target] = crops.get(_as_object_id(entry.get(key)))
+    return entries
+
+
+def save_won_crop(user_id, crop_id, bid_price, farmer_id=None):
+    """
+    Record (or update the price of) a won lot. Raises ModelError for bad ids.
+    """
+    won = WonCrop(user_id=user_id, crop_id=crop_id, farmer_id=farmer_id, bid_price=bid_price).to_bson()
+    won_at = won.pop("won_at")
+    return db.won_crops.update_one(
+        {"user_id": won["user_id"], "crop_id": won["crop_id"]},
+        {"$set": won, "$setOnInsert": {"won_at": won_at}},
+        upsert=True,
+    )
+
+
+def get_won_crops_for_user(user_id, fields=WON_CROP_FIELDS):
+    oid = _as_object_id(user_id)
+    if oid is None:
+        return []
+    won_list = list(db.won_crops.find({"user_id": oid}).sort("won_at", -1))
+    return join_crops(won_list, fields=fields)
 
 # ----------- DELETE WON CROPS --------
 def delete_won_crop(user_id, crop_id):
@@ -332,8 +960,8 @@ def delete_won_crop(user_id, crop_id):
     """
     try:
         result = db.won_crops.delete_one({
-            "user_id": str(user_id),
-            "crop_id": str(crop_id)
+            "user_id": ObjectId(user_id),
+            "crop_id": ObjectId(crop_id)
         })
         return result.deleted_count > 0
     except Exception as e:
@@ -342,6 +970,58 @@ def delete_won_crop(user_id, crop_id):
 
 
 
+# -------------------- WISHLIST --------------------
+
+WISHLIST_PAGE_SIZE = int(os.getenv("WISHLIST_PAGE_SIZE", "50"))
+WISHLIST_PAGE_MAX = 200
+WISHLIST_CROP_FIELDS = ("name", "price", "quantity", "quality", "image", "thumbnail",
+                        "location", "datetime", "status", "sold", "farmer_id", "farmer_name")
+
+
+def get_wishlist_page(user_id, page=1, limit=None, fields=WISHLIST_CROP_FIELDS):
+    """
+    One aggregation round trip for a page of a user's wishlist, newest first,
+    with the projected crop joined in and the total row count.
+    Returns (items, total). Raises ValueError for an invalid user id.
+    """
+    user_oid = _as_object_id(user_id)
+    if user_oid is None:
+        raise ValueError("Invalid user ID")
+    limit = min(max(int(limit or WISHLIST_PAGE_SIZE), 1), WISHLIST_PAGE_MAX)
+    page = max(int(page or 1), 1)
+
+    crop_projection = {f: 1 for f in fields}
+    pipeline = [
+        {"$match": {"user_id": user_oid}},
+        {"$sort": {"added_at": -1, "_id": -1}},
+        {"$facet": {
+            "items": [
+                {"$skip": (page - 1) * limit},
+                {"$limit": limit},
+                {"$lookup": {
+                    "from": "crops",
+                    "let": {"crop_id": "$crop_id"},
+                    "pipeline": [
+                        {"$match": {"$expr": {"$eq": ["$_id", "$$crop_id"]}}},
+                        {"$project": crop_projection},
+                    ],
+                    "as": "crop",
+                }},
+                {"$unwind": {"path": "$crop", "preserveNullAndEmptyArrays": True}},
+                {"$project": {"crop_id": 1, "user_id": 1, "added_at": 1, "crop": 1}},
+            ],
+            "total": [{"$count": "count"}],
+        }},
+    ]
+    result = next(db.wishlist.aggregate(pipeline), {"items": [], "total": []})
+    total = result["total"][0]["count"] if result["total"] else 0
+
+    items = result["items"]
+    for row in items:
+        row.setdefault("crop", None)
+    return items, total
+
+
 # -------------------- CHAT / MESSAGES --------------------
 
 def send_message(crop_id, sender_id, receiver_id, message):
@@ -349,51 +1029,215 @@ def send_message(crop_id, sender_id, receiver_id, message):
     Insert a chat message into 'messages' collection (app.py expects db.messages).
     """
     try:
-        doc = {
-            "crop_id": ObjectId(crop_id),
-            "sender_id": ObjectId(sender_id),
-            "receiver_id": ObjectId(receiver_id),
-            "message": str(message),
-            "timestamp": datetime.utcnow()
-        }
-        return db.messages.insert_one(doc)
+        msg = Message(
+            crop_id=crop_id,
+            sender_id=sender_id,
+            receiver_id=receiver_id,
+            message=str(message),
+        )
+        return msg.insert(db)
     except Exception as e:
         print("Error sending message:", e)
         return None
 
 
-def get_messages_for_crop(crop_id):
+# Messages are written by several workers, each stamping its own clock, and
+# one can become visible after a later one was already read. A poll for
+# `since` therefore re-reads MESSAGE_SINCE_OVERLAP seconds before it;
+# clients drop the repeats by _id.
+MESSAGE_SINCE_OVERLAP = float(os.getenv("MESSAGE_SINCE_OVERLAP", "5"))
+
+
+def _message_since_query(since):
+    """
+    `since` is the timestamp of the newest message a client has (ISO 8601)
+    or, from older clients, its _id (the ObjectId's creation time is used).
+    Raises ValueError for anything else.
+    """
+    if ObjectId.is_valid(since):
+        ts = ObjectId(since).generation_time
+    else:
+        try:
+            ts = datetime.fromisoformat(since.replace("Z", "+00:00"))
+        except (AttributeError, ValueError):
+            raise ValueError("Invalid since parameter")
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)  # stored as naive UTC
+    return {"timestamp": {"$gte": ts - timedelta(seconds=MESSAGE_SINCE_OVERLAP)}}
+
+
+def get_messages_for_crop(crop_id, since=None):
+    """
+    Cursor over a crop's messages in send order, documents as stored (see
+    streaming.py for encoding). With `since` only newer messages are
+    returned, so pollers fetch deltas instead of the whole conversation.
+    """
+    query = message_query(crop_id, since)
+    if query is None:
+        return iter(())
+    return db.messages.find(query).sort(MESSAGE_SORT)
+
+
+MESSAGE_SORT = [("timestamp", 1), ("_id", 1)]
+
+
+def message_query(crop_id, since=None):
+    """
+    Filter for get_messages_for_crop(); None for an invalid crop id.
+    Raises ValueError for a malformed `since`.
+    """
     try:
         oid = ObjectId(crop_id)
     except Exception:
-        return []
+        return None
 
-    msgs = list(db.messages.find({"crop_id": oid}).sort("timestamp", 1))
-    for m in msgs:
-        m["_id"] = str(m["_id"])
-        m["crop_id"] = str(m["crop_id"])
-        m["sender_id"] = str(m["sender_id"])
-        m["receiver_id"] = str(m["receiver_id"])
-        if isinstance(m.get("timestamp"), datetime):
-            m["timestamp"] = m["timestamp"].isoformat()
-    return msgs
+    query = {"crop_id": oid}
+    if since:
+        query.update(_message_since_query(since))
+    return query
 
 
 # -------------------- UTILITIES --------------------
 
+# One entry per access path in app.py / crud.py:
+# (collection, keys, options). Keep CANONICAL_QUERIES below in sync.
+INDEXES = [
+    # login / registration lookup
+    ("users", [("email", 1)], {"unique": True, "name": "email_unique"}),
+    # catalog keyset pagination (newest first), optionally per farmer / status / type
+    ("crops", [("datetime", -1), ("_id", -1)], {}),
+    ("crops", [("farmer_id", 1), ("datetime", -1), ("_id", -1)], {}),
+    ("crops", [("status", 1), ("datetime", -1), ("_id", -1)], {}),
+    ("crops", [("type", 1), ("datetime", -1), ("_id", -1)], {}),
+    ("crops", [("price", 1)], {}),
+    # distance search (?near=)
+    ("crops", [("geo", "2dsphere")], {}),
+    # open auctions for the scheduler
+    ("crops", [("status", 1), ("datetime", 1)], {}),
+    # image garbage collection: is a media URL still in use?
+    ("crops", [("images", 1)], {}),
+    ("crops", [("image", 1)], {}),
+    ("users", [("profile_picture", 1)], {"sparse": True}),
+    # legacy current-bid rows, keyed by string crop_id
+    ("bids", [("crop_id", 1), ("bid_price", -1)], {}),
+    ("bid_history", [("crop_id", 1), ("accepted", 1), ("bid_price", -1)], {}),
+    ("messages", [("crop_id", 1), ("timestamp", 1), ("_id", 1)], {}),
+    ("auction_winners", [("crop_id", 1)], {"unique": True, "name": "crop_id_unique"}),
+    ("won_crops", [("user_id", 1), ("won_at", -1)], {}),
+    ("won_crops", [("user_id", 1), ("crop_id", 1)], {"unique": True, "name": "user_crop_unique"}),
+    ("wishlist", [("user_id", 1), ("added_at", -1), ("_id", -1)], {}),
+    ("wishlist", [("user_id", 1), ("crop_id", 1)], {"unique": True, "name": "user_crop_unique"}),
+    # purge_deleted_crops(): dependents by crop, oldest deletions first
+    ("won_crops", [("crop_id", 1)], {}),
+    ("wishlist", [("crop_id", 1)], {}),
+    ("crop_deletions", [("deleted_at", 1)], {}),
+]
+
+# Indexes an earlier version created that no query uses any more;
+# ensure_indexes() drops them. (collection, keys)
+OBSOLETE_INDEXES = [
+    # chat polls by timestamp now, not by since=<_id>
+    ("messages", [("crop_id", 1), ("_id", 1)]),
+]
+
+
 def ensure_indexes():
     """
-    Create helpful indexes.
+    Create every index in INDEXES and drop OBSOLETE_INDEXES. Safe to run
+    on each start; existing indexes are left alone. A failing index (e.g. a unique index over
+    duplicate data) is reported and does not stop the others; an
+    unreachable server stops the run after the first attempt.
+    Returns a list of (collection, keys, error) for the failures.
     """
-    try:
-        db.crops.create_index("datetime")
-        db.crops.create_index("location")
-        db.bids.create_index([("crop_id", 1), ("bid_price", -1)])
-        db.messages.create_index([("crop_id", 1), ("timestamp", 1)])
-        db.auction_winners.create_index("crop_id")
-        db.won_crops.create_index([("user_id", 1), ("won_at", -1)])
-    except Exception as e:
-        print("Index creation failed:", e)
+    failures = []
+    for position, (collection, keys, options) in enumerate(INDEXES):
+        try:
+            db[collection].create_index(keys, **options)
+        except ConnectionFailure as e:
+            print(f"Index creation stopped, MongoDB not reachable: {e}")
+            failures.extend((c, k, str(e)) for c, k, _ in INDEXES[position:])
+            break
+        except Exception as e:
+            print(f"Index creation failed on {collection} {keys}: {e}")
+            failures.append((collection, keys, str(e)))
+    else:
+        for collection, keys in OBSOLETE_INDEXES:
+            try:
+                db[collection].drop_index(keys)
+            except OperationFailure:
+                pass  # never created, or dropped already
+    return failures
+
+
+# Representative shape of every query the app issues:
+# (name, collection, filter, sort). Values are placeholders; only the
+# shape matters to the planner.
+_SAMPLE_ID = ObjectId("000000000000000000000000")
+_SAMPLE_TIME = datetime(2030, 1, 1)
+CANONICAL_QUERIES = [
+    ("user by email", "users", {"email": "x@example.com"}, None),
+    ("usernames by id", "users", {"_id": {"$in": [_SAMPLE_ID]}}, None),
+    ("catalog page", "crops", {}, CROP_SORT),
+    ("catalog next page", "crops", {"$or": [{"datetime": {"$lt": _SAMPLE_TIME}},
+                                           {"datetime": _SAMPLE_TIME, "_id": {"$lt": _SAMPLE_ID}}]}, CROP_SORT),
+    ("catalog by farmer", "crops", {"farmer_id": "x"}, CROP_SORT),
+    ("catalog by status", "crops", {"status": {"$in": ["Available"]}}, CROP_SORT),
+    ("catalog by type", "crops", {"type": {"$in": ["Vegetable"]}}, CROP_SORT),
+    ("catalog unsold", "crops", {"sold": {"$ne": True}, "status": {"$nin": CLOSED_STATUSES}}, CROP_SORT),
+    ("crop by id", "crops", {"_id": _SAMPLE_ID}, None),
+    ("crops by ids", "crops", {"_id": {"$in": [_SAMPLE_ID]}}, None),
+    ("crops near a point", "crops", {"geo": {"$nearSphere": {
+        "$geometry": {"type": "Point", "coordinates": [0.0, 0.0]}, "$maxDistance": 1000}}}, None),
+    ("open auctions", "crops", {"status": {"$nin": CLOSED_STATUSES}, "sold": {"$ne": True},
+                                "datetime": {"$lte": _SAMPLE_TIME}}, None),
+    ("legacy current bid", "bids", {"crop_id": "x"}, None),
+    ("accepted bids", "bid_history", {"crop_id": _SAMPLE_ID, "accepted": True}, [("bid_price", -1)]),
+    ("messages for crop", "messages", {"crop_id": _SAMPLE_ID}, [("timestamp", 1), ("_id", 1)]),
+    ("messages since", "messages", {"crop_id": _SAMPLE_ID, "timestamp": {"$gte": _SAMPLE_TIME}},
+     [("timestamp", 1), ("_id", 1)]),
+    ("auction winner", "auction_winners", {"crop_id": _SAMPLE_ID}, None),
+    ("won crops for user", "won_crops", {"user_id": _SAMPLE_ID}, [("won_at", -1)]),
+    ("won crop row", "won_crops", {"user_id": _SAMPLE_ID, "crop_id": _SAMPLE_ID}, None),
+    ("wishlist for user", "wishlist", {"user_id": _SAMPLE_ID}, [("added_at", -1), ("_id", -1)]),
+    ("wishlist row", "wishlist", {"user_id": _SAMPLE_ID, "crop_id": _SAMPLE_ID}, None),
+]
+
+
+def _plan_stages(node):
+    """
+    Yield every "stage" name in an explain() document, whatever the engine
+    (classic or slot based) nests them under.
+    """
+    if isinstance(node, dict):
+        if isinstance(node.get("stage"), str):
+            yield node["stage"]
+        for value in node.values():
+            yield from _plan_stages(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _plan_stages(value)
+
+
+def check_query_plans():
+    """
+    explain() every canonical query and report the ones whose winning plan
+    is a collection scan. Returns a list of (name, stages) for offenders.
+    """
+    offenders = []
+    for name, collection, query, sort in CANONICAL_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            plan = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        except OperationFailure as e:
+            # e.g. $nearSphere without its geo index
+            offenders.append((name, [f"error: {e}"]))
+            continue
+        stages = list(_plan_stages(plan))
+        if "COLLSCAN" in stages:
+            offenders.append((name, stages))
+    return offenders
 
 
 # ------------------ END OF crud.py ------------------
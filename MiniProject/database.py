@@ -0,0 +1,264 @@
+# ------------------ database.py ------------------
+# The one MongoClient (and connection pool) of a process.
+#
+# The client is created lazily on first use and re-created after a fork, so
+# pre-forking servers never share sockets between workers. Everything else
+# goes through `db`, a thin proxy that resolves to the current database.
+#
+# The async API (asgi.py) has a second, asyncio client with the same
+# options: get_async_db(). It is bound to the event loop that created it.
+#
+# Configuration (environment):
+#   MONGO_URI, DB_NAME
+#   MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_MS,
+#   MONGO_WAIT_QUEUE_TIMEOUT_MS, MONGO_CONNECT_TIMEOUT_MS,
+#   MONGO_SOCKET_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS,
+#   MONGO_READ_PREFERENCE (primary, primaryPreferred, secondary, ...),
+#   MONGO_WRITE_CONCERN (w value: 1, majority, ...), MONGO_JOURNAL (0/1)
+
+import os
+import threading
+
+from dotenv import load_dotenv
+from pymongo import MongoClient, monitoring
+from pymongo.write_concern import WriteConcern
+
+load_dotenv()
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "crop_db")
+
+
+def _int_env(name, default=None):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def client_options():
+    """
+    Keyword arguments for MongoClient built from the environment.
+    """
+    options = {
+        "maxPoolSize": _int_env("MONGO_MAX_POOL_SIZE", 100),
+        "minPoolSize": _int_env("MONGO_MIN_POOL_SIZE", 0),
+        "maxIdleTimeMS": _int_env("MONGO_MAX_IDLE_MS"),
+        "waitQueueTimeoutMS": _int_env("MONGO_WAIT_QUEUE_TIMEOUT_MS"),
+        "connectTimeoutMS": _int_env("MONGO_CONNECT_TIMEOUT_MS", 5000),
+        "socketTimeoutMS": _int_env("MONGO_SOCKET_TIMEOUT_MS"),
+        "serverSelectionTimeoutMS": _int_env("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000),
+        "readPreference": os.getenv("MONGO_READ_PREFERENCE", "primary"),
+        # sockets are opened on first use, never before a fork
+        "connect": False,
+    }
+    return {k: v for k, v in options.items() if v is not None}
+
+
+def write_concern():
+    w = os.getenv("MONGO_WRITE_CONCERN")
+    journal = os.getenv("MONGO_JOURNAL")
+    if not w and journal is None:
+        return None
+    if w and w.isdigit():
+        w = int(w)
+    return WriteConcern(w=w or None, j=journal == "1" if journal is not None else None)
+
+
+# -------------------- POOL METRICS --------------------
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """
+    Counts connection pool events. Hooks registered with add_metrics_hook()
+    are called as hook(event_name, stats_snapshot) on every pool event.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hooks = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = {
+                "connections_created": 0,
+                "connections_closed": 0,
+                "checked_out": 0,
+                "checked_in": 0,
+                "checkout_failed": 0,
+                "pools_cleared": 0,
+            }
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.counts)
+        stats["open"] = stats["connections_created"] - stats["connections_closed"]
+        stats["in_use"] = stats["checked_out"] - stats["checked_in"]
+        return stats
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+            hooks = list(self._hooks)
+        if hooks:
+            stats = self.snapshot()
+            for hook in hooks:
+                try:
+                    hook(key, stats)
+                except Exception as e:
+                    print("Pool metrics hook failed:", e)
+
+    def add_hook(self, hook):
+        with self._lock:
+            self._hooks.append(hook)
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_check_out_started(self, event): pass
+    def connection_ready(self, event): pass
+
+    def pool_cleared(self, event):
+        self._count("pools_cleared")
+
+    def connection_created(self, event):
+        self._count("connections_created")
+
+    def connection_closed(self, event):
+        self._count("connections_closed")
+
+    def connection_check_out_failed(self, event):
+        self._count("checkout_failed")
+
+    def connection_checked_out(self, event):
+        self._count("checked_out")
+
+    def connection_checked_in(self, event):
+        self._count("checked_in")
+
+
+pool_stats = PoolStats()
+_event_listeners = [pool_stats]
+
+
+def add_metrics_hook(hook):
+    """
+    Register hook(event_name, stats) for connection pool events.
+    """
+    pool_stats.add_hook(hook)
+
+
+def add_event_listener(listener):
+    """
+    Register an extra pymongo event listener. Must happen before the client
+    is first used in this process.
+    """
+    _event_listeners.append(listener)
+
+
+# -------------------- CLIENT --------------------
+
+_client = None
+_client_pid = None
+_database = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                # a client inherited across fork is abandoned, never reused
+                _client = MongoClient(MONGO_URI, event_listeners=list(_event_listeners), **client_options())
+                _client_pid = pid
+                pool_stats.reset()
+    return _client
+
+
+def get_db(name=None):
+    global _database
+    client = get_client()
+    if name and name != DB_NAME:
+        return client.get_database(name, write_concern=write_concern())
+    database = _database
+    if database is None or database.client is not client:
+        database = _database = client.get_database(DB_NAME, write_concern=write_concern())
+    return database
+
+
+def close_client():
+    """
+    Close this process' client (e.g. on worker shutdown). The next use
+    creates a fresh one.
+    """
+    global _client, _client_pid, _database
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+        _database = None
+
+
+class _LazyDatabase:
+    """
+    Stands in for a pymongo Database; every attribute access resolves the
+    current process' client so module level `db` imports stay fork safe.
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+    def __getitem__(self, name):
+        return get_db()[name]
+
+    def __repr__(self):
+        return f"<lazy database {DB_NAME!r}>"
+
+
+db = _LazyDatabase()
+
+
+# -------------------- ASYNC CLIENT --------------------
+# pymongo's own asyncio client (pymongo >= 4.9), or Motor on older drivers.
+# Neither is needed unless the async API is served.
+
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient as AsyncMongoClient
+    except ImportError:
+        AsyncMongoClient = None
+
+_async_client = None
+_async_client_pid = None
+
+
+def get_async_client():
+    """
+    This process' asyncio client. Call it from the event loop that serves
+    the async API.
+    """
+    global _async_client, _async_client_pid
+    if AsyncMongoClient is None:
+        raise RuntimeError("The async API needs pymongo >= 4.9 or motor")
+    pid = os.getpid()
+    if _async_client is None or _async_client_pid != pid:
+        _async_client = AsyncMongoClient(MONGO_URI, event_listeners=list(_event_listeners), **client_options())
+        _async_client_pid = pid
+    return _async_client
+
+
+def get_async_db():
+    return get_async_client().get_database(DB_NAME, write_concern=write_concern())
+
+
+async def close_async_client():
+    global _async_client, _async_client_pid
+    client, _async_client, _async_client_pid = _async_client, None, None
+    if client is not None:
+        closed = client.close()
+        if closed is not None:  # a coroutine on pymongo's client, None on motor's
+            await closed
+
+# ------------------ END OF database.py ------------------
@@ -0,0 +1,85 @@
+# ------------------ gunicorn.conf.py ------------------
+# Production server settings:
+#
+#     gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Pre-forked workers, each with a thread pool (gthread): pymongo and bcrypt
+# block. Live updates (/api/stream) and the polling endpoints belong on the
+# async server next to this one (uvicorn asgi:app, see asgi.py); a stream
+# that does reach a worker here takes one of its SSE_MAX_STREAMS slots
+# (default 2 of the GUNICORN_THREADS) and gets a 503 once they are taken,
+# so streams can never occupy the threads API requests need.
+#
+# The app is imported once in the master (preload_app), which opens no
+# connections and starts no threads. Each worker drops whatever it
+# inherited, starts its own background threads (index creation, scheduler,
+# cleanup) and warms up (Mongo pool, templates, catalog cache) before it
+# accepts a connection, so a fresh worker does not serve its first requests
+# cold.
+#
+# Graceful reload: `kill -HUP <master>` starts new workers, lets them warm
+# up and retires the old ones after their in-flight requests (at most
+# graceful_timeout; SSE clients reconnect by themselves). With preload_app
+# new code needs a binary upgrade (USR2, then QUIT the old master) or
+# GUNICORN_PRELOAD=0, which makes HUP re-import the app.
+#
+# With more than one worker the catalog cache has to be shared:
+# CACHE_BACKEND=redis, or CATALOG_CACHE=0 to run without it (cache.py).
+#
+# Environment: BIND or PORT, WEB_CONCURRENCY (workers), GUNICORN_THREADS,
+# GUNICORN_TIMEOUT, GUNICORN_GRACEFUL_TIMEOUT, GUNICORN_MAX_REQUESTS,
+# GUNICORN_PRELOAD, plus WARMUP_PATHS / WARMUP_CONNECTIONS and
+# SSE_MAX_STREAMS (see app.py).
+
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(multiprocessing.cpu_count() * 2 + 1, 8))))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+# recycle workers now and then (0 = never); jitter keeps them from restarting together
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+errorlog = "-"
+# heartbeat files on tmpfs, so a slow disk can not get workers killed
+worker_tmp_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def on_starting(server):
+    # a RuntimeError here stops the master with its message
+    from cache import require_shared_cache
+
+    require_shared_cache(server.cfg.workers)
+
+
+def post_fork(server, worker):
+    import database
+    from realtime import broker
+
+    database.close_client()  # never share the master's sockets
+    broker.after_fork()
+
+
+def post_worker_init(worker):
+    # runs in the worker before it starts accepting connections
+    import app
+
+    app.start_background()
+    seconds = app.warm_up()
+    worker.log.info("Worker %s warmed up in %.0f ms", worker.pid, seconds * 1000)
+
+
+def worker_exit(server, worker):
+    import app
+
+    app.stop_background()
+
+# ------------------ END OF gunicorn.conf.py ------------------
@@ -0,0 +1,406 @@
+# ------------------ images.py ------------------
+# Content-addressed image store for crop photos.
+#
+# Images arrive either as data: URLs (JSON clients) or multipart uploads.
+# Uploads are streamed to disk in chunks while being hashed, fsynced, and
+# renamed to MEDIA_ROOT under their sha256, so identical photos are stored
+# once. Thumbnails are rendered afterwards on a background pool; their URLs
+# are known up front, so callers return as soon as the original is durable.
+# Crop documents only keep the short URLs returned from here.
+#
+# Configuration (environment): MEDIA_ROOT, MEDIA_URL, THUMBNAIL_SIZES,
+# MAX_IMAGE_BYTES (per image, default 10 MiB), IMAGE_WORKERS (default 2),
+# IMAGE_GC_GRACE_SECONDS (default 3600, see delete_image).
+
+import base64
+import binascii
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+try:
+    from PIL import Image
+except ImportError:  # thumbnails are skipped without Pillow
+    Image = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", os.path.join(BASE_DIR, "static", "media"))
+MEDIA_URL = os.getenv("MEDIA_URL", "/static/media")
+THUMBNAIL_SIZES = tuple(int(s) for s in os.getenv("THUMBNAIL_SIZES", "160,480").split(","))
+DEFAULT_IMAGE = "/static/default_crop.jpg"
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_GC_GRACE_SECONDS = float(os.getenv("IMAGE_GC_GRACE_SECONDS", "3600"))
+CHUNK_SIZE = 64 * 1024
+
+# the stored extension comes from the content, never from the client
+_SIGNATURES = [
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+]
+
+
+class ImageError(ValueError):
+    """Raised for payloads that are not a decodable image."""
+
+
+class ImageTooLarge(ImageError):
+    """Raised when an image exceeds the size limit."""
+
+
+def is_data_url(s):
+    return isinstance(s, str) and s.startswith("data:")
+
+
+def decode_data_url(s):
+    """
+    Split a base64 data URL into (bytes, mime type).
+    """
+    try:
+        header, payload = s.split(",", 1)
+    except ValueError:
+        raise ImageError("Malformed data URL")
+    mime = header[5:].split(";", 1)[0] or "application/octet-stream"
+    if ";base64" not in header:
+        raise ImageError("Only base64 data URLs are supported")
+    try:
+        return base64.b64decode(payload, validate=False), mime
+    except (binascii.Error, ValueError):
+        raise ImageError("Invalid base64 payload")
+
+
+def sniff_extension(head):
+    """
+    File extension for the first bytes of an image, or None if the format
+    is not one we accept.
+    """
+    for signature, ext in _SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+
+def _path_for(digest, suffix):
+    # two-level fan-out keeps directories small
+    return os.path.join(MEDIA_ROOT, digest[:2], digest + suffix)
+
+
+def _url_for(digest, suffix):
+    return f"{MEDIA_URL}/{digest[:2]}/{digest}{suffix}"
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:  # directories can not be opened on every platform
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+# -------------------- THUMBNAILS --------------------
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_pending = set()
+
+
+def _thumb_pool():
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="thumbs")
+                _pool_pid = pid
+                _pending.clear()
+    return _pool
+
+
+def thumbnail_urls(digest):
+    """
+    {size: url} of the thumbnails an original will have. Empty without Pillow.
+    """
+    if Image is None:
+        return {}
+    return {str(size): _url_for(digest, f"_{size}.jpg") for size in THUMBNAIL_SIZES}
+
+
+def make_thumbnails(digest, source):
+    """
+    Write one JPEG per THUMBNAIL_SIZES entry for the original at `source`.
+    Existing thumbnails are reused. An original Pillow can not decode is
+    linked in place of its thumbnails so the promised URLs never 404.
+    """
+    if Image is None:
+        return
+    missing = [s for s in THUMBNAIL_SIZES if not os.path.exists(_path_for(digest, f"_{s}.jpg"))]
+    if not missing:
+        return
+    try:
+        img = Image.open(source)
+        img.draft("RGB", (max(missing), max(missing)))  # cheap JPEG downscale on decode
+        img.load()
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+    except Exception as e:
+        print(f"Thumbnailing {digest} failed, using the original:", e)
+        img = None
+    for size in missing:
+        path = _path_for(digest, f"_{size}.jpg")
+        if img is None:
+            try:
+                os.link(source, path)
+            except OSError:
+                shutil.copyfile(source, path)
+            continue
+        thumb = img.copy()
+        thumb.thumbnail((size, size))
+        buf = BytesIO()
+        thumb.save(buf, "JPEG", quality=82, optimize=True)
+        _write_atomic(path, buf.getvalue())
+
+
+def _queue_thumbnails(digest, source):
+    if Image is None:
+        return
+    with _pool_lock:
+        if digest in _pending:
+            return
+        _pending.add(digest)
+
+    def run():
+        try:
+            make_thumbnails(digest, source)
+        except Exception as e:
+            print(f"Thumbnailing {digest} failed:", e)
+        finally:
+            with _pool_lock:
+                _pending.discard(digest)
+    _thumb_pool().submit(run)
+
+
+def pending_thumbnails():
+    with _pool_lock:
+        return len(_pending)
+
+
+def drain(wait=True):
+    """
+    Finish queued thumbnails and stop the pool (shutdown, migrations).
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        pool, _pool, _pool_pid = _pool, None, None
+    if pool is not None:
+        pool.shutdown(wait=wait)
+
+
+# -------------------- STORING --------------------
+
+def _too_large(max_bytes):
+    if max_bytes >= 1024 * 1024:
+        return ImageTooLarge(f"Image larger than {max_bytes / (1024 * 1024):g} MB")
+    return ImageTooLarge(f"Image larger than {max_bytes / 1024:g} KB")
+
+
+def store_stream(stream, max_bytes=MAX_IMAGE_BYTES):
+    """
+    Copy an image from a file-like object into the store chunk by chunk,
+    hashing as it goes. Returns once the original is fsynced under its final
+    name; thumbnails are queued. Identical images are written once.
+    Returns {"url", "hash", "thumbs"}.
+    """
+    incoming = os.path.join(MEDIA_ROOT, ".incoming")
+    os.makedirs(incoming, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=incoming, prefix=".tmp-")
+    sha = hashlib.sha256()
+    size = 0
+    head = b""
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise _too_large(max_bytes)
+                if len(head) < 16:
+                    head += chunk[:16]
+                sha.update(chunk)
+                fh.write(chunk)
+            fh.flush()
+            os.fsync(fh.fileno())
+        if not size:
+            raise ImageError("Empty image")
+        suffix = sniff_extension(head)
+        if suffix is None:
+            raise ImageError("Unsupported image type")
+
+        digest = sha.hexdigest()
+        path = _path_for(digest, suffix)
+        if os.path.exists(path):
+            os.remove(tmp)  # already stored
+            os.utime(path)  # in use again: keeps it from the collector (delete_image)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+            _fsync_dir(os.path.dirname(path))
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    _queue_thumbnails(digest, path)
+    return {"url": _url_for(digest, suffix), "hash": digest, "thumbs": thumbnail_urls(digest)}
+
+
+def store_bytes(data, max_bytes=MAX_IMAGE_BYTES):
+    if not data:
+        raise ImageError("Empty image")
+    return store_stream(BytesIO(data), max_bytes)
+
+
+def store_data_url(s, max_bytes=MAX_IMAGE_BYTES):
+    # base64 is 4/3 of the payload; refuse before decoding an oversized one
+    if len(s) > max_bytes * 4 // 3 + 256:
+        raise _too_large(max_bytes)
+    data, _ = decode_data_url(s)
+    return store_bytes(data, max_bytes)
+
+
+def store_upload(file_storage, max_bytes=MAX_IMAGE_BYTES):
+    """
+    Store a werkzeug FileStorage. The client filename is never used.
+    """
+    return store_stream(file_storage.stream, max_bytes)
+
+
+# -------------------- SERVING --------------------
+
+_MEDIA_NAME = re.compile(r"^([0-9a-f]{2})/([0-9a-f]{64})(_\d+)?(\.(?:jpg|png|gif|webp))$")
+
+
+def resolve_media(name):
+    """
+    Map a media path ("ab/<sha256>[_size].ext") to (file path, immutable).
+    A thumbnail that is still being rendered resolves to its original,
+    which must not be cached for long. (None, False) when nothing matches.
+    """
+    match = _MEDIA_NAME.match(name)
+    if not match or match.group(1) != match.group(2)[:2]:
+        return None, False
+    digest, size, suffix = match.group(2), match.group(3), match.group(4)
+    path = _path_for(digest, (size or "") + suffix)
+    if os.path.isfile(path):
+        return path, True
+    if size:
+        for ext in {ext for _, ext in _SIGNATURES} | {".webp"}:
+            original = _path_for(digest, ext)
+            if os.path.isfile(original):
+                return original, False
+    return None, False
+
+
+def describe_url(url):
+    """
+    Rebuild a store_*() result for an already stored media URL so its
+    thumbnails survive an edit. Foreign URLs come back without thumbnails.
+    """
+    name = url.rsplit("/", 1)[-1] if url.startswith(MEDIA_URL + "/") else ""
+    digest = os.path.splitext(name)[0]
+    if len(digest) != 64:
+        return {"url": url, "hash": None, "thumbs": {}}
+    source = _path_for(digest, os.path.splitext(name)[1])
+    if Image is not None and os.path.exists(source) \
+            and not os.path.exists(_path_for(digest, f"_{THUMBNAIL_SIZES[0]}.jpg")):
+        _queue_thumbnails(digest, source)  # stored before thumbnails existed
+    return {"url": url, "hash": digest, "thumbs": thumbnail_urls(digest)}
+
+
+def media_digest(url):
+    """
+    (digest, suffix) of an original in the store, None for any other URL
+    (thumbnails, the default image, foreign links).
+    """
+    if not isinstance(url, str) or not url.startswith(MEDIA_URL + "/"):
+        return None
+    match = _MEDIA_NAME.match(url[len(MEDIA_URL) + 1:])
+    if not match or match.group(1) != match.group(2)[:2] or match.group(3):
+        return None
+    return match.group(2), match.group(4)
+
+
+def delete_image(url, grace=IMAGE_GC_GRACE_SECONDS):
+    """
+    Remove a stored original and its thumbnails. The caller has checked
+    that nothing references it any more; an original stored (or deduplicated
+    by store_stream) within the last `grace` seconds is kept anyway, since
+    a crop being saved right now may be about to reference it.
+    Returns True if the original was removed.
+    """
+    parsed = media_digest(url)
+    if parsed is None:
+        return False
+    digest, suffix = parsed
+    original = _path_for(digest, suffix)
+    try:
+        if time.time() - os.stat(original).st_mtime < grace:
+            return False
+        os.remove(original)
+    except FileNotFoundError:
+        return False
+    for size in THUMBNAIL_SIZES:
+        try:
+            os.remove(_path_for(digest, f"_{size}.jpg"))
+        except FileNotFoundError:
+            pass
+    return True
+
+
+def image_fields(stored):
+    """
+    Crop fields for a list of store_*() results: images, image, thumbnails
+    (one {size: url} map per image) and thumbnail (small first image).
+    """
+    if not stored:
+        return {"images": [DEFAULT_IMAGE], "image": DEFAULT_IMAGE, "thumbnails": [], "thumbnail": DEFAULT_IMAGE}
+    images = [s["url"] for s in stored]
+    thumbnails = [s["thumbs"] for s in stored]
+    small = str(min(THUMBNAIL_SIZES)) if THUMBNAIL_SIZES else None
+    return {
+        "images": images,
+        "image": images[0],
+        "thumbnails": thumbnails,
+        "thumbnail": thumbnails[0].get(small) or images[0],
+    }
+
+
+# ------------------ END OF images.py ------------------
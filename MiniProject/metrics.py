@@ -0,0 +1,261 @@
+# ------------------ metrics.py ------------------
+# Per-route request and MongoDB command metrics.
+#
+# A pymongo CommandListener attributes every command, with its duration, to
+# the Flask route being served on the same thread (or the async route whose
+# task issued it, see asgi.py); commands issued by the auction scheduler and
+# other background threads are counted under "(background)". GET /metrics
+# exports, per route, histograms of request latency, Mongo command latency
+# and commands per request, plus command counts, in the Prometheus text
+# format. Numbers are per process.
+#
+# A request that issues more than N_PLUS_ONE_THRESHOLD commands of the same
+# shape (command, collection and filter keys; values ignored) is logged as
+# a likely N+1 query pattern.
+#
+# Configuration (environment):
+#   METRICS                0 disables the listener and the endpoint
+#   METRICS_TOKEN          if set, /metrics requires "Authorization: Bearer <token>"
+#   N_PLUS_ONE_THRESHOLD   same-shape commands per request before warning (default 10)
+
+import contextvars
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from flask import Response, abort, g, has_request_context, request
+from pymongo import monitoring
+
+import database
+
+METRICS_ENABLED = os.getenv("METRICS", "1") == "1"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+BACKGROUND = "(background)"
+UNMATCHED = "(unmatched)"
+
+# cursor and session housekeeping, not queries of their own
+_UNSHAPED = frozenset(("getMore", "killCursors", "endSessions", "commitTransaction", "abortTransaction"))
+
+log = logging.getLogger(__name__)
+
+# request state of the async API; Flask requests keep theirs in flask.g
+_async_request = contextvars.ContextVar("mongo_metrics", default=None)
+
+
+def _current():
+    if has_request_context():
+        return g.get("_mongo_metrics")
+    return _async_request.get()
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RouteStats:
+    __slots__ = ("latency", "command_latency", "commands_per_request", "commands", "n_plus_one")
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.command_latency = Histogram(LATENCY_BUCKETS)
+        self.commands_per_request = Histogram(COUNT_BUCKETS)
+        self.commands = Counter()  # command name -> count
+        self.n_plus_one = 0
+
+
+class RequestState:
+    __slots__ = ("route", "started", "commands", "shapes")
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.commands = 0
+        self.shapes = Counter()
+
+
+# -------------------- QUERY SHAPES --------------------
+
+def _skeleton(spec):
+    if isinstance(spec, dict):
+        return "{" + ",".join(f"{k}:{_skeleton(v)}" for k, v in sorted(spec.items())) + "}"
+    if isinstance(spec, list) and spec and isinstance(spec[0], dict):
+        return "[" + _skeleton(spec[0]) + "]"
+    return "?"
+
+
+def query_shape(command_name, command):
+    """
+    "<command> <collection> <filter skeleton>", e.g.
+    "find users {_id:?}" for any find on users by _id.
+    """
+    spec = None
+    if command_name == "find":
+        spec = command.get("filter")
+    elif command_name == "aggregate":
+        pipeline = command.get("pipeline") or [{}]
+        spec = pipeline[0].get("$match")
+    elif command_name in ("count", "distinct", "findAndModify"):
+        spec = command.get("query")
+    elif command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or [{}]
+        spec = statements[0].get("q")
+    return f"{command_name} {command.get(command_name)} {_skeleton(spec)}"
+
+
+# -------------------- COLLECTOR --------------------
+
+class Metrics(monitoring.CommandListener):
+    def __init__(self, threshold=N_PLUS_ONE_THRESHOLD):
+        self.threshold = threshold
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, route):
+        stats = self._routes.get(route)
+        if stats is None:
+            stats = self._routes[route] = RouteStats()
+        return stats
+
+    # ---- pymongo events (called on the thread that runs the command) ----
+
+    def started(self, event):
+        if event.command_name in _UNSHAPED:
+            return
+        state = _current()
+        if state is not None:
+            state.shapes[query_shape(event.command_name, event.command)] += 1
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+    def _finished(self, event):
+        state = _current()
+        if state is not None:
+            state.commands += 1
+        with self._lock:
+            stats = self._stats(state.route if state is not None else BACKGROUND)
+            stats.commands[event.command_name] += 1
+            stats.command_latency.observe(event.duration_micros / 1e6)
+
+    # ---- requests ----
+
+    def begin_request(self):
+        rule = request.url_rule
+        g._mongo_metrics = RequestState(f"{request.method} {rule.rule}" if rule else UNMATCHED)
+
+    def end_request(self, exc=None):
+        state = g.pop("_mongo_metrics", None)
+        if state is not None:
+            self._record(state)
+
+    def begin_async(self, route):
+        """
+        Start tracking an async request in the current task; returns the
+        token for end_async().
+        """
+        return _async_request.set(RequestState(route))
+
+    def end_async(self, token):
+        state = _async_request.get()
+        _async_request.reset(token)
+        if state is not None:
+            self._record(state)
+
+    def _record(self, state):
+        elapsed = time.perf_counter() - state.started
+        suspects = [(shape, n) for shape, n in state.shapes.items() if n > self.threshold]
+        with self._lock:
+            stats = self._stats(state.route)
+            stats.latency.observe(elapsed)
+            stats.commands_per_request.observe(state.commands)
+            stats.n_plus_one += len(suspects)
+        for shape, n in suspects:
+            log.warning("Possible N+1 in %s: %d x %s (%d commands, %.1f ms)",
+                        state.route, n, shape, state.commands, elapsed * 1000)
+
+    # ---- export ----
+
+    def render(self):
+        """
+        Prometheus text exposition of everything collected so far.
+        """
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = []
+            _histograms(lines, "http_request_duration_seconds", "Request latency by route.",
+                        [(r, s.latency) for r, s in routes if s.latency.count])
+            _histograms(lines, "mongo_command_duration_seconds", "MongoDB command latency by route.",
+                        [(r, s.command_latency) for r, s in routes if s.command_latency.count])
+            _histograms(lines, "mongo_commands_per_request", "MongoDB commands issued per request.",
+                        [(r, s.commands_per_request) for r, s in routes if s.commands_per_request.count])
+            lines += ["# HELP mongo_commands_total MongoDB commands by route and command.",
+                      "# TYPE mongo_commands_total counter"]
+            for route, stats in routes:
+                for command, n in sorted(stats.commands.items()):
+                    lines.append(f'mongo_commands_total{{route="{_label(route)}",command="{command}"}} {n}')
+            lines += ["# HELP mongo_n_plus_one_total Requests' same-shape query groups above the threshold.",
+                      "# TYPE mongo_n_plus_one_total counter"]
+            for route, stats in routes:
+                if stats.n_plus_one:
+                    lines.append(f'mongo_n_plus_one_total{{route="{_label(route)}"}} {stats.n_plus_one}')
+        for key, value in sorted(database.pool_stats.snapshot().items()):
+            lines += [f"# TYPE mongo_pool_{key} gauge", f"mongo_pool_{key} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+    def init_app(self, app):
+        app.before_request(self.begin_request)
+        app.teardown_request(self.end_request)
+        app.add_url_rule("/metrics", "metrics", self._view)
+
+    def _view(self):
+        if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+            abort(403)
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _histograms(lines, name, help_text, series):
+    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for route, hist in series:
+        label = _label(route)
+        cumulative = 0
+        for bound, n in zip(hist.buckets + ("+Inf",), hist.counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{route="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{route="{label}"}} {hist.sum:.6f}')
+        lines.append(f'{name}_count{{route="{label}"}} {hist.count}')
+
+
+metrics = Metrics()
+if METRICS_ENABLED:
+    database.add_event_listener(metrics)
+
+# ------------------ END OF metrics.py ------------------
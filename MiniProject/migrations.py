@@ -0,0 +1,303 @@
+# ------------------ migrations.py ------------------
+# One-off data migrations. Run from the MiniProject directory:
+#
+#     python migrations.py images      # move inline base64 images to the image store
+#     python migrations.py bids        # copy legacy per-crop bid rows onto the crops
+#     python migrations.py reconcile   # rebuild crop bid fields from bid_history
+#     python migrations.py normalize   # bring old crops to the normalized shape (see crud.prepare_crop)
+#     python migrations.py geo         # place crops on the map from their location text (crud.geo_point)
+#     python migrations.py purge       # remove what deleted crops left behind (see crud.delete_crop)
+#     python migrations.py close       # close every auction whose time is up (Closed, or Expired without bids)
+#     python migrations.py won         # won_crops / auction_winners rows to the model shape (ObjectId ids, won_at)
+#     python migrations.py indexes     # create every index the queries rely on
+#     python migrations.py check       # explain() each canonical query, fail on COLLSCAN
+
+import sys
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+import images as image_store
+from cache import catalog_cache
+from crud import db, ensure_indexes, check_query_plans, reconcile_bid_fields, prepare_crop, parse_datetime, \
+    purge_deleted_crops, geo_point, parse_lat_lon, close_auctions, get_open_auctions
+from models import AuctionWinner, ModelError, WonCrop
+
+
+# -------------------- INLINE IMAGES --------------------
+
+def migrate_inline_images(batch_size=100, dry_run=False):
+    """
+    Rewrite crops whose images/image still hold data: URLs so they only keep
+    references into the image store. Safe to re-run; already migrated
+    documents are not matched.
+    Returns the number of crops rewritten.
+    """
+    inline = {"$regex": "^data:"}
+    cursor = db.crops.find(
+        {"$or": [{"images": inline}, {"image": inline}]},
+        {"images": 1, "image": 1},
+        no_cursor_timeout=True,
+    ).batch_size(batch_size)
+
+    ops = []
+    migrated = 0
+    try:
+        for crop in cursor:
+            raw = crop.get("images") if isinstance(crop.get("images"), list) else []
+            if not raw and crop.get("image"):
+                raw = [crop["image"]]
+            stored = []
+            for img in raw:
+                if image_store.is_data_url(img):
+                    try:
+                        stored.append(image_store.store_data_url(img))
+                    except image_store.ImageError as e:
+                        print(f"Skipping broken image on crop {crop['_id']}: {e}")
+                elif isinstance(img, str) and img:
+                    stored.append(image_store.describe_url(img))
+            ops.append(UpdateOne({"_id": crop["_id"]}, {"$set": image_store.image_fields(stored)}))
+            migrated += 1
+            if len(ops) >= batch_size:
+                if not dry_run:
+                    db.crops.bulk_write(ops, ordered=False)
+                ops = []
+        if ops and not dry_run:
+            db.crops.bulk_write(ops, ordered=False)
+    finally:
+        cursor.close()
+        image_store.drain()  # thumbnails are rendered in the background
+    return migrated
+
+
+# -------------------- LEGACY BIDS --------------------
+
+def migrate_legacy_bids(batch_size=500):
+    """
+    Before the bid engine the current high bid was a single `bids` document
+    per crop keyed by string crop_id. Copy those onto the crop's current_bid
+    fields, never lowering a bid the engine already accepted.
+    Returns the number of crops updated.
+    """
+    ops = []
+    migrated = 0
+    for bid in db.bids.find({"crop_id": {"$type": "string"}, "bid_price": {"$ne": None}}):
+        try:
+            crop_oid = ObjectId(bid["crop_id"])
+            price = float(bid["bid_price"])
+        except Exception:
+            continue
+        ops.append(UpdateOne(
+            {"_id": crop_oid, "$or": [{"current_bid": None}, {"current_bid": {"$lt": price}}]},
+            {"$set": {
+                "current_bid": price,
+                "current_bidder_id": str(bid.get("bidder_id")),
+                "current_bidder_email": bid.get("bidder_email"),
+                "highest_bidder": str(bid.get("bidder_id")),
+            }},
+        ))
+        if len(ops) >= batch_size:
+            migrated += db.crops.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        migrated += db.crops.bulk_write(ops, ordered=False).modified_count
+    return migrated
+
+
+# -------------------- NORMALIZED CROPS --------------------
+
+def normalize_crops(batch_size=500):
+    """
+    Rewrite crops written before normalization on write: ISO string
+    datetimes become BSON dates (unparsable ones fall back to the _id
+    creation time), numbers become floats and missing display fields get
+    their defaults. Only changed fields are written; safe to re-run.
+    Returns the number of crops rewritten.
+    """
+    cursor = db.crops.find({}, no_cursor_timeout=True).batch_size(batch_size)
+    ops = []
+    migrated = 0
+    try:
+        for crop in cursor:
+            fixed = dict(crop)
+            if parse_datetime(fixed.get("datetime")) is None:
+                fixed["datetime"] = crop["_id"].generation_time.replace(tzinfo=None)
+            prepare_crop(fixed)
+            changes = {k: v for k, v in fixed.items() if k not in crop or crop[k] != v
+                       or type(crop[k]) is not type(v)}
+            if not changes:
+                continue
+            ops.append(UpdateOne({"_id": crop["_id"]}, {"$set": changes}))
+            if len(ops) >= batch_size:
+                migrated += db.crops.bulk_write(ops, ordered=False).modified_count
+                ops = []
+        if ops:
+            migrated += db.crops.bulk_write(ops, ordered=False).modified_count
+    finally:
+        cursor.close()
+    if migrated:
+        catalog_cache.clear()
+    return migrated
+
+
+# -------------------- CROP POSITIONS --------------------
+
+def backfill_crop_geo(batch_size=500):
+    """
+    Give crops without a `geo` point one parsed from their location text,
+    "<place> (lat, lon)" or "lat, lon" as the farmer portal fills it in.
+    Crops whose location has no coordinates stay out of distance searches.
+    Safe to re-run. Returns the number of crops placed.
+    """
+    cursor = db.crops.find(
+        {"geo": {"$exists": False}, "location": {"$regex": r"\d\.\d+\s*,\s*-?\d"}},
+        {"location": 1},
+        no_cursor_timeout=True,
+    ).batch_size(batch_size)
+    ops = []
+    migrated = 0
+    try:
+        for crop in cursor:
+            coordinates = parse_lat_lon(crop.get("location"))
+            if coordinates is None:
+                continue
+            ops.append(UpdateOne({"_id": crop["_id"], "geo": {"$exists": False}},
+                                 {"$set": {"geo": geo_point(*coordinates)}}))
+            if len(ops) >= batch_size:
+                migrated += db.crops.bulk_write(ops, ordered=False).modified_count
+                ops = []
+        if ops:
+            migrated += db.crops.bulk_write(ops, ordered=False).modified_count
+    finally:
+        cursor.close()
+    if migrated:
+        catalog_cache.clear()
+    return migrated
+
+
+# -------------------- AUCTION STATES --------------------
+
+def close_due_auctions(batch_size=500):
+    """
+    Close every auction whose time is up, as the scheduler does: crops with
+    a bid become Closed (sold), crops without one Expired. Listings from
+    before the scheduler existed are all due at once; run this before the
+    first deploy with the scheduler instead of leaving them to its first
+    pass. Safe to re-run. Returns the number of crops closed.
+    """
+    due = [crop_id for crop_id, _ in get_open_auctions(ending_before=datetime.utcnow())]
+    closed = 0
+    for start in range(0, len(due), batch_size):
+        closed += len(close_auctions(due[start:start + batch_size]))
+    return closed
+
+
+# -------------------- WON CROPS --------------------
+
+def migrate_won_crops():
+    """
+    Rewrite won_crops rows stored with string ids and a `datetime` field in
+    the WonCrop shape (ObjectId user_id / crop_id, won_at), and
+    auction_winners rows with a string user_id in the AuctionWinner shape.
+    A string row whose converted twin already exists is dropped; rows that
+    do not convert are reported and left alone. Safe to re-run.
+    Returns the number of rows rewritten or dropped.
+    """
+    migrated = 0
+    legacy = {"$or": [{"user_id": {"$type": "string"}}, {"crop_id": {"$type": "string"}},
+                      {"won_at": {"$exists": False}}]}
+    for row in db.won_crops.find(legacy):
+        try:
+            won = WonCrop.from_bson({
+                **row, "won_at": row.get("won_at") or row.get("datetime") or row["_id"].generation_time,
+            }).to_bson()
+        except ModelError as e:
+            print(f"Skipping won_crops row {row['_id']}: {e}")
+            continue
+        won.pop("datetime", None)
+        twin = db.won_crops.find_one(
+            {"user_id": won["user_id"], "crop_id": won["crop_id"], "_id": {"$ne": row["_id"]}}, {"_id": 1})
+        if twin:
+            db.won_crops.delete_one({"_id": row["_id"]})
+        else:
+            db.won_crops.replace_one({"_id": row["_id"]}, won)
+        migrated += 1
+
+    for row in db.auction_winners.find({"user_id": {"$type": "string"}}):
+        try:
+            winner = AuctionWinner.from_bson(row).to_bson()
+        except ModelError as e:
+            print(f"Skipping auction_winners row {row['_id']}: {e}")
+            continue
+        db.auction_winners.replace_one({"_id": row["_id"]}, winner)
+        migrated += 1
+    return migrated
+
+
+# -------------------- INDEXES --------------------
+
+def create_indexes():
+    """
+    Returns the number of indexes that could not be created.
+    """
+    failures = ensure_indexes()
+    for collection, keys, error in failures:
+        print(f"FAILED {collection} {keys}: {error}")
+    return len(failures)
+
+
+def check_indexes():
+    """
+    Returns the number of canonical queries planned as a collection scan.
+    """
+    offenders = check_query_plans()
+    for name, stages in offenders:
+        print(f"COLLSCAN  {name}: {' -> '.join(stages)}")
+    if not offenders:
+        print("all canonical queries use an index")
+    return len(offenders)
+
+
+# -------------------- DELETED CROPS --------------------
+
+def purge_all_deleted_crops():
+    """
+    Drain crop_deletions now instead of waiting for the cleanup worker.
+    Returns the number of crops purged.
+    """
+    purged = 0
+    while True:
+        count = purge_deleted_crops()
+        if not count:
+            return purged
+        purged += count
+
+
+COMMANDS = {
+    "images": migrate_inline_images,
+    "bids": migrate_legacy_bids,
+    "reconcile": reconcile_bid_fields,
+    "normalize": normalize_crops,
+    "geo": backfill_crop_geo,
+    "purge": purge_all_deleted_crops,
+    "close": close_due_auctions,
+    "won": migrate_won_crops,
+}
+
+# commands that report problems: a non-zero count is a failed run
+CHECKS = {
+    "indexes": create_indexes,
+    "check": check_indexes,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in {**COMMANDS, **CHECKS}:
+        print(f"usage: python migrations.py [{'|'.join([*COMMANDS, *CHECKS])}]")
+        sys.exit(2)
+    if sys.argv[1] in CHECKS:
+        sys.exit(1 if CHECKS[sys.argv[1]]() else 0)
+    print(f"{sys.argv[1]}: {COMMANDS[sys.argv[1]]()} documents migrated")
+
+# ------------------ END OF migrations.py ------------------
@@ -1,29 +1,376 @@
-from datetime import datetime
-
-class User:
-    def __init__(self, username, email, password, role="bidder"):
-        self.username = username
-        self.email = email
-        self.password = password
-        self.role = role
-
-class Crop:
-    def __init__(self, name, price, quantity, farmer_id, crop_type="vegetable", quality="A+", notes="", image=""):
-        self.name = name
-        self.type = crop_type
-        self.quality = quality
-        self.price = price
-        self.quantity = quantity
-        self.datetime = datetime.utcnow()
-        self.status = "Growing"
-        self.sold = False
-        self.notes = notes
-        self.image = image
-        self.farmer_id = farmer_id
-
-class Bid:
-    def __init__(self, crop_id, bidder_id, bid_price):
-        self.crop_id = crop_id
-        self.bidder_id = bidder_id
-        self.bid_price = bid_price
-        self.timestamp = datetime.utcnow()
+# ------------------ models.py ------------------
+# Typed documents for the collections.
+#
+# Every model is a __slots__ class, so an instance carries its fields and
+# nothing else (no per-instance __dict__), and has a codec:
+#
+#   Model.from_bson(doc)   validate and convert a stored or incoming document
+#   Model(**fields)        the same for keyword arguments
+#   model.to_bson()        dict ready for insert_one / $set
+#   model.to_json()        compact JSON bytes (streaming.dumps)
+#   Model.to_set(fields)   the same conversion for the fields of a $set
+#
+# Conversion happens once, when the model is built; after that every
+# attribute has its final type. Keys a model does not declare are kept in
+# `extra`, so reading and writing back a document never loses data.
+# Optional fields that are None are left out of to_bson().
+
+from datetime import datetime, timezone
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+
+import streaming
+
+
+class ModelError(ValueError):
+    """
+    A document is missing a required field or has one of the wrong type.
+    """
+
+
+REQUIRED = object()
+
+
+# -------------------- CONVERTERS --------------------
+# Each takes a non-None value and returns it converted, or raises
+# ValueError / TypeError.
+
+def parse_datetime(value):
+    """
+    Naive UTC datetime for a datetime or ISO 8601 string, None if invalid.
+    Strings without an offset are taken as UTC.
+    """
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def to_datetime(value):
+    if type(value) is datetime and value.tzinfo is None:
+        return value
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"not a datetime: {value!r}")
+    return parsed
+
+
+def to_object_id(value):
+    return value if type(value) is ObjectId else ObjectId(value)
+
+
+def to_id_string(value):
+    # bidder / farmer ids come from the session and are stored as strings
+    if type(value) is str:
+        return value
+    if not isinstance(value, (str, ObjectId)):
+        raise TypeError(f"not an id: {value!r}")
+    return str(value)
+
+
+def to_str(value):
+    if not isinstance(value, str):
+        raise TypeError(f"not a string: {value!r}")
+    return value
+
+
+def to_float(value):
+    if type(value) is float:
+        return value
+    if isinstance(value, bool):
+        raise TypeError(f"not a number: {value!r}")
+    return float(value)
+
+
+def to_int(value):
+    if type(value) is int:
+        return value
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise TypeError(f"not an integer: {value!r}")
+    return int(value)
+
+
+def to_bool(value):
+    if not isinstance(value, bool):
+        raise TypeError(f"not a boolean: {value!r}")
+    return value
+
+
+def to_str_list(value):
+    if type(value) is not list:
+        raise TypeError(f"not a list of strings: {value!r}")
+    for item in value:
+        if type(item) is not str:
+            raise TypeError(f"not a list of strings: {value!r}")
+    return value
+
+
+def to_list(value):
+    if type(value) is not list:
+        raise TypeError(f"not a list: {value!r}")
+    return value
+
+
+def to_point(value):
+    # GeoJSON point: {"type": "Point", "coordinates": [longitude, latitude]}
+    if type(value) is not dict or value.get("type") != "Point":
+        raise TypeError(f"not a GeoJSON point: {value!r}")
+    coordinates = value.get("coordinates")
+    if type(coordinates) is not list or len(coordinates) != 2:
+        raise TypeError(f"not a GeoJSON point: {value!r}")
+    lon, lat = to_float(coordinates[0]), to_float(coordinates[1])
+    if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+        raise ValueError(f"coordinates out of range: {value!r}")
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+def to_secret(value):
+    # bcrypt hashes are bytes; older rows may hold str
+    if not isinstance(value, (bytes, str)):
+        raise TypeError("password must be bytes or str")
+    return value
+
+
+# -------------------- BASE --------------------
+
+def _slots(fields):
+    return tuple(name for name, _, _ in fields)
+
+
+class Model:
+    """
+    Base class. Subclasses set COLLECTION, FIELDS as (name, converter,
+    default) triples and `__slots__ = _slots(FIELDS)`. A default of REQUIRED
+    makes the field mandatory; a callable default is called per instance.
+    """
+
+    __slots__ = ("_id", "extra")
+    COLLECTION = None
+    FIELDS = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._KNOWN = frozenset(("_id",) + _slots(cls.FIELDS))
+        # (name, converter, default, default is a factory) for _load()
+        cls._LOAD = tuple((name, convert, default, callable(default)) for name, convert, default in cls.FIELDS)
+        cls._CONVERT = {name: convert for name, convert, _ in cls.FIELDS}
+
+    def __init__(self, _id=None, **fields):
+        unknown = fields.keys() - self._KNOWN
+        if unknown:
+            raise TypeError(f"{type(self).__name__} has no field(s) {', '.join(sorted(unknown))}")
+        self._load(_id, fields)
+        self.extra = {}
+
+    def _load(self, _id, values):
+        """
+        Convert and set every field; raises ModelError naming the offending
+        field.
+        """
+        name = "_id"
+        try:
+            self._id = None if _id is None else to_object_id(_id)
+            for name, convert, default, factory in self._LOAD:
+                value = values.get(name)
+                if value is not None:
+                    value = convert(value)
+                elif default is REQUIRED:
+                    raise ModelError(f"{type(self).__name__}.{name} is required")
+                else:
+                    value = default() if factory else default
+                setattr(self, name, value)
+        except (TypeError, ValueError, InvalidId) as e:
+            if isinstance(e, ModelError):
+                raise
+            raise ModelError(f"{type(self).__name__}.{name}: {e}") from None
+
+    @classmethod
+    def from_bson(cls, doc):
+        """
+        Build from a document as the driver returns it (or a request body).
+        Raises ModelError.
+        """
+        obj = cls.__new__(cls)
+        obj._load(doc.get("_id"), doc)
+        known = cls._KNOWN
+        obj.extra = {} if doc.keys() <= known else {k: v for k, v in doc.items() if k not in known}
+        return obj
+
+    @classmethod
+    def to_set(cls, fields):
+        """
+        Convert the declared fields among `fields` (a partial update) the way
+        from_bson() does; None values and undeclared keys pass through.
+        Raises ModelError.
+        """
+        doc = {}
+        for name, value in fields.items():
+            convert = cls._CONVERT.get(name)
+            if convert is not None and value is not None:
+                try:
+                    value = convert(value)
+                except (TypeError, ValueError, InvalidId) as e:
+                    raise ModelError(f"{cls.__name__}.{name}: {e}") from None
+            doc[name] = value
+        return doc
+
+    def to_bson(self):
+        doc = dict(self.extra) if self.extra else {}
+        for name, _, default in self.FIELDS:
+            value = getattr(self, name)
+            if value is not None or default is not None:
+                doc[name] = value
+        if self._id is not None:
+            doc["_id"] = self._id
+        return doc
+
+    def to_json(self):
+        return streaming.dumps(self.to_bson())
+
+    def insert(self, db):
+        """
+        insert_one into COLLECTION; sets and returns the new _id.
+        """
+        result = db[self.COLLECTION].insert_one(self.to_bson())
+        self._id = result.inserted_id
+        return result
+
+    def __eq__(self, other):
+        return type(other) is type(self) and other.to_bson() == self.to_bson()
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name, _, _ in self.FIELDS[:3])
+        return f"{type(self).__name__}(_id={self._id!r}, {fields}, ...)"
+
+
+# -------------------- MODELS --------------------
+
+class User(Model):
+    COLLECTION = "users"
+    FIELDS = (
+        ("username", to_str, REQUIRED),
+        ("email", to_str, REQUIRED),
+        ("password", to_secret, REQUIRED),
+        ("role", to_str, "bidder"),
+        ("phone", to_str, None),
+        ("address", to_str, None),
+        ("profile_picture", to_str, None),
+    )
+    __slots__ = _slots(FIELDS)
+
+
+class Crop(Model):
+    """
+    A catalog lot. Business defaults (image fallback, sold from status, ...)
+    are applied by crud.prepare_crop(); this checks the stored types.
+    """
+
+    COLLECTION = "crops"
+    FIELDS = (
+        ("name", to_str, "Unnamed"),
+        ("type", to_str, "-"),
+        ("quality", to_str, "-"),
+        ("price", to_float, 0.0),
+        ("quantity", to_float, 0.0),
+        ("datetime", to_datetime, datetime.utcnow),
+        ("location", to_str, "Not specified"),
+        ("geo", to_point, None),              # see crud.geo_point()
+        ("status", to_str, "Available"),
+        ("sold", to_bool, False),
+        ("notes", to_str, ""),
+        ("images", to_str_list, list),
+        ("image", to_str, None),
+        ("thumbnail", to_str, None),
+        ("thumbnails", to_list, list),       # one {size: url} map per image
+        ("farmer_id", to_id_string, ""),
+        ("farmer_name", to_str, "Unknown Farmer"),
+        ("buyer_name", to_str, "Unknown"),
+        # denormalized bid state, maintained by crud.place_bid
+        ("current_bid", to_float, None),
+        ("current_bidder_id", to_id_string, None),
+        ("current_bidder_email", to_str, None),
+        ("highest_bidder", to_id_string, None),
+        ("bid_count", to_int, 0),
+        ("last_bid_at", to_datetime, None),
+    )
+    __slots__ = _slots(FIELDS)
+
+
+class Bid(Model):
+    """
+    One bid attempt, accepted or not (bid_history).
+    """
+
+    COLLECTION = "bid_history"
+    FIELDS = (
+        ("crop_id", to_object_id, REQUIRED),
+        ("bidder_id", to_id_string, REQUIRED),
+        ("bid_price", to_float, REQUIRED),
+        ("bidder_email", to_str, None),
+        ("accepted", to_bool, False),
+        ("timestamp", to_datetime, datetime.utcnow),
+    )
+    __slots__ = _slots(FIELDS)
+
+
+class WonCrop(Model):
+    """
+    A lot a bidder won, written when the auction closes (crud.close_auctions).
+    """
+
+    COLLECTION = "won_crops"
+    FIELDS = (
+        ("user_id", to_object_id, REQUIRED),
+        ("crop_id", to_object_id, REQUIRED),
+        ("farmer_id", to_id_string, None),   # as on the crop
+        ("bid_price", to_float, REQUIRED),
+        ("won_at", to_datetime, datetime.utcnow),
+    )
+    __slots__ = _slots(FIELDS)
+
+
+class WishlistItem(Model):
+    COLLECTION = "wishlist"
+    FIELDS = (
+        ("user_id", to_object_id, REQUIRED),
+        ("crop_id", to_object_id, REQUIRED),
+        ("added_at", to_datetime, datetime.utcnow),
+    )
+    __slots__ = _slots(FIELDS)
+
+
+class Message(Model):
+    COLLECTION = "messages"
+    FIELDS = (
+        ("crop_id", to_object_id, REQUIRED),
+        ("sender_id", to_object_id, REQUIRED),
+        ("receiver_id", to_object_id, REQUIRED),
+        ("message", to_str, REQUIRED),
+        ("timestamp", to_datetime, datetime.utcnow),
+    )
+    __slots__ = _slots(FIELDS)
+
+
+class AuctionWinner(Model):
+    COLLECTION = "auction_winners"
+    FIELDS = (
+        ("crop_id", to_object_id, REQUIRED),
+        ("user_id", to_object_id, REQUIRED),
+        ("bidder_email", to_str, None),
+        ("bid_price", to_float, None),
+        ("assigned_at", to_datetime, datetime.utcnow),
+    )
+    __slots__ = _slots(FIELDS)
+
+
+MODELS = {model.COLLECTION: model for model in
+          (User, Crop, Bid, WonCrop, WishlistItem, Message, AuctionWinner)}
+
+# ------------------ END OF models.py ------------------
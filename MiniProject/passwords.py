@@ -0,0 +1,172 @@
+# ------------------ passwords.py ------------------
+# Password hashing off the request thread.
+#
+# bcrypt is deliberately slow, so hashing inline lets a burst of logins tie
+# up every request worker. Hashes run on a bounded pool instead; when all
+# workers are busy and the queue is full, callers get PoolSaturated right
+# away (the API answers 429) rather than piling up behind each other.
+#
+# Configuration (environment):
+#   BCRYPT_ROUNDS          cost factor for new hashes (default 12)
+#   PASSWORD_POOL          thread (default) or process
+#   PASSWORD_WORKERS       pool size (default: CPU count)
+#   PASSWORD_QUEUE_LIMIT   hashes allowed to wait for a worker (default 4 x workers)
+#   PASSWORD_TIMEOUT       seconds a request waits for its hash (default 10)
+
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+_COST_RE = re.compile(rb"^\$2[abxy]?\$(\d{2})\$")
+
+
+class PoolSaturated(Exception):
+    """
+    Raised when the hashing pool cannot take (or finish) more work in time.
+    """
+
+
+def _as_bytes(value):
+    return value.encode() if isinstance(value, str) else value
+
+
+# module level so they can be pickled into a process pool
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _checkpw(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+def hash_cost(hashed):
+    """
+    Cost factor of a bcrypt hash, or None if it is not one.
+    """
+    match = _COST_RE.match(_as_bytes(hashed) or b"")
+    return int(match.group(1)) if match else None
+
+
+class PasswordHasher:
+    def __init__(self, workers=None, queue_limit=None, rounds=BCRYPT_ROUNDS,
+                 kind="thread", timeout=10.0):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_limit = self.workers * 4 if queue_limit is None else queue_limit
+        self.rounds = rounds
+        self.kind = kind
+        self.timeout = timeout
+        # one slot per running or queued hash
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_limit)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _pool(self):
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    if self.kind == "process":
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                            thread_name_prefix="bcrypt")
+                    self._executor_pid = pid
+        return self._executor
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise PoolSaturated("password hashing pool is saturated")
+        try:
+            future = self._pool().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _wait(self, future):
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise PoolSaturated("password hashing timed out")
+
+    # -------------------- API --------------------
+
+    def hash(self, password):
+        """
+        bcrypt hash (bytes) of `password` at the configured cost.
+        """
+        return self._wait(self.submit(_hashpw, _as_bytes(password), self.rounds))
+
+    def check(self, password, hashed):
+        if not hashed:
+            return False
+        try:
+            return self._wait(self.submit(_checkpw, _as_bytes(password), _as_bytes(hashed)))
+        except ValueError:  # not a bcrypt hash
+            return False
+
+    def needs_rehash(self, hashed):
+        cost = hash_cost(hashed)
+        return cost is not None and cost != self.rounds
+
+    def rehash_later(self, password, on_done):
+        """
+        Hash `password` at the current cost in the background and call
+        on_done(new_hash). Skipped when the pool is busy; the next login
+        tries again.
+        """
+        try:
+            future = self.submit(_hashpw, _as_bytes(password), self.rounds)
+        except PoolSaturated:
+            return False
+
+        def finished(f):
+            try:
+                on_done(f.result())
+            except Exception as e:
+                print("Password rehash failed:", e)
+        future.add_done_callback(finished)
+        return True
+
+    def start(self):
+        """
+        Create the pool now rather than on the first login (worker warm-up).
+        """
+        self._pool()
+
+    def in_flight(self):
+        return self.workers + self.queue_limit - self._slots._value
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=wait)
+            self._executor = None
+            self._executor_pid = None
+
+
+def create_hasher():
+    workers = os.getenv("PASSWORD_WORKERS")
+    queue_limit = os.getenv("PASSWORD_QUEUE_LIMIT")
+    return PasswordHasher(
+        workers=int(workers) if workers else None,
+        queue_limit=int(queue_limit) if queue_limit else None,
+        kind=os.getenv("PASSWORD_POOL", "thread"),
+        timeout=float(os.getenv("PASSWORD_TIMEOUT", "10")),
+    )
+
+
+hasher = create_hasher()
+
+# ------------------ END OF passwords.py ------------------
@@ -0,0 +1,315 @@
+# ------------------ realtime.py ------------------
+# Server push for bids, chat messages and auction results.
+#
+# Routes publish small events to per-crop topics ("crop:<crop_id>") and
+# browsers subscribe over Server-Sent Events. A Broker fans events out to
+# the subscribers of its own process; the backend carries events between
+# processes:
+#
+#   InProcessBackend  single process (default). Several brokers attached to
+#                     the same backend instance behave like several workers
+#                     sharing a bus, which is how multi-worker fan-out is
+#                     exercised locally.
+#   RedisBackend      Redis pub/sub, for multi-worker deployments.
+#
+# REALTIME_BACKEND=memory|redis selects the backend, REDIS_URL points at Redis.
+# Creating the broker connects to nothing: the Redis listener starts with the
+# first subscription, so the gunicorn master (preload_app) never runs one.
+#
+# A WSGI stream (sse_stream) holds a server thread for as long as the client
+# is connected; the ASGI server (asgi.py) streams with asse_stream, where a
+# subscriber is a task waiting on an asyncio queue.
+
+import asyncio
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+
+HEARTBEAT_SECONDS = float(os.getenv("REALTIME_HEARTBEAT", "15"))
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("REALTIME_QUEUE_SIZE", "100"))
+
+
+def crop_topic(crop_id):
+    return f"crop:{crop_id}"
+
+
+# -------------------- BACKENDS --------------------
+
+class InProcessBackend:
+    """
+    Delivers every published event to all attached brokers synchronously.
+    """
+
+    def __init__(self):
+        self._brokers = []
+        self._lock = threading.Lock()
+
+    def attach(self, broker):
+        with self._lock:
+            self._brokers.append(broker)
+
+    def detach(self, broker):
+        with self._lock:
+            if broker in self._brokers:
+                self._brokers.remove(broker)
+
+    def publish(self, topic, payload):
+        with self._lock:
+            brokers = list(self._brokers)
+        for broker in brokers:
+            broker.deliver(topic, payload)
+
+    def listen(self):
+        pass
+
+    def close(self):
+        with self._lock:
+            self._brokers.clear()
+
+
+class RedisBackend:
+    """
+    Redis pub/sub transport. One listener thread per process pattern-subscribes
+    to the channel prefix and hands events to the local broker; it is started
+    by listen(), on the first subscription. Publishing needs no listener.
+    """
+
+    def __init__(self, url=None, prefix="cropconnect:", client=None):
+        if client is None:
+            import redis  # optional dependency, only needed for this backend
+            client = redis.Redis.from_url(url or os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        self.client = client
+        self.prefix = prefix
+        self._broker = None
+        self._pubsub = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def attach(self, broker):
+        self._broker = broker
+
+    def detach(self, broker):
+        self.close()
+
+    def listen(self):
+        with self._lock:
+            if self._pubsub is not None or self._broker is None:
+                return
+            self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.psubscribe(self.prefix + "*")
+            self._thread = threading.Thread(target=self._listen, args=(self._pubsub,),
+                                            name="realtime-redis", daemon=True)
+            self._thread.start()
+
+    def _listen(self, pubsub):
+        for message in pubsub.listen():
+            if message.get("type") != "pmessage" or self._broker is None:
+                continue
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            self._broker.deliver(channel[len(self.prefix):], message["data"])
+
+    def publish(self, topic, payload):
+        self.client.publish(self.prefix + topic, payload)
+
+    def close(self):
+        with self._lock:
+            self._broker = None
+            if self._pubsub is not None:
+                try:
+                    self._pubsub.close()
+                except Exception:
+                    pass
+                self._pubsub = None
+
+
+# -------------------- BROKER --------------------
+
+class Subscription:
+    """
+    A bounded event queue for one client. When the client falls behind the
+    oldest events are dropped rather than blocking publishers.
+    """
+
+    def __init__(self, broker, topics, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.broker = broker
+        self.topics = set(topics)
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class AsyncSubscription(Subscription):
+    """
+    A Subscription read by a coroutine. Create it on the event loop; events
+    delivered from publisher or listener threads are handed to that loop.
+    """
+
+    def __init__(self, broker, topics, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.broker = broker
+        self.topics = set(topics)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def put(self, item):
+        try:
+            self.loop.call_soon_threadsafe(self._put, item)
+        except RuntimeError:  # loop already closed
+            pass
+
+    def _put(self, item):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(item)
+
+    async def get(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Broker:
+    def __init__(self, backend=None):
+        self.backend = backend or InProcessBackend()
+        self._subs = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.backend.attach(self)
+
+    def subscribe(self, topics, subscription=Subscription):
+        self.backend.listen()
+        sub = subscription(self, topics)
+        with self._lock:
+            for topic in sub.topics:
+                self._subs.setdefault(topic, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            for topic in sub.topics:
+                subs = self._subs.get(topic)
+                if subs:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subs[topic]
+
+    def publish(self, topic, event, data):
+        """
+        Publish `data` (JSON serializable) as `event` on `topic`. Errors in the
+        transport are logged, never raised into the calling request.
+        """
+        payload = json.dumps({"event": event, "data": data}, default=str)
+        try:
+            self.backend.publish(topic, payload)
+        except Exception as e:
+            print(f"Realtime publish failed on {topic}: {e}")
+
+    def deliver(self, topic, payload):
+        with self._lock:
+            subs = list(self._subs.get(topic, ()))
+        if not subs:
+            return
+        if isinstance(payload, bytes):
+            payload = payload.decode()
+        message = json.loads(payload)
+        item = (next(self._ids), topic, message["event"], message["data"])
+        for sub in subs:
+            sub.put(item)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(s) for s in self._subs.values())
+
+    def after_fork(self):
+        """
+        Call in a freshly forked worker: the parent's subscribers are not
+        ours, and a backend listener thread does not survive fork(), so the
+        backend is attached again (and listens from the next subscribe()).
+        """
+        self._lock = threading.Lock()
+        self._subs = {}
+        self.backend.detach(self)
+        self.backend.attach(self)
+
+    def close(self):
+        self.backend.detach(self)
+
+
+def sse_stream(sub, heartbeat=HEARTBEAT_SECONDS):
+    """
+    Generator of text/event-stream chunks for a subscription. Sends a comment
+    line as heartbeat so proxies keep the connection open. The subscription
+    is released when the client disconnects (generator closed).
+    """
+    try:
+        yield _sse_open(sub)
+        last = time.monotonic()
+        while True:
+            item = sub.get(timeout=heartbeat)
+            if item is None:
+                if time.monotonic() - last >= heartbeat:
+                    yield ": keep-alive\n\n"
+                    last = time.monotonic()
+                continue
+            yield _sse_event(item)
+            last = time.monotonic()
+    finally:
+        sub.close()
+
+
+async def asse_stream(sub, heartbeat=HEARTBEAT_SECONDS):
+    """
+    sse_stream() for an AsyncSubscription, as an async generator of bytes.
+    """
+    try:
+        yield _sse_open(sub).encode()
+        while True:
+            item = await sub.get(timeout=heartbeat)
+            yield b": keep-alive\n\n" if item is None else _sse_event(item).encode()
+    finally:
+        sub.close()
+
+
+def _sse_open(sub):
+    return f"retry: 3000\n: subscribed {','.join(sorted(sub.topics))}\n\n"
+
+
+def _sse_event(item):
+    seq, topic, event, data = item
+    payload = json.dumps(dict(data, topic=topic), default=str)
+    return f"id: {seq}\nevent: {event}\ndata: {payload}\n\n"
+
+
+def create_broker():
+    kind = os.getenv("REALTIME_BACKEND", "memory").lower()
+    if kind == "redis":
+        return Broker(RedisBackend())
+    return Broker(InProcessBackend())
+
+
+broker = create_broker()
+
+# ------------------ END OF realtime.py ------------------
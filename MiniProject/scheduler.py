@@ -0,0 +1,149 @@
+# ------------------ scheduler.py ------------------
+# Background auction closing.
+#
+# Auctions used to be closed by whichever browser's countdown hit zero
+# first (and then again by every other browser watching). The scheduler
+# keeps a min-heap of auction end times and closes due auctions in batches
+# with crud.close_auctions(), which is idempotent, so several workers can
+# run a scheduler each. New crops are pushed in by the API; a periodic
+# rescan picks up crops created by other workers.
+
+import heapq
+import os
+import threading
+from datetime import datetime, timedelta
+
+import crud
+from realtime import broker, crop_topic
+
+RESCAN_SECONDS = float(os.getenv("AUCTION_RESCAN_SECONDS", "30"))
+CLOSE_BATCH_SIZE = int(os.getenv("AUCTION_CLOSE_BATCH", "100"))
+
+
+class AuctionScheduler:
+    def __init__(self, rescan_seconds=RESCAN_SECONDS, batch_size=CLOSE_BATCH_SIZE):
+        self.rescan_seconds = rescan_seconds
+        self.batch_size = batch_size
+        self._heap = []          # (end_time, crop_id)
+        self._ends = {}          # crop_id -> end_time currently scheduled
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._next_rescan = datetime.min
+
+    # -------------------- SCHEDULING --------------------
+
+    def schedule(self, crop_id, ends_at):
+        """
+        (Re)schedule one auction. A changed end time supersedes the old entry.
+        Ignored until start(): with no thread to drain it (AUCTION_SCHEDULER=0)
+        the heap would only grow.
+        """
+        if self._thread is None:
+            return
+        self._push(crop_id, ends_at)
+
+    def _push(self, crop_id, ends_at):
+        if ends_at is None:
+            return
+        crop_id = str(crop_id)
+        with self._cond:
+            if self._ends.get(crop_id) == ends_at:
+                return
+            self._ends[crop_id] = ends_at
+            heapq.heappush(self._heap, (ends_at, crop_id))
+            self._cond.notify()
+
+    def schedule_crop(self, crop):
+        self.schedule(crop["_id"], crud.auction_end_time(crop))
+
+    def rescan(self):
+        """
+        Load open auctions ending before the next rescan from the database.
+        """
+        horizon = datetime.utcnow() + timedelta(seconds=self.rescan_seconds * 2)
+        for crop_id, ends_at in crud.get_open_auctions(ending_before=horizon):
+            self._push(crop_id, ends_at)
+        self._next_rescan = datetime.utcnow() + timedelta(seconds=self.rescan_seconds)
+
+    def pending(self):
+        with self._cond:
+            return len(self._ends)
+
+    # -------------------- CLOSING --------------------
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            ends_at, crop_id = heapq.heappop(self._heap)
+            if self._ends.get(crop_id) != ends_at:
+                continue  # superseded by a reschedule
+            del self._ends[crop_id]
+            due.append(crop_id)
+        return due
+
+    def run_once(self, now=None):
+        """
+        Close every auction that is due. Returns the closed results.
+        """
+        now = now or datetime.utcnow()
+        results = []
+        while True:
+            with self._cond:
+                due = self._pop_due(now)
+            if not due:
+                return results
+            try:
+                closed = crud.close_auctions(due)
+            except Exception as e:
+                print("Auction close failed, retrying later:", e)
+                retry_at = now + timedelta(seconds=5)
+                for crop_id in due:
+                    self._push(crop_id, retry_at)
+                return results
+            for result in closed:
+                broker.publish(crop_topic(result["crop_id"]), "auction_closed", result)
+            results.extend(closed)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                now = datetime.utcnow()
+                wake = self._next_rescan
+                if self._heap:
+                    wake = min(wake, self._heap[0][0])
+                if wake > now:
+                    self._cond.wait(timeout=(wake - now).total_seconds())
+                    continue
+            if datetime.utcnow() >= self._next_rescan:
+                try:
+                    self.rescan()
+                except Exception as e:
+                    print("Auction rescan failed:", e)
+                    self._next_rescan = datetime.utcnow() + timedelta(seconds=self.rescan_seconds)
+            self.run_once()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._loop, name="auction-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._cond:
+            self._heap.clear()
+            self._ends.clear()
+
+
+scheduler = AuctionScheduler()
+
+# ------------------ END OF scheduler.py ------------------
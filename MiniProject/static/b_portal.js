@@ -13,16 +13,28 @@ let searchInput = null;
 let filterBtn = null;
 let locationInput = null;
 const countdownIntervals = {}; // track timers by crop id
+let liveStreams = []; // SSE subscriptions for the displayed crops, one per ID_CHUNK of them
+let bidPollTimer = null; // one batched /api/current_bids poll for all cards
+let loadMoreBtn = null;
+let nextCursor = null; // X-Next-Cursor of the last catalog page; null once all are loaded
+let cropsLoading = false;
+let cropsRequest = 0; // bumped by every catalog fetch so a stale page is dropped
+let cropFilter = { location: "", name: "" }; // search sent with every catalog page
+let searchTimer = null;
+const CROP_PAGE_SIZE = 24;
+const ID_CHUNK = 500; // crops per /api/stream or /api/current_bids request (server limit)
 
 // -------------------- UTILITIES --------------------
 function getIdOf(x) { return x?._id || x?.id || x?.crop_id || ""; }
 function getName(x) { return x?.name || x?.crop_name || "Unnamed"; }
 function getFarmer(x) { return x?.farmer_name || x?.farmer || x?.uploaded_by_name || "Farmer"; }
 function getImage(x) { return x?.image || (x?.images && x.images[0]) || "/static/default_crop.jpg"; }
+function getThumb(x) { return x?.thumbnail || getImage(x); }
 function formatDT(dt) { try { return new Date(dt).toLocaleString(); } catch { return dt || "-"; } }
 function auctionEndTs(item) { const t = new Date(item.datetime).getTime(); return isNaN(t) ? null : t + 5*60*1000; }
 function isAuctionOpen(item) { const end = auctionEndTs(item); return end===null ? true : Date.now()<end; }
 function safeJSONParse(s,fallback=null){try{return JSON.parse(s);}catch{return fallback;}}
+function chunked(list,size){ const out=[]; for(let i=0;i<list.length;i+=size) out.push(list.slice(i,i+size)); return out; }
 
 // -------------------- CURRENT USER & LOCAL WISHLIST --------------------
 function loadSessionData(){
@@ -33,19 +45,40 @@ function saveWishlist(){ localStorage.setItem("wishlist",JSON.stringify(wishlist
 function updateWishlistCount(){ if(wishlistCountEl) wishlistCountEl.textContent = wishlist.length; }
 
 // -------------------- FETCH CROPS & WON CROPS --------------------
-async function fetchCrops(){
+// The catalog is keyset paginated: one page per request, the cursor of the
+// next one comes back in X-Next-Cursor. fetchCrops() reloads the first page,
+// fetchCrops(true) appends the next ("Load more", or scrolling down to it).
+// The location / name search is applied by the server (see applyFilter()).
+async function fetchCrops(more=false){
+    if(more && (!nextCursor || cropsLoading)) return;
+    const seq = ++cropsRequest;
+    cropsLoading = true;
     try{
-        const res = await fetch("/api/crops");
-        const data = await res.ok ? await res.json() : [];
-        crops = Array.isArray(data) ? data.map(c => ({ ...c, _id: getIdOf(c) })) : [];
-        displayCrops(crops.filter(c=>{
-            const status = (c.status||"").toLowerCase();
-            const end = auctionEndTs(c);
-            return !(status==="closed"||status==="sold"||(end && Date.now()>=end));
-        }));
-    } catch(e){ console.error("fetchCrops error:",e); if(cropsContainer)cropsContainer.innerHTML=`<p style="color:red;">Error loading crops.</p>`; }
+        const qs = new URLSearchParams({ sold: "false", include_bids: "1", limit: CROP_PAGE_SIZE });
+        if(cropFilter.location) qs.set("location", cropFilter.location);
+        if(cropFilter.name) qs.set("name", cropFilter.name);
+        if(more) qs.set("cursor", nextCursor);
+        const res = await fetch(`/api/crops?${qs}`);
+        if(!res.ok) throw new Error(`HTTP ${res.status}`);
+        const data = await res.json();
+        if(seq !== cropsRequest) return;
+        const page = Array.isArray(data) ? data.map(c => {
+            const bid = c.highest_bid?.bid_price;
+            return { ...c, _id: getIdOf(c), price: bid && bid > (c.price ?? 0) ? bid : c.price };
+        }) : [];
+        crops = more ? crops.concat(page) : page;
+        nextCursor = res.headers.get("X-Next-Cursor");
+        showOpenCrops();
+    } catch(e){
+        console.error("fetchCrops error:",e);
+        if(!more && seq === cropsRequest && cropsContainer) cropsContainer.innerHTML=`<p style="color:red;">Error loading crops.</p>`;
+    } finally{
+        if(seq === cropsRequest){ cropsLoading = false; updateLoadMore(); }
+    }
 }
 
+function updateLoadMore(){ if(loadMoreBtn) loadMoreBtn.style.display = nextCursor ? "block" : "none"; }
+
 async function fetchWonCrops(){
     try{
         const res = await fetch("/api/won-crops",{credentials:'include'});
@@ -74,8 +107,9 @@ function displayCrops(list){
 
         const card = document.createElement("div");
         card.className="crop-card";
+        card.dataset.id=id;
         card.innerHTML=`
-          <img src="${getImage(item)}" alt="${getName(item)}" class="crop-img"/>
+          <img src="${getThumb(item)}" alt="${getName(item)}" class="crop-img" loading="lazy" onerror="this.onerror=null;this.src='${getImage(item)}'"/>
           <div class="crop-info">
             <h3 class="crop-title">${getName(item)}</h3>
             <p>Price: ₹<span class="price">${item.price??0}</span></p>
@@ -119,6 +153,50 @@ function displayCrops(list){
     });
 
     updateWishlistCount();
+    subscribeLive(list);
+}
+
+// -------------------- LIVE UPDATES (SSE) --------------------
+function subscribeLive(list){
+    liveStreams.forEach(s=>s.close());
+    liveStreams=[];
+    if(!window.EventSource) return;
+
+    chunked(list.map(getIdOf).filter(Boolean), ID_CHUNK).forEach(ids=>{
+        const stream=new EventSource(`/api/stream?crops=${ids.map(encodeURIComponent).join(",")}`);
+        stream.cropIds=ids;
+        stream.addEventListener("bid",e=>{
+            const data=safeJSONParse(e.data,{});
+            showBidPrice(data.crop_id, data.bid_price);
+        });
+        stream.addEventListener("auction_closed",()=>{ fetchWonCrops(); });
+        // browser retries on its own; its crops are only polled once it gives up
+        stream.onerror=()=>{ if(stream.readyState===EventSource.CLOSED) liveStreams=liveStreams.filter(s=>s!==stream); };
+        liveStreams.push(stream);
+    });
+}
+
+function showBidPrice(id, bidPrice){
+    const item=crops.find(c=>getIdOf(c)===id);
+    if(item && bidPrice>(item.price??0)){
+        item.price=bidPrice;
+        const priceEl=document.querySelector(`.crop-card[data-id="${id}"] .price`);
+        if(priceEl) priceEl.innerText=bidPrice;
+    }
+}
+
+// Polling fallback for running auctions no stream covers: one request per ID_CHUNK
+async function pollCurrentBids(){
+    const live=new Set(liveStreams.flatMap(s=>s.cropIds));
+    const ids=Object.keys(countdownIntervals).filter(id=>!live.has(id));
+    await Promise.all(chunked(ids, ID_CHUNK).map(async part=>{
+        try{
+            const res=await fetch(`/api/current_bids?ids=${part.map(encodeURIComponent).join(",")}`,{credentials:'include'});
+            if(!res.ok) return;
+            const bids=await res.json();
+            Object.entries(bids).forEach(([id,bid])=>{ if(bid) showBidPrice(id, bid.bid_price); });
+        } catch(err){ console.warn("Live bid fetch failed:",err); }
+    }));
 }
 
 // -------------------- UTILITIES --------------------
@@ -300,17 +378,7 @@ function startCountdownFor(item){
             const m=Math.floor(diff/60000);
             const s=Math.floor((diff%60000)/1000);
             el.innerText=`⏰ Time Left: ${m}m ${s}s`;
-
-            // Live current bid
-            fetch(`/api/current_bid/${id}`,{credentials:'include'})
-                .then(r=>r.json())
-                .then(data=>{
-                    if(data.bid_price && data.bid_price>item.price){
-                        item.price=data.bid_price;
-                        el.previousElementSibling.querySelector(".price").innerText=data.bid_price;
-                    }
-                })
-                .catch(err=>console.warn("Live bid fetch failed:",err));
+            // live current bid: SSE, or the batched pollCurrentBids()
         } else {
             el.innerText="🔒 Bidding Closed";
             clearInterval(countdownIntervals[id]);
@@ -328,14 +396,8 @@ async function finalizeAuction(item){
         const res=await fetch(`/api/auction/winner/${item._id}`,{credentials:'include'});
         if(res.ok){
             const winnerData=await res.json();
-            // If current user won → save
+            // The server records the win when it closes the auction
             if(String(winnerData.user_id)===String(currentUser.id||currentUser._id)){
-                await fetch("/api/save_won_crop",{
-                    method:"POST",
-                    headers:{"Content-Type":"application/json"},
-                    credentials:'include',
-                    body:JSON.stringify({ user_id:currentUser.id||currentUser._id, crop_id:item._id, farmer_id:item.farmer_id||item.farmer, bid_price:winnerData.bid_price??item.price })
-                });
                 alert(`🎉 You won "${getName(item)}" at ₹${winnerData.bid_price}`);
             }
         }
@@ -386,18 +448,23 @@ function openChat(cropId){
 }
 
 // -------------------- SEARCH & FILTER --------------------
+// A changed search starts over from the first page, so it covers the whole
+// catalog rather than the pages loaded so far
 function applyFilter(){
-    const loc=(locationInput?.value||"").trim().toLowerCase();
-    const q=(searchInput?.value||"").trim().toLowerCase();
-    const filtered=crops.filter(c=>{
+    const next={ location: (locationInput?.value||"").trim(), name: (searchInput?.value||"").trim() };
+    if(next.location===cropFilter.location && next.name===cropFilter.name) return;
+    cropFilter=next;
+    nextCursor=null;
+    fetchCrops();
+}
+
+// Loaded crops whose auction is still running
+function showOpenCrops(){
+    displayCrops(crops.filter(c=>{
         const status=(c.status||"").toLowerCase();
-        if(status==="closed"||status==="sold") return false;
-        if(!isAuctionOpen(c)) return false;
-        if(loc && !((c.location||"").toLowerCase().includes(loc))) return false;
-        if(q && !getName(c).toLowerCase().includes(q)) return false;
-        return true;
-    });
-    displayCrops(filtered);
+        if(status==="closed"||status==="sold"||status==="expired") return false;
+        return isAuctionOpen(c);
+    }));
 }
 
 // -------------------- INIT --------------------
@@ -409,6 +476,7 @@ document.addEventListener("DOMContentLoaded",()=>{
     searchInput=document.getElementById("search");
     filterBtn=document.getElementById("filterBtn");
     locationInput=document.getElementById("locationInput");
+    loadMoreBtn=document.getElementById("loadMoreCrops");
 
     loadSessionData();
     if(!currentUser||!currentUser.email){ alert("Please login to view crops."); window.location.href="/login"; return; }
@@ -419,10 +487,17 @@ document.addEventListener("DOMContentLoaded",()=>{
     });
 
     filterBtn?.addEventListener("click",applyFilter);
-    searchInput?.addEventListener("input",applyFilter);
+    searchInput?.addEventListener("input",()=>{ clearTimeout(searchTimer); searchTimer=setTimeout(applyFilter,300); });
     locationInput?.addEventListener("keyup",e=>{if(e.key==="Enter") applyFilter();});
+    loadMoreBtn?.addEventListener("click",()=>fetchCrops(true));
+    if(loadMoreBtn && window.IntersectionObserver){
+        // the next page loads as the button scrolls into view
+        new IntersectionObserver(entries=>{ if(entries.some(e=>e.isIntersecting)) fetchCrops(true); },
+            { rootMargin: "200px" }).observe(loadMoreBtn);
+    }
 
     updateWishlistCount();
     fetchCrops();
     fetchWonCrops();
+    bidPollTimer=setInterval(pollCurrentBids,3000);
 });
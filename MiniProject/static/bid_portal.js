@@ -54,18 +54,7 @@ async function finalizeAuction() {
         const bidPrice = data.bid_price ?? currentPrice;
 
         if (String(winnerUserId) === String(currentUser.id || currentUser._id)) {
-            // Save won crop to server
-            await fetch("/api/save_won_crop", {
-                method: "POST",
-                headers: { "Content-Type": "application/json" },
-                credentials: "include",
-                body: JSON.stringify({
-                    user_id: currentUser.id || currentUser._id,
-                    crop_id: cropId,
-                    farmer_id: currentCrop.farmer_id || currentCrop.farmer,
-                    bid_price: bidPrice
-                })
-            });
+            // The server records the win when it closes the auction
             alert(`🎉 You won "${currentCrop.name}" at ₹${bidPrice}`);
         } else {
             alert(`Auction ended. Winner: ${winnerEmail} at ₹${bidPrice}`);
@@ -91,7 +80,8 @@ function updateTimer() {
     const secs = Math.floor((diff % (1000 * 60)) / 1000);
     timerEl.innerText = `Time Left: ${mins}m ${secs}s`;
 
-    // Optionally: fetch live current bid from server
+    // Fall back to polling the live current bid when the push stream is unavailable
+    if (liveStream) return;
     fetch(`/api/current_bid/${cropId}`, { credentials: "include" })
         .then(res => res.json())
         .then(data => {
@@ -103,6 +93,22 @@ function updateTimer() {
         .catch(err => console.warn("Live bid fetch failed:", err));
 }
 
+// -------------------- LIVE BID STREAM --------------------
+let liveStream = null;
+if (window.EventSource && cropId) {
+    liveStream = new EventSource(`/api/stream?crops=${encodeURIComponent(cropId)}`);
+    liveStream.addEventListener("bid", e => {
+        const data = JSON.parse(e.data);
+        if (data.bid_price && data.bid_price > currentPrice) {
+            currentPrice = data.bid_price;
+            if (currentPriceEl) currentPriceEl.innerText = currentPrice;
+        }
+    });
+    liveStream.onerror = () => {
+        if (liveStream && liveStream.readyState === EventSource.CLOSED) liveStream = null;
+    };
+}
+
 let timerInterval = setInterval(updateTimer, 1000);
 updateTimer();
 
@@ -54,18 +54,35 @@ async function loadCropInfo() {
   }
 }
 
-// Load messages periodically
+// Load messages periodically; after the first load only messages from around the
+// newest one on are requested (the server repeats a few seconds, seenIds drops them)
+let allMessages = [];
+const seenIds = new Set();
+let loadingMessages = false;
+
 async function loadMessages() {
+  if (loadingMessages) return;
+  loadingMessages = true;
   try {
     if (!receiverId) return;
 
-    const res = await fetch(`/api/messages/${cropId}`);
+    const last = allMessages.length ? allMessages[allMessages.length - 1].timestamp : null;
+    const url = last
+      ? `/api/messages/${cropId}?since=${encodeURIComponent(last)}`
+      : `/api/messages/${cropId}`;
+    const res = await fetch(url);
     if (!res.ok) throw new Error("Failed to load messages");
 
     const data = await res.json();
-    renderMessages(data);
+    const fresh = (data || []).filter(m => !seenIds.has(m._id));
+    fresh.forEach(m => seenIds.add(m._id));
+    // a message that showed up late sorts in by its time
+    allMessages = allMessages.concat(fresh).sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
+    if (fresh.length || !allMessages.length) renderMessages(allMessages);
   } catch (err) {
     console.error("Error loading messages:", err);
+  } finally {
+    loadingMessages = false;
   }
 }
 
@@ -142,6 +159,18 @@ if (backBtn) {
   const cropLoaded = await loadCropInfo();
   if (!cropLoaded) return;
 
+  // New messages are pushed over SSE; polling is a slow safety net while
+  // the stream is open and fast otherwise (refused with 503, reconnecting)
+  const FAST_POLL_MS = 2000, SLOW_POLL_MS = 15000;
+  let pollMs = FAST_POLL_MS;
+  if (window.EventSource) {
+    const live = new EventSource(`/api/stream?crops=${encodeURIComponent(cropId)}`);
+    live.addEventListener("message", () => loadMessages());
+    live.onopen = () => { pollMs = SLOW_POLL_MS; };
+    live.onerror = () => { pollMs = FAST_POLL_MS; };
+  }
   await loadMessages();
-  setInterval(loadMessages, 2000);
+  (function poll() {
+    setTimeout(() => { loadMessages(); poll(); }, pollMs);
+  })();
 })();
@@ -5,6 +5,10 @@ let fName, fType, fQuality, fPrice, fQuantity, fDateTime, fImage, fNotes, fLocat
 let imagePreviewContainer;
 let popupImageGallery, popupTitle, popupType, popupQuality, popupPrice, popupQuantity;
 let popupDateTime, popupStatus, popupSold, popupNotes, popupLocation, popupChatBtn;
+let autoLocation = null; // { text, lat, lon } last filled in from the browser
+let loadMoreBtn = null;
+let nextCursor = null; // X-Next-Cursor of the last page loaded; null once all are
+const CROP_PAGE_SIZE = 24;
 
 document.addEventListener("DOMContentLoaded", () => {
   initializeApp();
@@ -50,6 +54,7 @@ function initializeApp() {
   popupNotes = document.getElementById("popupNotes");
   popupLocation = document.getElementById("popupLocation");
   popupChatBtn = document.getElementById("chatWithBidderBtn");
+  loadMoreBtn = document.getElementById("loadMoreCrops");
 
   setupEventListeners();
   loadCropsFromServer();
@@ -57,6 +62,8 @@ function initializeApp() {
 }
 
 function setupEventListeners() {
+  if (loadMoreBtn) loadMoreBtn.addEventListener("click", () => loadCropsFromServer(true));
+
   uploadBtn.addEventListener("click", () => {
     clearForm();
     uploadForm.dataset.editingId = "";
@@ -115,6 +122,7 @@ async function autoFillLocation() {
       const lon = pos.coords.longitude.toFixed(4);
       const readable = await getReadableLocation(lat, lon);
       if (fLocation) fLocation.value = readable ? `${readable} (${lat}, ${lon})` : `${lat}, ${lon}`;
+      autoLocation = { text: fLocation ? fLocation.value : "", lat, lon };
     },
     (err) => console.warn("Location unavailable:", err)
   );
@@ -131,15 +139,39 @@ async function getReadableLocation(lat, lon) {
   }
 }
 
-async function loadCropsFromServer() {
+function currentFarmerId() {
   try {
-    const response = await fetch("/api/crops");
-    if (!response.ok) {
-      const text = await response.text();
-      throw new Error(`Failed to fetch crops: ${response.status} ${text}`);
-    }
-    const data = await response.json();
-    crops = Array.isArray(data) ? data.map((c) => ({ ...c, id: c._id || c.id })) : [];
+    return JSON.parse(localStorage.getItem("loggedInUser"))?.id || null;
+  } catch {
+    return null;
+  }
+}
+
+// One page of this farmer's crops; the catalog is keyset paginated and the
+// cursor of the next page comes back in X-Next-Cursor
+async function fetchCropPage(cursor) {
+  const qs = new URLSearchParams({ limit: CROP_PAGE_SIZE });
+  const farmerId = currentFarmerId();
+  if (farmerId) qs.set("farmer_id", farmerId);
+  if (cursor) qs.set("cursor", cursor);
+  const response = await fetch(`/api/crops?${qs}`);
+  if (!response.ok) {
+    const text = await response.text();
+    throw new Error(`Failed to fetch crops: ${response.status} ${text}`);
+  }
+  const page = await response.json();
+  return { page: Array.isArray(page) ? page : [], next: response.headers.get("X-Next-Cursor") };
+}
+
+// Reloads the first page; more = true appends the next one ("Load more")
+async function loadCropsFromServer(more = false) {
+  if (more && !nextCursor) return;
+  try {
+    const { page, next } = await fetchCropPage(more ? nextCursor : null);
+    const rows = page.map((c) => ({ ...c, id: c._id || c.id }));
+    crops = more ? crops.concat(rows) : rows;
+    nextCursor = next;
+    if (loadMoreBtn) loadMoreBtn.style.display = nextCursor ? "block" : "none";
     displayCrops();
   } catch (error) {
     console.error(error);
@@ -150,7 +182,7 @@ async function loadCropsFromServer() {
   }
 }
 
-// Updated displayCrops function: separate sold and unsold crops, show bidder info
+// Updated displayCrops function: separate sold, unsold and expired crops, show bidder info
 function displayCrops() {
   if (!cropsContainer) return;
   cropsContainer.innerHTML = "";
@@ -160,15 +192,19 @@ function displayCrops() {
     return;
   }
 
-  const unsoldCrops = crops.filter(c => !c.sold);
+  // auctions that ended without a bid are "Expired" (sold stays false)
+  const isExpired = c => !c.sold && (c.status || "").toLowerCase() === "expired";
+  const unsoldCrops = crops.filter(c => !c.sold && !isExpired(c));
+  const expiredCrops = crops.filter(isExpired);
   const soldCrops = crops.filter(c => c.sold);
 
-  // ---------------- UNSOLD CROPS ----------------
-  if (unsoldCrops.length) {
+  // ---------------- UNSOLD & EXPIRED CROPS ----------------
+  [["Available Crops", unsoldCrops], ["Expired (no bids)", expiredCrops]].forEach(([title, list]) => {
+    if (!list.length) return;
     const unsoldTitle = document.createElement("h2");
-    unsoldTitle.textContent = "Available Crops";
+    unsoldTitle.textContent = title;
     cropsContainer.appendChild(unsoldTitle);
-    unsoldCrops.forEach(crop => {
+    list.forEach(crop => {
       const cropCard = createCropCard(crop);
 
       // For unsold crops: remove chat button
@@ -180,7 +216,7 @@ function displayCrops() {
 
       cropsContainer.appendChild(cropCard);
     });
-  }
+  });
 
   // ---------------- SOLD CROPS ----------------
   if (soldCrops.length) {
@@ -232,9 +268,15 @@ function createCropCard(crop) {
 
   const img = document.createElement("img");
   img.className = "crop-image";
-  const firstImg = (crop.images && crop.images.length > 0 ? crop.images[0] : null) || crop.image || "https://via.placeholder.com/300x200?text=No+Image";
+  const firstImg = crop.thumbnail || (crop.images && crop.images.length > 0 ? crop.images[0] : null) || crop.image || "https://via.placeholder.com/300x200?text=No+Image";
   img.src = firstImg;
   img.alt = crop.name || "Unnamed crop";
+  img.loading = "lazy";
+  // thumbnails are rendered in the background right after an upload
+  const fullImg = (crop.images && crop.images[0]) || crop.image;
+  if (fullImg && fullImg !== firstImg) {
+    img.addEventListener("error", () => { img.src = fullImg; }, { once: true });
+  }
   img.addEventListener("click", () => showCropDetails(crop.id));
 
   const info = document.createElement("div");
@@ -390,6 +432,12 @@ function handleFormSubmit(e) {
     notes: fNotes.value.trim(),
   };
 
+  // coordinates only while the location is still the one the browser gave
+  if (autoLocation && autoLocation.text === cropData.location) {
+    cropData.latitude = autoLocation.lat;
+    cropData.longitude = autoLocation.lon;
+  }
+
   const formData = new FormData();
   for (const key in cropData) formData.append(key, cropData[key]);
 
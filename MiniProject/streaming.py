@@ -0,0 +1,125 @@
+# ------------------ streaming.py ------------------
+# JSON encoding for list endpoints.
+#
+# Documents are encoded one at a time as the Mongo cursor yields them and
+# sent in ~64 KiB chunks, so neither the whole result set nor the whole
+# encoded body has to be in memory. ObjectId and datetime are handled by
+# the encoder itself; documents can go out exactly as the driver returns
+# them. Naive datetimes are UTC (that is what the driver returns) and are
+# written with a +00:00 offset. Clients that send
+# `Accept: application/x-ndjson` get one document per line instead of a
+# JSON array.
+#
+# orjson is used when installed, the standard library otherwise.
+
+import json
+from datetime import date, datetime, timezone
+
+from bson.objectid import ObjectId
+from flask import Response, stream_with_context
+
+try:
+    import orjson
+except ImportError:  # the stdlib encoder produces the same output, slower
+    orjson = None
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson")
+CHUNK_SIZE = 64 * 1024
+
+
+def _default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime):
+        if obj.tzinfo is None:
+            obj = obj.replace(tzinfo=timezone.utc)
+        return obj.isoformat()
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """
+    Encode to compact JSON bytes. ObjectId becomes its hex string, datetime
+    its ISO 8601 form.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NAIVE_UTC)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def wants_ndjson(request):
+    best = request.accept_mimetypes.best_match(("application/json",) + NDJSON_TYPES)
+    return best in NDJSON_TYPES
+
+
+def encode_chunks(docs, ndjson=False, transform=None):
+    """
+    Yield the encoded body for `docs` (any iterable, typically a cursor) in
+    chunks of about CHUNK_SIZE bytes.
+    """
+    buf = bytearray(b"" if ndjson else b"[")
+    first = True
+    for doc in docs:
+        if transform is not None:
+            doc = transform(doc)
+        if ndjson:
+            buf += dumps(doc) + b"\n"
+        else:
+            if not first:
+                buf += b","
+            buf += dumps(doc)
+        first = False
+        if len(buf) >= CHUNK_SIZE:
+            yield bytes(buf)
+            buf.clear()
+    if not ndjson:
+        buf += b"]"
+    if buf:
+        yield bytes(buf)
+
+
+async def aencode_chunks(docs, ndjson=False):
+    """
+    encode_chunks() for an async iterable (async driver cursors).
+    """
+    buf = bytearray(b"" if ndjson else b"[")
+    first = True
+    async for doc in docs:
+        if ndjson:
+            buf += dumps(doc) + b"\n"
+        else:
+            if not first:
+                buf += b","
+            buf += dumps(doc)
+        first = False
+        if len(buf) >= CHUNK_SIZE:
+            yield bytes(buf)
+            buf.clear()
+    if not ndjson:
+        buf += b"]"
+    if buf:
+        yield bytes(buf)
+
+
+def encode_body(docs, ndjson=False, transform=None):
+    """
+    The whole body at once, for responses that are cached.
+    """
+    return b"".join(encode_chunks(docs, ndjson, transform))
+
+
+def content_type(ndjson):
+    return NDJSON_TYPES[0] if ndjson else "application/json"
+
+
+def stream_response(request, docs, transform=None, headers=None, status=200):
+    """
+    Streamed response for `docs` in the format the client asked for.
+    """
+    ndjson = wants_ndjson(request)
+    body = stream_with_context(encode_chunks(docs, ndjson, transform))
+    return Response(body, status=status, mimetype=content_type(ndjson), headers=headers)
+
+# ------------------ END OF streaming.py ------------------
@@ -0,0 +1,70 @@
+# ------------------ tests/conftest.py ------------------
+# The app runs against mongomock (pip install -r requirements-dev.txt):
+#
+#     python -m pytest -q
+#
+# Every test gets an empty database and empty caches. The auction scheduler
+# and the cleanup thread are never started.
+
+import os
+import sys
+
+import mongomock
+import pytest
+
+os.environ.setdefault("AUCTION_SCHEDULER", "0")
+os.environ.setdefault("CROP_CLEANUP", "0")
+os.environ.setdefault("ENSURE_INDEXES", "0")
+os.environ.setdefault("CACHE_BACKEND", "memory")
+os.environ.setdefault("REALTIME_BACKEND", "memory")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+database._client = mongomock.MongoClient()
+database._client_pid = os.getpid()
+
+import app as app_module  # noqa: E402
+import crud  # noqa: E402
+from cache import catalog_cache  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def db():
+    database._client.drop_database(database.DB_NAME)
+    catalog_cache.clear()
+    crud._username_cache.clear()
+    yield database.get_db()
+
+
+@pytest.fixture
+def app():
+    app_module.app.config["TESTING"] = True
+    return app_module.app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, user_id, role="bidder", username="tester", email="tester@example.com"):
+    """
+    Put a logged in user in the test client's session.
+    """
+    with client.session_transaction() as session:
+        session["logged_in_user"] = {"id": str(user_id), "username": username, "role": role, "email": email}
+
+
+@pytest.fixture
+def make_crop(db):
+    """
+    make_crop(**fields) -> ObjectId of a new open crop.
+    """
+    def make(**fields):
+        crop = crud.prepare_crop({"name": "Wheat", "price": 100, "quantity": 10, "location": "Mandya",
+                                  "datetime": "2030-01-01T00:00:00Z", **fields})
+        return db.crops.insert_one(crop).inserted_id
+    return make
+
+# ------------------ END OF tests/conftest.py ------------------
@@ -0,0 +1,121 @@
+# ------------------ tests/test_auctions.py ------------------
+# Closing auctions: close_auctions() and /api/auction/winner/<crop_id>.
+
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+import crud
+import migrations
+from scheduler import AuctionScheduler
+from test_bids import bid
+
+B1, B2 = str(ObjectId()), str(ObjectId())  # bidders are user ids
+
+
+def test_close_with_a_bid(db, make_crop):
+    crop_id = make_crop()
+    bid(crop_id, 50, B1)
+    closed = crud.close_auctions([crop_id])
+    assert closed == [{"crop_id": str(crop_id), "user_id": B1, "bidder_email": f"{B1}@example.com",
+                       "bid_price": 50.0}]
+    crop = db.crops.find_one({"_id": crop_id})
+    assert (crop["status"], crop["sold"], crop["sold_price"]) == ("Closed", True, 50.0)
+    assert db.won_crops.count_documents({}) == 1
+    assert db.auction_winners.count_documents({"crop_id": crop_id}) == 1
+
+
+def test_close_without_bids_expires(db, make_crop):
+    crop_id = make_crop()
+    assert crud.close_auctions([crop_id]) == [{"crop_id": str(crop_id), "user_id": None,
+                                               "bidder_email": None, "bid_price": None}]
+    crop = db.crops.find_one({"_id": crop_id})
+    assert (crop["status"], crop["sold"]) == ("Expired", False)
+    assert db.won_crops.count_documents({}) == 0
+
+
+def test_expired_crops_are_not_listed_as_open(client, make_crop):
+    open_id, expired_id, sold_id = make_crop(), make_crop(), make_crop()
+    bid(sold_id, 50)
+    crud.close_auctions([expired_id, sold_id])
+    assert crud.build_crop_query(sold=False) == {"sold": {"$ne": True}, "status": {"$nin": crud.CLOSED_STATUSES}}
+    listed = {c["_id"] for c in client.get("/api/crops?sold=false").get_json()}
+    assert listed == {str(open_id)}
+    listed = {c["_id"] for c in client.get("/api/crops?sold=true").get_json()}
+    assert listed == {str(sold_id)}
+
+
+def test_close_migration(db, make_crop):
+    due = make_crop(datetime="2020-01-01T00:00:00Z")
+    bid(due, 50)
+    stale = make_crop(datetime="2020-01-01T00:00:00Z")
+    running = make_crop(datetime=datetime.utcnow().isoformat())
+    assert migrations.close_due_auctions() == 2
+    assert migrations.close_due_auctions() == 0
+    assert [db.crops.find_one({"_id": c})["status"] for c in (due, stale)] == ["Closed", "Expired"]
+    assert db.crops.find_one({"_id": running}).get("status") not in crud.CLOSED_STATUSES
+
+
+def test_close_is_idempotent(db, make_crop):
+    crop_id = make_crop()
+    bid(crop_id, 50, B1)
+    assert len(crud.close_auctions([crop_id])) == 1
+    assert crud.close_auctions([crop_id]) == []
+    assert crud.close_auctions([str(crop_id), "bad-id"]) == []
+    assert db.won_crops.count_documents({}) == 1
+    assert db.auction_winners.count_documents({}) == 1
+
+
+def test_no_bids_to_a_closed_crop(make_crop):
+    crop_id = make_crop()
+    crud.close_auctions([crop_id])
+    assert bid(crop_id, 50)["status"] == crud.BID_CLOSED
+
+
+def test_bid_between_read_and_close_wins(db, make_crop, monkeypatch):
+    crop_id = make_crop()
+    bid(crop_id, 50, B1)
+    read_bids = crud.get_current_bids
+
+    def outbid_after_read(*args, **kwargs):
+        bids = read_bids(*args, **kwargs)
+        if db.crops.find_one({"_id": crop_id})["current_bid"] == 50:
+            bid(crop_id, 80, B2)
+        return bids
+
+    monkeypatch.setattr(crud, "get_current_bids", outbid_after_read)
+    closed = crud.close_auctions([crop_id])
+    assert [(c["user_id"], c["bid_price"]) for c in closed] == [(B2, 80.0)]
+    assert db.crops.find_one({"_id": crop_id})["winner_id"] == B2
+    assert [str(w["user_id"]) for w in db.won_crops.find()] == [B2]
+
+
+def test_closed_elsewhere_writes_nothing(db, make_crop, monkeypatch):
+    crop_id = make_crop()
+    bid(crop_id, 50)
+    read_bids = crud.get_current_bids
+
+    def closed_by_another_worker(*args, **kwargs):
+        bids = read_bids(*args, **kwargs)
+        db.crops.update_one({"_id": crop_id}, {"$set": {"status": "Closed", "sold": True}})
+        return bids
+
+    monkeypatch.setattr(crud, "get_current_bids", closed_by_another_worker)
+    assert crud.close_auctions([crop_id]) == []
+    assert db.won_crops.count_documents({}) == 0
+    assert db.auction_winners.count_documents({}) == 0
+
+
+def test_scheduler_ignores_crops_until_started(db):
+    auctions = AuctionScheduler(rescan_seconds=3600)
+    auctions.schedule(ObjectId(), datetime(2030, 1, 1))
+    assert auctions.pending() == 0  # AUCTION_SCHEDULER=0: nothing would drain it
+    auctions.start()
+    try:
+        auctions.schedule(ObjectId(), datetime(2030, 1, 1))
+        assert auctions.pending() == 1
+    finally:
+        auctions.stop()
+    assert auctions.pending() == 0
+
+# ------------------ END OF tests/test_auctions.py ------------------
@@ -0,0 +1,75 @@
+# ------------------ tests/test_bids.py ------------------
+# The bid engine: place_bid()'s compare-and-set and the /api/place_bid route.
+
+from bson.objectid import ObjectId
+
+import crud
+
+
+def bid(crop_id, price, bidder="b1"):
+    return crud.place_bid({"crop_id": str(crop_id), "bidder_id": bidder,
+                           "bidder_email": f"{bidder}@example.com", "bid_price": price})
+
+
+def test_first_bid_is_accepted(db, make_crop):
+    crop_id = make_crop()
+    assert bid(crop_id, 50) == {"status": crud.BID_ACCEPTED, "current_bid": 50.0}
+    crop = db.crops.find_one({"_id": crop_id})
+    assert (crop["current_bid"], crop["current_bidder_id"], crop["bid_count"]) == (50.0, "b1", 1)
+
+
+def test_lower_or_equal_bid_is_too_low(db, make_crop):
+    crop_id = make_crop()
+    bid(crop_id, 50)
+    assert bid(crop_id, 50, "b2") == {"status": crud.BID_TOO_LOW, "current_bid": 50.0}
+    assert bid(crop_id, 40, "b2") == {"status": crud.BID_TOO_LOW, "current_bid": 50.0}
+    crop = db.crops.find_one({"_id": crop_id})
+    assert (crop["current_bid"], crop["current_bidder_id"], crop["bid_count"]) == (50.0, "b1", 1)
+
+
+def test_higher_bid_replaces_current(db, make_crop):
+    crop_id = make_crop()
+    bid(crop_id, 50)
+    assert bid(crop_id, 60, "b2")["status"] == crud.BID_ACCEPTED
+    assert crud.get_current_bid(crop_id)["bidder_id"] == "b2"
+
+
+def test_closed_and_sold_crops_reject_bids(make_crop):
+    assert bid(make_crop(status="Closed"), 50)["status"] == crud.BID_CLOSED
+    assert bid(make_crop(sold=True), 50)["status"] == crud.BID_CLOSED
+
+
+def test_invalid_and_unknown(make_crop):
+    assert bid("not-an-id", 50)["status"] == crud.BID_INVALID
+    assert bid(make_crop(), 0)["status"] == crud.BID_INVALID
+    assert bid(make_crop(), "abc")["status"] == crud.BID_INVALID
+    assert bid(ObjectId(), 50)["status"] == crud.BID_NOT_FOUND
+
+
+def test_every_attempt_is_recorded(db, make_crop):
+    crop_id = make_crop()
+    bid(crop_id, 50)
+    bid(crop_id, 40, "b2")
+    history = list(db.bid_history.find({"crop_id": crop_id}).sort("bid_price", -1))
+    assert [(h["bid_price"], h["accepted"]) for h in history] == [(50.0, True), (40.0, False)]
+
+
+def test_reconcile_rebuilds_crop_fields(db, make_crop):
+    crop_id = make_crop()
+    bid(crop_id, 50)
+    bid(crop_id, 70, "b2")
+    db.crops.update_one({"_id": crop_id}, {"$unset": {"current_bid": "", "current_bidder_id": ""}})
+    crud.reconcile_bid_fields([crop_id])
+    crop = db.crops.find_one({"_id": crop_id})
+    assert (crop["current_bid"], crop["current_bidder_id"]) == (70.0, "b2")
+
+
+def test_place_bid_route(client, make_crop):
+    crop_id = str(make_crop())
+    body = {"crop_id": crop_id, "bidder_id": "b1", "bidder_email": "b1@example.com", "bid_price": 50}
+    assert client.post("/api/place_bid", json=body).status_code == 200
+    assert client.post("/api/place_bid", json=body).status_code == 400
+    assert client.post("/api/place_bid", json={**body, "crop_id": str(ObjectId())}).status_code == 404
+    assert client.post("/api/place_bid", json={"crop_id": crop_id}).status_code == 400
+
+# ------------------ END OF tests/test_bids.py ------------------
@@ -0,0 +1,83 @@
+# ------------------ tests/test_cache.py ------------------
+# The catalog cache: read-through, invalidation on every crop write, ETags,
+# and the multi-process guard.
+
+import pytest
+
+import crud
+from cache import catalog_cache, require_shared_cache
+from test_bids import bid
+
+
+def names(response):
+    return sorted(c["name"] for c in response.get_json())
+
+
+def test_listing_is_served_from_cache_until_a_write(client, db, make_crop):
+    make_crop(name="Wheat")
+    assert names(client.get("/api/crops")) == ["Wheat"]
+    # behind the API's back: the cached page is still served
+    db.crops.insert_one(crud.prepare_crop({"name": "Hidden"}))
+    assert names(client.get("/api/crops")) == ["Wheat"]
+    # any crop write moves the catalog to a new generation
+    crud.create_crop({"name": "Barley"})
+    assert names(client.get("/api/crops")) == ["Barley", "Hidden", "Wheat"]
+
+
+def test_bids_invalidate_listings_and_the_crop(client, make_crop):
+    crop_id = make_crop()
+    first = client.get("/api/crops?include_bids=1").get_json()[0]
+    assert first.get("highest_bid") is None
+    crud.get_crop(str(crop_id))  # cache the single crop too
+    bid(crop_id, 50)
+    assert client.get("/api/crops?include_bids=1").get_json()[0]["highest_bid"]["bid_price"] == 50.0
+    assert crud.get_crop(str(crop_id))["current_bid"] == 50.0
+
+
+def test_closing_invalidates(client, make_crop):
+    crop_id = make_crop()
+    assert len(client.get("/api/crops?sold=false").get_json()) == 1
+    crud.close_auctions([crop_id])
+    assert client.get("/api/crops?sold=false").get_json() == []
+
+
+def test_etag_revalidation(client, make_crop):
+    make_crop()
+    first = client.get("/api/crops")
+    etag = first.headers["ETag"]
+    again = client.get("/api/crops", headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.data == b""
+    crud.create_crop({"name": "Barley"})
+    assert client.get("/api/crops", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_disabled_cache_stores_nothing(client, make_crop, monkeypatch):
+    monkeypatch.setattr(catalog_cache, "enabled", False)
+    make_crop(name="Wheat")
+    client.get("/api/crops")
+    crud.db.crops.insert_one(crud.prepare_crop({"name": "Direct"}))
+    assert names(client.get("/api/crops")) == ["Direct", "Wheat"]
+
+
+@pytest.mark.parametrize("env, processes, ok", [
+    ({}, 1, True),
+    ({}, 4, False),
+    ({"CACHE_BACKEND": "fakeredis"}, 4, False),
+    ({"CACHE_BACKEND": "redis"}, 4, True),
+    ({"CATALOG_CACHE": "0"}, 4, True),
+    ({}, None, False),  # asgi.py: the process count is unknown
+    ({"CATALOG_CACHE_LOCAL": "1"}, None, True),
+    ({"CACHE_BACKEND": "redis"}, None, True),
+])
+def test_several_processes_need_a_shared_cache(monkeypatch, env, processes, ok):
+    for name in ("CACHE_BACKEND", "CATALOG_CACHE", "CATALOG_CACHE_LOCAL"):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    if ok:
+        require_shared_cache(processes)
+    else:
+        with pytest.raises(RuntimeError, match="CACHE_BACKEND=redis"):
+            require_shared_cache(processes)
+
+# ------------------ END OF tests/test_cache.py ------------------
@@ -0,0 +1,97 @@
+# ------------------ tests/test_crops.py ------------------
+# Crop writes: create and partial edits through the routes; catalog pages.
+
+import pytest
+from bson.objectid import ObjectId
+
+from conftest import login
+
+
+def test_partial_edit_keeps_other_fields(client, db, make_crop):
+    crop_id = make_crop(price=120, quantity=7, location="Mysuru (12.30, 76.64)")
+    before = db.crops.find_one({"_id": crop_id})
+    assert before["geo"]["coordinates"] == [76.64, 12.3]
+
+    response = client.put(f"/api/crops/{crop_id}", json={"name": "Red rice"})
+    assert response.status_code == 200
+    after = db.crops.find_one({"_id": crop_id})
+    assert after["name"] == "Red rice"
+    for field in ("price", "quantity", "location", "geo"):
+        assert after[field] == before[field], field
+
+
+def test_edit_normalizes_what_it_sends(client, db, make_crop):
+    crop_id = make_crop(location="Mysuru (12.30, 76.64)")
+    client.put(f"/api/crops/{crop_id}", data={"price": "99.5", "location": "Hassan"})
+    crop = db.crops.find_one({"_id": crop_id})
+    assert (crop["price"], crop["location"]) == (99.5, "Hassan")
+    assert "geo" not in crop  # moved somewhere without coordinates
+
+
+def test_crop_writes_go_through_the_model(client, db, make_crop):
+    crop_id = make_crop()
+    response = client.put(f"/api/crops/{crop_id}", json={"bid_count": "many"})
+    assert response.status_code == 400 and "Crop.bid_count" in response.get_json()["error"]
+    response = client.post("/api/crops", json={"name": "Ragi", "farmer_name": ["x"]})
+    assert response.status_code == 400 and "Crop.farmer_name" in response.get_json()["error"]
+    assert db.crops.count_documents({}) == 1
+
+    client.put(f"/api/crops/{crop_id}", json={"bid_count": 3.0, "farmer_email": "a@b"})
+    crop = db.crops.find_one({"_id": crop_id})
+    assert crop["bid_count"] == 3 and type(crop["bid_count"]) is int
+    assert crop["farmer_email"] == "a@b"  # undeclared fields are kept
+
+
+def test_edit_unknown_crop(client):
+    assert client.put(f"/api/crops/{ObjectId()}", json={"name": "x"}).status_code == 404
+
+
+def test_create_from_form(client, db):
+    farmer = ObjectId()
+    login(client, farmer, role="farmer", username="Asha")
+    response = client.post("/api/crops", data={"name": "Ragi", "price": "40", "location": "12.5, 76.5",
+                                               "datetime": "2030-01-01T00:00:00Z"})
+    assert response.status_code in (200, 201)
+    crop = db.crops.find_one({"name": "Ragi"})
+    assert crop["price"] == 40.0 and crop["geo"]["coordinates"] == [76.5, 12.5]
+
+
+def test_catalog_pages_follow_the_cursor(client, make_crop):
+    # two crops share a datetime, so the page break falls on the _id tie-break
+    ids = [make_crop(name=f"c{i}", datetime=f"2030-01-0{1 + i // 2}T00:00:00Z") for i in range(5)]
+    seen, cursor, pages = [], None, 0
+    while True:
+        response = client.get("/api/crops?limit=2" + (f"&cursor={cursor}" if cursor else ""))
+        assert response.status_code == 200
+        seen += [c["_id"] for c in response.get_json()]
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert pages == 3
+    # newest first on (datetime, _id), every crop exactly once
+    assert seen == [str(i) for i in reversed(ids)]
+
+
+def test_catalog_filters_by_farmer(client, make_crop):
+    mine = make_crop(farmer_id="f1")
+    make_crop(farmer_id="f2")
+    rows = client.get("/api/crops?farmer_id=f1").get_json()
+    assert [c["_id"] for c in rows] == [str(mine)]
+
+
+def test_catalog_search_reaches_past_the_first_page(client, make_crop):
+    make_crop(name="Red Chilli", location="Guntur (16.30, 80.45)", datetime="2029-01-01T00:00:00Z")
+    for i in range(3):
+        make_crop(name=f"Wheat {i}")
+    assert [c["name"] for c in client.get("/api/crops?limit=2&location=guntur").get_json()] == ["Red Chilli"]
+    assert [c["name"] for c in client.get("/api/crops?limit=2&name=chil").get_json()] == ["Red Chilli"]
+
+
+@pytest.mark.parametrize("cursor", ["bogus", "e30", "%00"])
+def test_catalog_rejects_a_bad_cursor(client, cursor):
+    response = client.get(f"/api/crops?cursor={cursor}")
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid cursor"}
+
+# ------------------ END OF tests/test_crops.py ------------------
@@ -0,0 +1,74 @@
+# ------------------ tests/test_geo.py ------------------
+# Crop positions and distance search: coordinate parsing, the ?near=
+# parameters and the $geoNear pipeline (mongomock has no $geoNear, so the
+# query itself is not run here).
+
+import pytest
+from pymongo.errors import OperationFailure
+
+import app as app_module
+from crud import crop_near_pipeline, geo_point, parse_lat_lon, split_near_page
+
+
+@pytest.mark.parametrize("location, expected", [
+    ("Mysuru (12.30, 76.64)", (12.3, 76.64)),
+    ("12.5, 76.5", (12.5, 76.5)),
+    ("-33.86,151.21", (-33.86, 151.21)),
+    ("Mysuru", None),
+    ("12, 76", None),  # needs decimals
+    ("95.0, 76.5", None),  # latitude out of range
+    (None, None),
+])
+def test_parse_lat_lon(location, expected):
+    assert parse_lat_lon(location) == expected
+
+
+def test_geo_point():
+    assert geo_point("12.5", 76.5) == {"type": "Point", "coordinates": [76.5, 12.5]}
+    for lat, lon in ((91, 0), (0, 181), ("x", 0), (None, 0)):
+        with pytest.raises(ValueError):
+            geo_point(lat, lon)
+
+
+def test_create_takes_explicit_coordinates(db, make_crop):
+    crop_id = make_crop(location="Hassan", latitude="13.0", longitude="76.1")
+    assert db.crops.find_one({"_id": crop_id})["geo"]["coordinates"] == [76.1, 13.0]
+
+
+@pytest.mark.parametrize("query", [
+    "near=12.3", "near=abc,76", "near=95,76", "within=10", "near=12.3,76.6&within=0",
+    "near=12.3,76.6&within=100000", "near=12.3,76.6&cursor=bogus",
+])
+def test_near_rejects_bad_parameters(client, query):
+    response = client.get(f"/api/crops?{query}")
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_near_pipeline_pages_from_the_cursor():
+    pipeline, limit = crop_near_pipeline({"sold": {"$ne": True}}, (12.3, 76.6), 25, limit=2)
+    geo_near = pipeline[0]["$geoNear"]
+    assert geo_near["near"]["coordinates"] == [76.6, 12.3]
+    assert geo_near["maxDistance"] == 25000 and geo_near["query"] == {"sold": {"$ne": True}}
+    assert pipeline[-1] == {"$limit": 3}
+
+    docs = [{"_id": f"{i:024x}", "_distance": 1000.0 * i} for i in range(1, 4)]
+    page, cursor = split_near_page(docs, limit)
+    assert [c["distance_km"] for c in page] == [1.0, 2.0]
+
+    pipeline, _ = crop_near_pipeline(None, (12.3, 76.6), None, cursor=cursor, limit=2)
+    assert pipeline[0]["$geoNear"]["minDistance"] == 2000.0
+    assert "query" not in pipeline[0]["$geoNear"]
+    assert "$or" in pipeline[1]["$match"]
+
+
+def test_near_without_geo_index_is_503(client, monkeypatch):
+    def refuse(*args, **kwargs):
+        raise OperationFailure("unable to find index for $geoNear query", code=291)
+
+    monkeypatch.setattr(app_module, "get_crops_page", refuse)
+    response = client.get("/api/crops?near=12.3,76.6")
+    assert response.status_code == 503
+    assert response.get_json() == {"error": "Distance search is unavailable right now"}
+
+# ------------------ END OF tests/test_geo.py ------------------
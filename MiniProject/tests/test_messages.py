@@ -0,0 +1,74 @@
+# ------------------ tests/test_messages.py ------------------
+# Chat messages: POST /api/messages and GET /api/messages/<crop_id>.
+
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+
+import crud
+
+
+def post(client, crop_id, sender, receiver, text="hello"):
+    return client.post("/api/messages", json={"crop_id": str(crop_id), "sender_id": str(sender),
+                                              "receiver_id": str(receiver), "message": text})
+
+
+def test_send_message(client, db):
+    crop_id, alice, bob = ObjectId(), ObjectId(), ObjectId()
+    assert post(client, crop_id, alice, bob).status_code == 201
+    assert db.messages.find_one()["message"] == "hello"
+
+
+def test_send_message_with_bad_ids_is_rejected(client, db):
+    assert post(client, "not-an-id", ObjectId(), ObjectId()).status_code == 400
+    assert post(client, ObjectId(), "nobody", ObjectId()).status_code == 400
+    assert client.post("/api/messages", json={"crop_id": str(ObjectId())}).status_code == 400
+    assert db.messages.count_documents({}) == 0
+
+def texts(response):
+    return [m["message"] for m in response.get_json()]
+
+
+def test_since_repeats_the_overlap_window(client, db):
+    crop_id, alice, bob = ObjectId(), ObjectId(), ObjectId()
+    t0 = datetime(2030, 1, 1, 12, 0, 0)
+    db.messages.insert_many([
+        {"crop_id": crop_id, "sender_id": alice, "receiver_id": bob, "message": "old", "timestamp": t0},
+        {"crop_id": crop_id, "sender_id": bob, "receiver_id": alice, "message": "newest",
+         "timestamp": t0 + timedelta(seconds=60)},
+    ])
+    assert texts(client.get(f"/api/messages/{crop_id}")) == ["old", "newest"]
+
+    # written by another worker, stamped before `newest` but visible only now
+    db.messages.insert_one({"crop_id": crop_id, "sender_id": alice, "receiver_id": bob, "message": "late",
+                            "timestamp": t0 + timedelta(seconds=58)})
+    since = (t0 + timedelta(seconds=60)).isoformat() + "Z"
+    assert texts(client.get(f"/api/messages/{crop_id}", query_string={"since": since})) == ["late", "newest"]
+    # older clients send the last _id; it is read as its creation time
+    last_id = ObjectId.from_datetime(t0 + timedelta(seconds=60))
+    assert "late" in texts(client.get(f"/api/messages/{crop_id}?since={last_id}"))
+
+
+def test_since_query():
+    query = crud.message_query(str(ObjectId()), since="2030-01-01T05:30:00+05:30")
+    assert query["timestamp"] == {"$gte": datetime(2030, 1, 1) - timedelta(seconds=crud.MESSAGE_SINCE_OVERLAP)}
+    assert crud.message_query("bad") is None
+    with pytest.raises(ValueError):
+        crud.message_query(str(ObjectId()), since="yesterday")
+
+
+def test_bad_since_is_a_400(client):
+    assert client.get(f"/api/messages/{ObjectId()}?since=yesterday").status_code == 400
+
+
+def test_indexes_match_the_since_query(db):
+    db.messages.create_index([("crop_id", 1), ("_id", 1)])
+    crud.ensure_indexes()
+    keys = [info["key"] for info in db.messages.index_information().values()]
+    assert [("crop_id", 1), ("_id", 1)] not in keys
+    assert [("crop_id", 1), ("timestamp", 1), ("_id", 1)] in keys
+    since = crud.message_query(str(ObjectId()), "2030-01-01T00:00:00Z")
+    assert set(since) == {"crop_id", "timestamp"}
+
+# ------------------ END OF tests/test_messages.py ------------------
@@ -0,0 +1,50 @@
+# ------------------ tests/test_models.py ------------------
+# The model codec (models.py).
+
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+from models import Bid, Crop, ModelError, User
+
+
+def test_round_trip_keeps_unknown_keys():
+    doc = {"_id": ObjectId(), "name": "Rice", "price": 10, "legacy_field": 1}
+    crop = Crop.from_bson(doc)
+    assert crop.price == 10.0 and crop.status == "Available" and crop.images == []
+    out = crop.to_bson()
+    assert out["legacy_field"] == 1 and out["_id"] == doc["_id"]
+    assert "geo" not in out and "current_bid" not in out  # optional and None
+
+
+def test_defaults_are_built_per_instance():
+    first, second = Crop.from_bson({}), Crop.from_bson({})
+    first.images.append("x")
+    assert second.images == []
+    assert isinstance(first.datetime, datetime)
+
+
+def test_errors_name_the_field():
+    with pytest.raises(ModelError, match=r"Crop\.price"):
+        Crop.from_bson({"price": "cheap"})
+    with pytest.raises(ModelError, match=r"User\.email is required"):
+        User(username="a", password=b"x")
+    with pytest.raises(ModelError, match=r"Bid\.crop_id"):
+        Bid(crop_id="not-an-id", bidder_id="b", bid_price=1)
+    with pytest.raises(ModelError, match=r"Crop\._id"):
+        Crop.from_bson({"_id": "bad"})
+
+
+def test_unknown_keyword_is_a_type_error():
+    with pytest.raises(TypeError):
+        Bid(crop_id=ObjectId(), bidder_id="b", bid_price=1, colour="red")
+
+
+def test_conversions():
+    bid = Bid(crop_id=str(ObjectId()), bidder_id=ObjectId(), bid_price="12.5",
+              timestamp="2030-01-01T05:30:00+05:30")
+    assert isinstance(bid.crop_id, ObjectId) and isinstance(bid.bidder_id, str)
+    assert bid.bid_price == 12.5 and bid.timestamp == datetime(2030, 1, 1)
+
+# ------------------ END OF tests/test_models.py ------------------
@@ -0,0 +1,97 @@
+# ------------------ tests/test_realtime.py ------------------
+# Live updates: the broker, the Flask /api/stream slots and the ASGI stream.
+
+import asyncio
+import threading
+
+import app as app_module
+import asgi
+from realtime import Broker, RedisBackend, broker, crop_topic
+
+
+def test_stream_validates_crops(client):
+    assert client.get("/api/stream").status_code == 400
+    ids = ",".join(str(i) for i in range(app_module.STREAM_MAX_TOPICS + 1))
+    assert client.get(f"/api/stream?crops={ids}").status_code == 400
+
+
+def test_flask_streams_are_capped(client):
+    responses = [client.get("/api/stream?crops=a", buffered=False) for _ in range(app_module.SSE_MAX_STREAMS)]
+    assert [r.status_code for r in responses] == [200] * app_module.SSE_MAX_STREAMS
+    busy = client.get("/api/stream?crops=a")
+    assert busy.status_code == 503 and busy.headers["Retry-After"]
+    for response in responses:
+        response.close()
+    assert broker.subscriber_count() == 0
+    second = client.get("/api/stream?crops=a", buffered=False)
+    assert second.status_code == 200
+    second.close()
+
+
+def test_asgi_stream_delivers_and_unsubscribes():
+    async def run():
+        sent, disconnect = [], asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+            if b"event: bid" in message.get("body", b""):
+                disconnect.set()
+
+        scope = {"type": "http", "method": "GET", "path": "/api/stream", "query_string": b"crops=c1",
+                 "headers": []}
+        serving = asyncio.ensure_future(asgi.app(scope, receive, send))
+        while broker.subscriber_count() == 0:
+            await asyncio.sleep(0.01)
+        # published from another thread, as a Flask route or the Redis listener would
+        threading.Thread(target=broker.publish, args=(crop_topic("c1"), "bid", {"bid_price": 5})).start()
+        await asyncio.wait_for(serving, 5)
+        return sent
+
+    sent = asyncio.run(run())
+    assert sent[0]["status"] == 200
+    assert dict(sent[0]["headers"])[b"content-type"] == b"text/event-stream"
+    body = b"".join(m.get("body", b"") for m in sent[1:])
+    assert b"event: bid" in body and b'"bid_price": 5' in body
+    assert broker.subscriber_count() == 0
+
+
+class FakeRedis:
+    """
+    Records pub/sub use; the listener sees no messages and returns.
+    """
+
+    def __init__(self):
+        self.pubsubs, self.published = [], []
+
+    def pubsub(self, **kwargs):
+        self.pubsubs.append(self)
+        return self
+
+    def psubscribe(self, pattern):
+        pass
+
+    def listen(self):
+        return iter(())
+
+    def close(self):
+        pass
+
+    def publish(self, channel, payload):
+        self.published.append(channel)
+
+
+def test_redis_listener_starts_with_the_first_subscription():
+    redis = FakeRedis()
+    redis_broker = Broker(RedisBackend(client=redis))
+    redis_broker.publish(crop_topic("c1"), "bid", {})
+    assert redis.published == ["cropconnect:crop:c1"] and redis.pubsubs == []
+    redis_broker.subscribe([crop_topic("c1")]).close()
+    redis_broker.subscribe([crop_topic("c2")]).close()
+    assert len(redis.pubsubs) == 1
+    redis_broker.close()
+
+# ------------------ END OF tests/test_realtime.py ------------------
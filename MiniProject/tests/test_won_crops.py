@@ -0,0 +1,72 @@
+# ------------------ tests/test_won_crops.py ------------------
+# won_crops / auction_winners: one schema (models.WonCrop / AuctionWinner)
+# for every writer, the bidder's routes and the migration of old rows.
+
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+import crud
+import migrations
+from conftest import login
+from test_bids import bid
+
+
+def test_closing_writes_the_model_shape(db, make_crop):
+    bidder = ObjectId()
+    crop_id = make_crop(farmer_id="f1")
+    bid(crop_id, 50, str(bidder))
+    crud.close_auctions([crop_id])
+    won = db.won_crops.find_one()
+    assert (won["user_id"], won["crop_id"], won["farmer_id"], won["bid_price"]) == (bidder, crop_id, "f1", 50.0)
+    assert isinstance(won["won_at"], datetime) and "datetime" not in won
+    winner = db.auction_winners.find_one()
+    assert (winner["user_id"], winner["bidder_email"]) == (bidder, f"{bidder}@example.com")
+    assert crud.get_auction_winner(crop_id)["user_id"] == str(bidder)
+
+
+def test_won_crops_routes(client, db, make_crop):
+    bidder = ObjectId()
+    first, second = make_crop(name="First"), make_crop(name="Second")
+    for crop_id in (first, second):
+        bid(crop_id, 50, str(bidder))
+        crud.close_auctions([crop_id])
+    login(client, bidder)
+    rows = client.get("/api/won-crops").get_json()
+    assert [r["crop"]["name"] for r in rows] == ["Second", "First"]  # newest first
+
+    assert client.delete(f"/api/delete_won_bid/{first}?user_id={bidder}").get_json() == {"success": True}
+    assert [r["crop"]["name"] for r in client.get("/api/won-crops").get_json()] == ["Second"]
+
+
+def test_save_won_crop_route(client, db):
+    user_id, crop_id = ObjectId(), ObjectId()
+    body = {"user_id": str(user_id), "crop_id": str(crop_id), "farmer_id": "f1", "bid_price": "75"}
+    assert client.post("/api/save_won_crop", json=body).status_code == 200
+    assert client.post("/api/save_won_crop", json={**body, "bid_price": 80}).status_code == 200
+    rows = list(db.won_crops.find())
+    assert len(rows) == 1 and rows[0]["user_id"] == user_id and rows[0]["bid_price"] == 80.0
+    assert client.post("/api/save_won_crop", json={**body, "user_id": "nobody"}).status_code == 400
+
+
+def test_migration_converts_old_rows(db):
+    user_id, crop_id, other_crop = ObjectId(), ObjectId(), ObjectId()
+    when = datetime(2030, 1, 1)
+    db.won_crops.insert_many([
+        {"user_id": str(user_id), "crop_id": str(crop_id), "bid_price": 10, "datetime": when},
+        # string twin of a row already in the new shape
+        {"user_id": str(user_id), "crop_id": str(other_crop), "bid_price": 20, "datetime": when},
+        {"user_id": user_id, "crop_id": other_crop, "bid_price": 20.0, "won_at": when},
+        {"user_id": "guest", "crop_id": str(crop_id), "bid_price": 5},
+    ])
+    db.auction_winners.insert_one({"crop_id": crop_id, "user_id": str(user_id), "bid_price": 10.0})
+
+    assert migrations.migrate_won_crops() == 3
+    assert migrations.migrate_won_crops() == 0
+    rows = list(db.won_crops.find({"user_id": user_id}).sort("crop_id", 1))
+    assert [(r["crop_id"], r["won_at"]) for r in rows] == sorted([(crop_id, when), (other_crop, when)])
+    assert all("datetime" not in r for r in rows)
+    assert db.won_crops.count_documents({"user_id": "guest"}) == 1  # not an ObjectId: left alone
+    assert db.auction_winners.find_one()["user_id"] == user_id
+
+# ------------------ END OF tests/test_won_crops.py ------------------
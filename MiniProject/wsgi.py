@@ -0,0 +1,15 @@
+# ------------------ wsgi.py ------------------
+# WSGI entry point for production servers:
+#
+#     gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Importing it starts nothing; the server's post-fork hooks call
+# app.start_background() and app.warm_up() in each worker (see
+# gunicorn.conf.py). Other servers must do the same per worker process.
+# The polling endpoints can also be served by the async API (asgi.py).
+
+from app import configure_app
+
+app = configure_app()
+
+# ------------------ END OF wsgi.py ------------------